@@ -2,24 +2,326 @@
 Access (query/create/delete/manage) items, databases and collections in Azure Cosmos SQL Databases
 """
 
-__all__ = ["CosmosClient", "Database", "Container", "Item"]
+__all__ = [
+    "CosmosClient",
+    "Database",
+    "Container",
+    "Item",
+    "PreparedQuery",
+    "PatchOperation",
+    "HedgingPolicy",
+    "Scheduler",
+    "PriorityClass",
+    "RequestShed",
+    "CircuitBreakers",
+    "CircuitOpen",
+    "CancellationToken",
+    "DeadlineExceeded",
+    "OperationCancelled",
+    "LocalReplica",
+    "User",
+    "Permission",
+]
 
 
 from internal.cosmos.errors import HTTPFailure
 
-from typing import Any, List, Iterable, Optional, Dict, Union, Tuple, cast, overload
+from typing import Any, Callable, List, Iterable, Optional, Dict, Union, Tuple, cast, overload
 
+import copy
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 
+from internal.cosmos import auth as _auth
+from internal.cosmos import base as _base
+from internal.cosmos import documents as _documents
+from internal.cosmos import request_object as _request_object
+from internal.cosmos import synchronized_request as _synchronized_request
 from internal.cosmos.cosmos_client import CosmosClient as _CosmosClient
 from internal.cosmos.errors import HTTPFailure
 
+from . import deadlines as _deadlines
+from . import patch as _patch
+from . import profiling as _profiling
+from . import scheduling as _scheduling
+from . import signing as _signing
+from .batching import BufferedWriter
+from .breaker import CircuitBreakers, CircuitOpen
+from .caching import ChangeFeedInvalidator, LRUCache, QueryResultCache
+from .concurrency import ConflictStats, SingleFlight, backoff_delay
+from .compression import compress_fields, decompress_value, is_compressed
+from .deadlines import CancellationToken, DeadlineExceeded, OperationCancelled, cancellable
+from .export import ExportStats, export_container
+from .hedging import HedgingPolicy
+from .indexing import IndexingRecommendation, WorkloadRecorder
+from .merge import CrossPartitionMerge
+from .partitions import PartitionStats, PartitionTracker, analyze_partition_key, is_range_gone
+from .patch import PatchOperation
+from .permissions import Permission, ResourceTokenCache, permission_mode, resource_link
+from .profiling import Profiler, profiled
+from .query import PreparedQuery, QueryPlan
+from .replica import LocalReplica, UnsupportedQuery
+from .scheduling import PriorityClass, RequestShed, Scheduler, prioritized
+from .signing import MasterKeySigner
+from .transport import CosmosSession
+
 
 class ClientContext(_CosmosClient):
-    pass
+    def __init__(
+        self,
+        url_connection,
+        auth,
+        connection_policy=None,
+        consistency_level="Session",
+        *,
+        query_plan_cache_size: "int" = 256,
+        compress_requests_over: "Optional[int]" = None,
+        hedging: "Optional[HedgingPolicy]" = None,
+        coalesce_reads: "bool" = False,
+        scheduler: "Optional[Scheduler]" = None,
+        track_partitions: "bool" = False,
+        circuit_breakers: "Optional[CircuitBreakers]" = None,
+    ):
+        # Response headers are tracked per thread, so that a client can be shared by concurrent callers
+        self._thread_state = threading.local()
+        # Master key signatures are computed from a prepared HMAC, and reused within a date window
+        _signing.install(_auth)
+        master_key = (auth or {}).get("masterKey")
+        self.signer = MasterKeySigner(master_key) if master_key else None
+        super().__init__(
+            url_connection,
+            auth,
+            connection_policy=connection_policy,
+            consistency_level=consistency_level,
+        )
+        # Client-wide cache of query plans, keyed on query text
+        self.query_plans = LRUCache(query_plan_cache_size)
+        # Concurrent identical reads share one request if set
+        self.single_flight = SingleFlight() if coalesce_reads else None
+        # Per-phase timing of operations, if enabled
+        self.profiler = None  # type: Optional[Profiler]
+        # Resource tokens of users, if cached
+        self.token_cache = None  # type: Optional[ResourceTokenCache]
+
+        # Swap in our own session, keeping the adapters and proxies configured from the connection policy
+        transport = CosmosSession(
+            compress_requests_over=compress_requests_over,
+            hedging=hedging,
+            scheduler=scheduler,
+            partitions=PartitionTracker() if track_partitions else None,
+            breakers=circuit_breakers,
+        )
+        transport.adapters.update(self._requests_session.adapters)
+        transport.proxies.update(self._requests_session.proxies)
+        transport.enable_cancellation()
+        self._requests_session = transport
+
+    @property
+    def transport(self) -> "CosmosSession":
+        return self._requests_session
+
+    @property
+    def scheduler(self) -> "Optional[Scheduler]":
+        return self._requests_session.scheduler
+
+    def enable_profiling(self, profiler: "Profiler"):
+        """ Start timing the phases of operations with `profiler`. """
+        # Only this client's (and other profiled clients') calls are timed
+        _profiling.instrument_serialization(_synchronized_request)
+        _profiling.instrument(_auth, "GetAuthorizationHeader", "sign")
+        self.transport.enable_profiling()
+        self.profiler = profiler
+
+    def coalesce(self, key, fn):
+        """ Call `fn`, sharing the call with concurrent callers using the same key if reads are coalesced. """
+        if self.single_flight is None:
+            return fn()
+        return self.single_flight.do(key, fn)
+
+    @property
+    def last_response_headers(self):
+        return getattr(self._thread_state, "last_response_headers", None)
+
+    @last_response_headers.setter
+    def last_response_headers(self, headers):
+        self._thread_state.last_response_headers = headers
+
+    def QueryItemsPage(
+        self, collection_link, query=None, options=None, partition_key_range_id=None
+    ):
+        """ Fetch a single page of documents.
+
+        :param str collection_link: The link to the document collection.
+        :param (str or dict) query: The query to run. If None, all documents are read.
+        :param dict options: The request options for the request, including the continuation token.
+        :param str partition_key_range_id: Only read from this partition key range.
+        :return: Tuple of (documents, response headers).
+        """
+        path = _base.GetPathFromLink(collection_link, "docs")
+        collection_id = _base.GetResourceIdOrFullNameFromLink(collection_link)
+        return self.QueryFeed(
+            path, collection_id, query, options or {}, partition_key_range_id
+        )
+
+    def PatchItem(self, document_link, operations, options=None):
+        """ Apply partial update operations to a document and return the updated document.
+
+        :param str document_link: The link to the document.
+        :param list operations: The patch operations, see :class:`PatchOperation`.
+        :param dict options: The request options for the request.
+        """
+        if options is None:
+            options = {}
+        path = _base.GetPathFromLink(document_link)
+        document_id = _base.GetResourceIdOrFullNameFromLink(document_link)
+        headers = _base.GetHeaders(
+            self, self.default_headers, "patch", path, document_id, "docs", options
+        )
+        request = _request_object._RequestObject("docs", _documents._OperationType.Update)
+        result, self.last_response_headers = _synchronized_request.SynchronizedRequest(
+            self,
+            request,
+            self._global_endpoint_manager,
+            self.connection_policy,
+            self._requests_session,
+            "PATCH",
+            path,
+            dict(operations=operations),
+            query_params=None,
+            headers=headers,
+        )
+        self._UpdateSessionIfRequired(headers, result, self.last_response_headers)
+        return result
 
 
 class User:
-    pass
+    """
+    Represents a user of an Azure Cosmos :class:`Database`, and the permissions granting it access to
+    resources through resource tokens.
+    """
+
+    def __init__(
+        self,
+        client_context: "ClientContext",
+        database_link: "str",
+        id: "str",
+        properties: "Optional[Dict[str, Any]]" = None,
+    ):
+        self.client_context = client_context
+        self.id = id
+        self.user_link = f"{database_link}/users/{id}"
+        self.properties = properties
+
+    def _get_permission_link(self, permission_or_id: "Union[Permission, str]") -> "str":
+        return getattr(
+            permission_or_id,
+            "permission_link",
+            f"{self.user_link}/permissions/{permission_or_id}",
+        )
+
+    @staticmethod
+    def _permission_body(
+        id: "str", resource, mode: "str", partition_key: "Optional[Any]"
+    ) -> "Dict[str, Any]":
+        body = dict(id=id, permissionMode=permission_mode(mode), resource=resource_link(resource))
+        if partition_key is not None:
+            body["resourcePartitionKey"] = [partition_key]
+        return body
+
+    @cancellable
+    @profiled
+    def create_permission(
+        self,
+        id: "str",
+        resource,
+        mode: "str" = "read",
+        partition_key: "Optional[Any]" = None,
+    ) -> "Permission":
+        """ Grant the user access to `resource`, and everything below it.
+
+        :param id: Id of the permission.
+        :param resource: A :class:`Container` or :class:`Database`, or the link of a resource.
+        :param mode: 'read' or 'all'.
+        :param partition_key: If given, only grant access to the items with this partition key.
+        """
+        properties = self.client_context.CreatePermission(
+            self.user_link, self._permission_body(id, resource, mode, partition_key)
+        )
+        return Permission(self.user_link, properties)
+
+    @cancellable
+    @profiled
+    def upsert_permission(
+        self,
+        id: "str",
+        resource,
+        mode: "str" = "read",
+        partition_key: "Optional[Any]" = None,
+    ) -> "Permission":
+        """ Create or replace a permission; see :func:`User.create_permission`. """
+        properties = self.client_context.UpsertPermission(
+            self.user_link, self._permission_body(id, resource, mode, partition_key)
+        )
+        return Permission(self.user_link, properties)
+
+    @cancellable
+    @profiled
+    def get_permission(
+        self,
+        permission: "Union[Permission, str]",
+        expiry_seconds: "Optional[int]" = None,
+    ) -> "Permission":
+        """ Read a permission, with a fresh resource token.
+
+        :param expiry_seconds: Requested lifetime of the token. Defaults to the service's (one hour).
+        """
+        options = {} if expiry_seconds is None else dict(resourceTokenExpirySeconds=expiry_seconds)
+        read_at = time.time()
+        properties = self.client_context.ReadPermission(
+            self._get_permission_link(permission), options
+        )
+        return Permission(self.user_link, properties, expiry_seconds, read_at)
+
+    @cancellable
+    @profiled
+    def list_permissions(self, expiry_seconds: "Optional[int]" = None) -> "Iterable[Permission]":
+        """ Read the user's permissions, with fresh resource tokens; see :func:`User.get_permission`. """
+        options = {} if expiry_seconds is None else dict(resourceTokenExpirySeconds=expiry_seconds)
+        read_at = time.time()
+        yield from [
+            Permission(self.user_link, properties, expiry_seconds, read_at)
+            for properties in self.client_context.ReadPermissions(self.user_link, options)
+        ]
+
+    @cancellable
+    @profiled
+    def delete_permission(self, permission: "Union[Permission, str]"):
+        self.client_context.DeletePermission(self._get_permission_link(permission))
+        token_cache = self.client_context.token_cache
+        if token_cache is not None:
+            token_cache.invalidate(self)
+
+    def get_resource_token(self, resource, partition_key: "Optional[Any]" = None) -> "str":
+        """ A resource token granting the user access to `resource`, to hand to the user.
+
+        Tokens come from the client's resource token cache, if enabled (see
+        :func:`CosmosClient.enable_resource_token_cache`), and are otherwise read from the service.
+
+        :param resource: A :class:`Container` or :class:`Database`, or the link of a resource.
+        :param partition_key: If given, the partition key the token must give access to.
+        :raises LookupError: If the user has no permission on the resource.
+        """
+        token_cache = self.client_context.token_cache
+        if token_cache is not None:
+            return token_cache.token(self, resource, partition_key)
+        link = resource_link(resource)
+        matches = [p for p in self.list_permissions() if p.covers(link, partition_key)]
+        if not matches:
+            raise LookupError(f"User {self.user_link} has no permission on {link}")
+        return max(matches, key=lambda p: len(p.resource_link)).token
 
 
 class CosmosClient:
@@ -28,10 +330,33 @@ class CosmosClient:
     This client is used to configure and execute requests in the Azure Cosmos DB database service.
     """
 
-    def __init__(self, url: "str", key, consistency_level="Session"):
+    def __init__(
+        self,
+        url: "str",
+        key,
+        consistency_level="Session",
+        *,
+        compress_requests_over: "Optional[int]" = None,
+        hedging: "Optional[HedgingPolicy]" = None,
+        coalesce_reads: "bool" = False,
+        scheduler: "Optional[Scheduler]" = None,
+        track_partitions: "bool" = False,
+        circuit_breakers: "Optional[CircuitBreakers]" = None,
+    ):
         """ Instantiate a new CosmosClient.
 
         :param url: The URL of the cosmos account. 
+        :param compress_requests_over: If set, gzip request bodies of at least this many bytes.
+        :param hedging: If set, slow reads are hedged according to this policy.
+        :param coalesce_reads: If set, concurrent identical reads of items, containers and queries share a single request.
+            Statistics are available from `client_context.single_flight.stats()`.
+        :param scheduler: If set, requests are admitted by priority class, see :func:`CosmosClient.priority`
+            and :func:`Container.with_priority`. Statistics are available from `client_context.scheduler.stats()`.
+        :param track_partitions: If set, requests, request charge and throttling are tracked per partition key
+            and partition key range of every container, see :func:`Container.partition_stats`.
+        :param circuit_breakers: If set, requests to an endpoint that is failing or slow fail fast (or reads are
+            rerouted) until trial requests succeed again. Breaker states and transitions are available from
+            `circuit_breakers.stats()`.
 
         >>> import os
         >>> ACCOUNT_KEY = os.environ['ACCOUNT_KEY']
@@ -41,13 +366,127 @@ class CosmosClient:
 
         """
         self.client_context = ClientContext(
-            url, dict(masterKey=key), consistency_level=consistency_level
+            url,
+            dict(masterKey=key),
+            consistency_level=consistency_level,
+            compress_requests_over=compress_requests_over,
+            hedging=hedging,
+            coalesce_reads=coalesce_reads,
+            scheduler=scheduler,
+            track_partitions=track_partitions,
+            circuit_breakers=circuit_breakers,
         )
 
+    def priority(self, name: "str"):
+        """ Send the requests made by the current thread within a `with` block with priority class `name`.
+
+        .. code-block:: python
+
+            with client.priority('background'):
+                for item in items:
+                    container.upsert_item(item)
+
+        """
+        if self.client_context.scheduler is None:
+            raise ValueError("Priorities require a client created with a scheduler")
+        self.client_context.scheduler._class_of(name)
+        return _scheduling.priority(name)
+
+    def deadline(
+        self,
+        timeout: "Optional[float]" = None,
+        cancellation: "Optional[CancellationToken]" = None,
+    ):
+        """ Complete the operations of the current thread within a `with` block in `timeout` seconds,
+        or until `cancellation` is cancelled, including their retries, backoff and page fetches.
+
+        Operations fail with :class:`DeadlineExceeded` or :class:`OperationCancelled` otherwise. Every
+        client, database and container operation also accepts `timeout` and `cancellation` keyword
+        arguments, for a deadline of its own.
+
+        .. code-block:: python
+
+            with client.deadline(timeout=request.time_left()):
+                item = container.get_item('item1')
+                related = list(container.query_items('SELECT * FROM c WHERE c.parent = "item1"'))
+
+        """
+        return _deadlines.deadline(timeout, cancellation)
+
+    def enable_profiling(
+        self,
+        sample_rate: "float" = 1.0,
+        exporter: "Optional[Callable[[_profiling.Span], None]]" = None,
+    ) -> "Profiler":
+        """ Time where operations spend their time: serializing, signing, sending, waiting and decoding.
+
+        :param sample_rate: Fraction (0-1) of operations to profile.
+        :param exporter: Called with the :class:`azure.cosmos.profiling.Span` of every profiled operation,
+            e.g. :class:`azure.cosmos.profiling.OpenTelemetryExporter`.
+        :returns: The profiler, whose `stats()` has the mean time per phase of every operation type.
+
+        .. code-block:: python
+
+            client.enable_profiling(sample_rate=0.1)
+            ...
+            print(client.profile_report())
+
+        """
+        profiler = Profiler(sample_rate=sample_rate, exporter=exporter)
+        self.client_context.enable_profiling(profiler)
+        return profiler
+
+    def disable_profiling(self):
+        self.client_context.profiler = None
+
+    def enable_resource_token_cache(
+        self,
+        expiry_seconds: "int" = 3600,
+        refresh_before: "float" = 0.25,
+        idle_timeout: "Optional[float]" = None,
+    ) -> "ResourceTokenCache":
+        """ Cache the resource tokens handed out by :func:`User.get_resource_token`, and refresh them in the
+        background before they expire, so that handing out a token doesn't wait on the service.
+
+        :param expiry_seconds: Requested lifetime of the tokens, in seconds (600 to 18000).
+        :param refresh_before: Fraction (0-1) of a token's lifetime before its expiry at which it is refreshed.
+        :param idle_timeout: Seconds after a user last asked for a token that its tokens stop being refreshed.
+            Defaults to `expiry_seconds`.
+        :returns: The cache, which exposes hit/miss/refresh counters through `stats()`.
+
+        .. code-block:: python
+
+            client.enable_resource_token_cache(expiry_seconds=3600)
+            tenant = client.get_database('db').get_user(tenant_id)
+            token = tenant.get_resource_token(client.get_database('db').get_container('orders'))
+
+        """
+        self.disable_resource_token_cache()
+        self.client_context.token_cache = ResourceTokenCache(
+            self.client_context,
+            expiry_seconds=expiry_seconds,
+            refresh_before=refresh_before,
+            idle_timeout=idle_timeout,
+        )
+        return self.client_context.token_cache
+
+    def disable_resource_token_cache(self):
+        if self.client_context.token_cache is not None:
+            self.client_context.token_cache.close()
+        self.client_context.token_cache = None
+
+    def profile_report(self) -> "str":
+        """ Mean elapsed and CPU time per phase of every profiled operation type, as a table. """
+        if self.client_context.profiler is None:
+            return "Profiling is not enabled"
+        return self.client_context.profiler.report()
+
     @staticmethod
     def _get_database_link(database_or_id: "Union[str, Database]") -> "str":
         return getattr(database_or_id, "database_link", f"dbs/{database_or_id}")
 
+    @cancellable
+    @profiled
     def create_database(self, id: "str", fail_if_exists: "bool" = False) -> "Database":
         """ Create a new database with the given name (id)
 
@@ -75,6 +514,8 @@ class CosmosClient:
                 raise
         return self.get_database(id)
 
+    @cancellable
+    @profiled
     def get_database(self, database: "Union[str, Database]") -> "Database":
         """
         Retreive the existing database with the id (name) `id`. 
@@ -86,6 +527,8 @@ class CosmosClient:
         properties = self.client_context.ReadDatabase(database_link)
         return DatabaseReference(self.client_context, properties["id"], properties)
 
+    @cancellable
+    @profiled
     def get_database_properties(self, database: "Union[Database, str]"):
         """
         Get the database properties 
@@ -97,6 +540,8 @@ class CosmosClient:
         properties = self.client_context.ReadDatabase(database_link)
         return properties
 
+    @cancellable
+    @profiled
     def list_databases(self, query: "Optional[str]" = None) -> "Iterable[Database]":
         """
         List databases in the Cosmos SQL Database Account. 
@@ -114,6 +559,8 @@ class CosmosClient:
                 for properties in self.client_context.ReadDatabases()
             ]
 
+    @cancellable
+    @profiled
     def delete_database(self, database: "Union[Database, str]"):
         """
         Delete the database with the given id (name).
@@ -152,6 +599,8 @@ class Database:
             f"{self.database_link}/colls/{container_or_id}",
         )
 
+    @cancellable
+    @profiled
     def create_container(
         self,
         id,
@@ -216,6 +665,8 @@ class Database:
     def delete_container(self, container: "Container"):
         ...
 
+    @cancellable
+    @profiled
     def delete_container(self, container: "Union[str, Container]"):
         """ Delete the container
 
@@ -224,6 +675,8 @@ class Database:
         collection_link = self._get_container_link(container)
         properties = self.client_context.DeleteContainer(collection_link)
 
+    @cancellable
+    @profiled
     def get_container(self, container: "Union[str, Container]") -> "Container":
         """ Get the container with the id (name) `container`. 
 
@@ -244,7 +697,10 @@ class Database:
         collection_link = getattr(
             container, "collection_link", f"{self.database_link}/colls/{container}"
         )
-        container_properties = self.client_context.ReadContainer(collection_link)
+        container_properties = self.client_context.coalesce(
+            ("ReadContainer", collection_link),
+            lambda: self.client_context.ReadContainer(collection_link),
+        )
         return ContainerReference(
             self.client_context,
             self,
@@ -252,6 +708,8 @@ class Database:
             properties=container_properties,
         )
 
+    @cancellable
+    @profiled
     def list_containers(self, query:"str"=None, parameters=None) -> "Iterable[ContainerReference]":
         """ List the containers in this database.
 
@@ -282,6 +740,8 @@ class Database:
                 )
             ]
 
+    @cancellable
+    @profiled
     def set_container_properties(
         self,
         container: "Union[str, Container]",
@@ -301,7 +761,7 @@ class Database:
                 "id": container_id,
                 "partitionKey": partition_key,
                 "indexingPolicy": indexing_policy,
-                "defaultTtl": int(default_ttl),
+                "defaultTtl": int(default_ttl) if default_ttl is not None else None,
                 "conflictResolutionPolicy": conflict_resolution_policy,
             }.items()
             if value
@@ -310,6 +770,8 @@ class Database:
         collection_link = f"{self.database_link}/colls/{container_id}"
         self.client_context.ReplaceContainer(collection_link, collection=parameters)
 
+    @cancellable
+    @profiled
     def get_container_properties(self, container) -> "Dict[str, Any]":
         """
         Get properties for the given container.
@@ -324,21 +786,54 @@ class Database:
         )
         return user_link
 
-    def create_user(self, user, options=None):
-        database = cast("Database", self)
-        return database.client_context.CreateUser(database.database_link, user, options)
+    def _user(self, properties: "Dict[str, Any]") -> "User":
+        return User(self.client_context, self.database_link, properties["id"], properties)
+
+    @cancellable
+    @profiled
+    def create_user(self, user: "Union[str, Dict[str, Any]]", options=None) -> "User":
+        """ Create a user.
+
+        :param user: Id of the user, or its body.
+        """
+        body = dict(id=user) if isinstance(user, str) else user
+        return self._user(
+            self.client_context.CreateUser(self.database_link, body, options)
+        )
+
+    @cancellable
+    @profiled
+    def upsert_user(self, user: "Union[str, Dict[str, Any]]", options=None) -> "User":
+        body = dict(id=user) if isinstance(user, str) else user
+        return self._user(
+            self.client_context.UpsertUser(self.database_link, body, options)
+        )
 
-    def get_user(self, id):
-        database = cast("Database", self)
-        return database.client_context.ReadUser(self.get_user_link(id))
+    @cancellable
+    @profiled
+    def get_user(self, user: "Union[str, User]") -> "User":
+        return self._user(self.client_context.ReadUser(self.get_user_link(user)))
 
-    def list_users(self, query=None):
-        database = cast("Database", self)
-        yield from [User(user) for user in database.client_context.ReadUsers(query)]
+    @cancellable
+    @profiled
+    def list_users(self, query: "Optional[str]" = None, parameters=None) -> "Iterable[User]":
+        if query is None:
+            users = self.client_context.ReadUsers(self.database_link)
+        else:
+            users = self.client_context.QueryUsers(
+                self.database_link,
+                query if parameters is None else dict(query=query, parameters=parameters),
+            )
+        yield from [self._user(user) for user in users]
 
-    def delete_user(self, user):
-        database = cast("Database", self)
-        database.client_context.DeleteUser(self.get_user_link(id))
+    @cancellable
+    @profiled
+    def delete_user(self, user: "Union[str, User]"):
+        user_link = self.get_user_link(user)
+        self.client_context.DeleteUser(user_link)
+        token_cache = self.client_context.token_cache
+        if token_cache is not None:
+            token_cache.invalidate(user_link)
 
 
 class DatabaseReference(Database):
@@ -353,7 +848,25 @@ class Item(dict):
     def __init__(self, headers: "Dict[str, Any]", data: "Dict[str, Any]"):
         super().__init__()
         self.response_headers = headers
-        self.update(data)
+        # Fields stored compressed (see `Container.compressed_fields`) are decoded up front, so that
+        # indexing, iterating, copying and serializing the item all see the original values
+        self.update(
+            {
+                key: decompress_value(value) if is_compressed(value) else value
+                for key, value in data.items()
+            }
+        )
+        # Serialized copy of the item as read, only kept for containers with `diff_replace` enabled
+        self._snapshot = None  # type: Optional[str]
+
+    def snapshot(self):
+        """ Remember the current state of the item, so that later changes can be sent as a patch. """
+        self._snapshot = json.dumps(self)
+
+    @property
+    def original(self) -> "Optional[Dict[str, Any]]":
+        """ The item as it was when `snapshot` was last called, or None. """
+        return None if self._snapshot is None else json.loads(self._snapshot)
 
 
 class Container:
@@ -371,6 +884,32 @@ class Container:
         self.id = id
         database_link = getattr(database, "database_link", f"dbs/{database}")
         self.collection_link = f"{database_link}/colls/{self.id}"
+        self.result_cache = None  # type: Optional[QueryResultCache]
+        # If set, replace_item sends only the changes to an item read through this container
+        self.diff_replace = False
+        # Top-level fields stored compressed on the server and decompressed when read
+        self.compressed_fields = ()  # type: Iterable[str]
+        # Conflict counters for update_item
+        self.conflict_stats = ConflictStats()
+        # Background writer that upsert/create/delete_item go through, if enabled
+        self.write_behind = None  # type: Optional[BufferedWriter]
+        # Priority class the requests made through this handle are sent with, if any
+        self.priority = None  # type: Optional[str]
+        # Recorder of query shapes and writes for indexing recommendations, if enabled
+        self.workload = None  # type: Optional[WorkloadRecorder]
+        self._partition_key_paths = None  # type: Optional[List[str]]
+
+    def _item(self, headers: "Dict[str, Any]", data: "Dict[str, Any]") -> "Item":
+        item = Item(headers=headers, data=data)
+        if self.diff_replace:
+            item.snapshot()
+        return item
+
+    def _written(self, data: "Dict[str, Any]") -> "Item":
+        headers = self.client_context.last_response_headers
+        if self.workload is not None:
+            self.workload.record_write(data, headers)
+        return self._item(headers=headers, data=data)
 
     @staticmethod
     def _document_link(item_or_link) -> "str":
@@ -378,18 +917,32 @@ class Container:
             return item_or_link
         return cast("str", cast("Item", item_or_link)["_self"])
 
-    def get_item(self, id: "str") -> "Item":
+    @cancellable
+    @profiled
+    @prioritized
+    def get_item(self, id: "str", partition_key: "Optional[Any]" = None) -> "Item":
         """
         Get the item identified by `id`
         :param str id: Id of item to retreive
+        :param partition_key: Partition key of the item, if the container is partitioned.
         :returns: Item if present.
         """
         doc_link = f"{self.collection_link}/docs/{id}"
-        result = self.client_context.ReadItem(document_link=doc_link)
-        headers = self.client_context.last_response_headers
+        options = {} if partition_key is None else {"partitionKey": partition_key}
+
+        def read():
+            result = self.client_context.ReadItem(document_link=doc_link, options=dict(options))
+            return result, self.client_context.last_response_headers
+
+        result, headers = self.client_context.coalesce(
+            ("ReadItem", doc_link, json.dumps(partition_key)), read
+        )
         self.session_token = headers.get("x-ms-session-token", self.session_token)
-        return Item(headers=headers, data=result)
+        return self._item(headers=headers, data=result)
 
+    @cancellable
+    @profiled
+    @prioritized
     def list_items(self, options=None) -> "Iterable[Item]":
         """ List all items in the collection
         """
@@ -400,6 +953,28 @@ class Container:
         headers = self.client_context.last_response_headers
         yield from [Item(headers=headers, data=item) for item in items]
 
+    def export(self, path: "str", format: "str" = "jsonl", **kwargs) -> "ExportStats":
+        """ Export all items in the container to sharded files.
+
+        Partition key ranges are read in parallel and streamed to disk page by page, so memory use does
+        not grow with the size of the container. Exporting to a directory that holds an interrupted
+        export resumes it.
+
+        :param path: Directory to export to.
+        :param format: 'jsonl' or 'parquet'.
+        :param kwargs: Additional options, see :func:`azure.cosmos.export.export_container`.
+
+        .. code-block:: python
+
+            stats = container.export('/backups/customers', format='jsonl', parallelism=16, progress=print)
+            print(f'Exported {stats.documents} items at {stats.throughput:.0f} items/s')
+
+        """
+        return export_container(self, path, format=format, **kwargs)
+
+    @cancellable
+    @profiled
+    @prioritized
     def query_items_change_feed(self, options=None):
         items = self.client_context.QueryItemsChangeFeed(
             self.collection_link, options=options
@@ -407,17 +982,60 @@ class Container:
         headers = self.client_context.last_response_headers
         yield from [Item(headers, item) for item in items]
 
+    def enable_result_cache(
+        self,
+        ttl: "float" = 60.0,
+        max_bytes: "int" = 64 * 1024 * 1024,
+        *,
+        invalidate_on_change: "bool" = False,
+        poll_interval: "float" = 1.0,
+    ) -> "QueryResultCache":
+        """ Cache the results of :func:`Container.query_items` on the client.
+
+        Results are keyed on query text, parameters, partition key and options.
+
+        :param ttl: Default number of seconds a cached result stays valid.
+        :param max_bytes: Memory budget for cached results. Least recently used results are evicted first.
+        :param invalidate_on_change: Drop all cached results whenever the container's change feed reports a
+            change. The change feed is polled by a background thread.
+        :param poll_interval: Number of seconds between change feed polls.
+        :returns: The cache, which also exposes hit/miss/request charge saved counters through `stats()`.
+        """
+        self.disable_result_cache()
+        cache = QueryResultCache(ttl=ttl, max_bytes=max_bytes)
+        if invalidate_on_change:
+            cache.invalidator = ChangeFeedInvalidator(
+                self.client_context, self.collection_link, poll_interval, on_change=cache.clear
+            )
+            cache.invalidator.start()
+        self.result_cache = cache
+        return self.result_cache
+
+    def disable_result_cache(self):
+        cache, self.result_cache = self.result_cache, None
+        if cache is not None and cache.invalidator is not None:
+            cache.invalidator.close()
+
+    @cancellable
+    @profiled
+    @prioritized
     def query_items(
         self,
         query: "str",
         parameters: "Optional[List]" = None,
         options=None,
         partition_key: "Optional[str]" = None,
+        cache_ttl: "Optional[float]" = None,
+        max_memory: "Optional[int]" = None,
     ) -> "Iterable[Item]":
         """Return any items matching the given `query`.
 
         :param query: The Azure Cosmos SQL query to run
         :param parameters: Optional array of parameters
+        :param cache_ttl: Number of seconds to cache the result for, if the result cache is enabled. Pass 0 to bypass the cache.
+        :param max_memory: Stream cross-partition ORDER BY and DISTINCT queries, merging the results of
+            the partitions on the client within about this many bytes, and spilling DISTINCT state to
+            temporary files beyond it. See :class:`CrossPartitionMerge`. Results are not cached.
 
         **Example:** find all families in the state of NY:
 
@@ -439,48 +1057,549 @@ class Container:
             )
 
         """
+        yield from self._query_items(
+            query, parameters, options, partition_key, cache_ttl, max_memory
+        )
+
+    @cancellable
+    @profiled
+    @prioritized
+    def _query_prepared(
+        self,
+        prepared: "PreparedQuery",
+        spec: "Dict[str, Any]",
+        options: "Dict[str, Any]",
+        ranges: "Optional[List[Dict[str, Any]]]",
+        max_memory: "Optional[int]",
+    ) -> "Iterable[Item]":
+        """ Run the bound query of `prepared` with its plan, and the partition key ranges it targets. """
+        plan = prepared.plan
+        if (
+            ranges is not None
+            and len(ranges) > 1
+            and self.result_cache is None
+            and not (plan.requires_merge or plan.offset)
+        ):
+            yield from self._query_ranges(prepared, spec, options)
+            return
+        yield from self._query_items(
+            spec["query"], spec["parameters"], options, None, None, max_memory, prepared.plan, ranges
+        )
+
+    def _query_ranges(
+        self, prepared: "PreparedQuery", spec: "Dict[str, Any]", options: "Dict[str, Any]"
+    ) -> "Iterable[Item]":
+        """ Run a query whose results need no merging on each of its partition key ranges in turn,
+        without asking the service for a query plan. A range that was split is read on the ranges it
+        was split into, from where it was. """
+        pending = deque((pk_range["id"], None) for pk_range in prepared.partition_key_ranges)
+        headers = {}  # type: Dict[str, Any]
+        while pending:
+            range_id, continuation = pending.popleft()
+            while True:
+                page_options = dict(options)
+                if continuation:
+                    page_options["continuation"] = continuation
+                try:
+                    page, headers = self.client_context.QueryItemsPage(
+                        self.collection_link, spec, page_options, range_id
+                    )
+                except HTTPFailure as e:
+                    if not is_range_gone(e):
+                        raise
+                    prepared.refresh()
+                    children = [
+                        (pk_range["id"], continuation)
+                        for pk_range in prepared.partition_key_ranges
+                        if range_id in pk_range.get("parents", ())
+                    ]
+                    if not children:
+                        raise
+                    pending.extendleft(reversed(children))
+                    break
+                yield from [self._item(headers, item) for item in page]
+                continuation = headers.get("x-ms-continuation")
+                if not continuation:
+                    break
+        self._record_query(spec["query"], headers)
+
+    def _query_items(
+        self,
+        query: "str",
+        parameters: "Optional[List]",
+        options,
+        partition_key: "Optional[str]",
+        cache_ttl: "Optional[float]",
+        max_memory: "Optional[int]",
+        plan: "Optional[QueryPlan]" = None,
+        ranges: "Optional[List[Dict[str, Any]]]" = None,
+    ) -> "Iterable[Item]":
+        if (
+            max_memory is not None
+            and partition_key is None
+            and "partitionKey" not in (options or {})
+            # A single range orders and deduplicates the results itself
+            and (ranges is None or len(ranges) > 1)
+        ):
+            if plan is None:
+                plan = self.client_context.query_plans.get_or_add(query, lambda: QueryPlan(query))
+            if (plan.sort_terms or plan.distinct) and not (
+                plan.aggregates or plan.group_by_paths or plan.offset
+            ):
+                merge = CrossPartitionMerge(
+                    self,
+                    query,
+                    parameters,
+                    options=options,
+                    max_memory=max_memory,
+                    plan=plan,
+                    ranges=ranges,
+                )
+                for result in merge:
+                    yield self._item(merge.last_response_headers, result)
+                self._record_query(query, merge.last_response_headers)
+                return
+
+        cache = self.result_cache
+        if cache is not None and cache_ttl != 0:
+            yield from self._query_items_cached(
+                cache, query, parameters, options, partition_key, cache_ttl
+            )
+            return
+
+        def run():
+            items = list(
+                self.client_context.QueryItems(
+                    database_or_Container_link=self.collection_link,
+                    query=query
+                    if parameters is None
+                    else dict(query=query, parameters=parameters),
+                    options=dict(options or {}),
+                    partition_key=partition_key,
+                )
+            )
+            headers = self.client_context.last_response_headers
+            self._record_query(query, headers)
+            return headers, items
+
+        headers, items = self.client_context.coalesce(
+            (
+                "QueryItems",
+                self.collection_link,
+                QueryResultCache.make_key(query, parameters, partition_key, options),
+            ),
+            run,
+        )
+        yield from [self._item(headers, item) for item in items]
+
+    def _query_items_cached(
+        self, cache, query, parameters, options, partition_key, cache_ttl
+    ) -> "Iterable[Item]":
+        key = QueryResultCache.make_key(query, parameters, partition_key, options)
+        cached = cache.get(key)
+        if cached is None:
+            # Not shared with uncached queries: only these fill the cache
+            cached = self.client_context.coalesce(
+                ("QueryItemsCached", self.collection_link, key),
+                lambda: self._fill_result_cache(
+                    cache, key, query, parameters, options, partition_key, cache_ttl
+                ),
+            )
+        headers, results = cached
+        yield from [self._item(headers, item) for item in results]
+
+    def _fill_result_cache(
+        self, cache, key, query, parameters, options, partition_key, cache_ttl
+    ):
+        # Taken before the query runs: a change seen meanwhile clears the cache and makes the
+        # results too old to store
+        generation = cache.generation
         items = self.client_context.QueryItems(
             database_or_Container_link=self.collection_link,
             query=query
             if parameters is None
             else dict(query=query, parameters=parameters),
-            options=options,
+            options=dict(options or {}),
             partition_key=partition_key,
         )
-        headers = self.client_context.last_response_headers
-        yield from [Item(headers, item) for item in items]
+        results = []
+        request_charge = 0.0
+        while True:
+            block = items.fetch_next_block()
+            headers = self.client_context.last_response_headers or {}
+            request_charge += float(headers.get("x-ms-request-charge", 0))
+            if not block:
+                break
+            results.extend(block)
+        self._record_query(query, {"x-ms-request-charge": request_charge})
+        cache.put(key, headers, results, request_charge, ttl=cache_ttl, generation=generation)
+        return headers, results
+
+    def _record_query(self, query: "str", headers: "Optional[Dict[str, Any]]"):
+        if self.workload is not None:
+            plan = self.client_context.query_plans.get_or_add(query, lambda: QueryPlan(query))
+            self.workload.record_query(plan, headers)
+
+    def enable_workload_recording(self, sample_every: "int" = 1) -> "WorkloadRecorder":
+        """ Record the shapes of queries and the documents written through this container, for
+        :func:`Container.recommend_indexing_policy`.
+
+        :param sample_every: Only inspect every n-th written document.
+        """
+        self.workload = WorkloadRecorder(sample_every=sample_every)
+        return self.workload
+
+    def disable_workload_recording(self):
+        self.workload = None
+
+    def recommend_indexing_policy(self) -> "IndexingRecommendation":
+        """ Recommend an indexing policy that indexes only the paths the recorded queries filter and order
+        on, with composite indexes for multi-path ORDER BY, and estimate the write request charge saved
+        compared to the container's current policy.
+
+        .. code-block:: python
+
+            container.enable_workload_recording()
+            ...  # run a representative workload
+            recommendation = container.recommend_indexing_policy()
+            print(recommendation)
+            container.apply_indexing_policy(recommendation.policy)
+
+        """
+        if self.workload is None:
+            raise ValueError("Workload recording is not enabled")
+        return self.workload.recommend(self.get_properties().get("indexingPolicy"))
+
+    def apply_indexing_policy(self, indexing_policy: "Dict[str, Any]"):
+        """ Replace the indexing policy of the container, keeping its other properties. """
+        properties = self.get_properties()
+        database = Database(self.client_context, self.collection_link.split("/")[1])
+        database.set_container_properties(
+            self,
+            partition_key=properties.get("partitionKey"),
+            indexing_policy=indexing_policy,
+            default_ttl=properties.get("defaultTtl"),
+            conflict_resolution_policy=properties.get("conflictResolutionPolicy"),
+        )
+
+    def prepare(self, query: "str") -> "PreparedQuery":
+        """ Prepare a (parameterized) query for repeated execution.
+
+        The query plan is looked up in (or added to) the client-wide plan cache, so preparing the
+        same query text again is cheap. Only the parameter values are bound per call.
+
+        :param query: The Azure Cosmos SQL query to prepare.
+
+        .. code-block:: python
+
+            by_account = container.prepare('SELECT * FROM root r WHERE r.AccountNumber = @account')
+            items = list(by_account.query_items({'@account': 'Account1'}))
 
+        """
+        plan = self.client_context.query_plans.get_or_add(query, lambda: QueryPlan(query))
+        return PreparedQuery(self, plan)
+
+    @cancellable
+    @profiled
+    @prioritized
     def replace_item(self, item: "Union[Item, str]", body: "Dict[str, Any]") -> "Item":
+        """ Replace the given item with `body`.
+
+        If `diff_replace` is set on the container and `item` was read through it, only the paths that
+        changed since the item was read are sent, as a patch conditional on the item's `_etag`.
+
+        :param item: The item (or link to the item) to replace.
+        :param body: The new content of the item.
+        :raises `HTTPFailure`: With status_code 412 if the item changed on the server since it was read.
+        """
         item_link = Container._document_link(item)
+        body = compress_fields(body, self.compressed_fields)
+        original = item.original if isinstance(item, Item) else None
+        options = None
+        if original is not None:
+            # Compared with the body as stored
+            original = compress_fields(original, self.compressed_fields)
+            options = {}
+            if original.get("_etag"):
+                options["accessCondition"] = dict(type="IfMatch", condition=original["_etag"])
+            operations = _patch.diff(original, body)
+            if len(operations) <= _patch.MAX_OPERATIONS:
+                if not operations:
+                    return item
+                options = self.client_context._AddPartitionKey(
+                    self.collection_link, original, options
+                )
+                data = self.client_context.PatchItem(
+                    document_link=item_link, operations=operations, options=options
+                )
+                return self._written(data)
         data = self.client_context.ReplaceItem(
-            document_link=item_link, new_document=body
+            document_link=item_link, new_document=body, options=options
+        )
+        return self._written(data)
+
+    @cancellable
+    @profiled
+    @prioritized
+    def patch_item(
+        self,
+        item: "Union[Item, str]",
+        operations: "List[Dict[str, Any]]",
+        *,
+        partition_key: "Optional[Any]" = None,
+        if_match: "Optional[str]" = None,
+    ) -> "Item":
+        """ Apply partial update operations to an item.
+
+        :param item: The item (or link to the item) to update.
+        :param operations: The operations to apply, created through :class:`PatchOperation`.
+        :param partition_key: Partition key of the item. Derived from `item` if omitted.
+        :param if_match: Only apply the operations if the item's `_etag` still has this value.
+        :raises `HTTPFailure`: With status_code 412 if `if_match` was given and the item has changed.
+
+        .. code-block:: python
+
+            container.patch_item(item, [PatchOperation.set('/firstName', 'Some Other Name')])
+
+        """
+        options = {}  # type: Dict[str, Any]
+        if if_match:
+            options["accessCondition"] = dict(type="IfMatch", condition=if_match)
+        if partition_key is not None:
+            options["partitionKey"] = partition_key
+        elif isinstance(item, Item):
+            options = self.client_context._AddPartitionKey(self.collection_link, item, options)
+        data = self.client_context.PatchItem(
+            document_link=Container._document_link(item),
+            operations=operations,
+            options=options,
         )
-        return Item(headers=self.client_context.last_response_headers, data=data)
+        return self._written(data)
+
+    @cancellable
+    @profiled
+    @prioritized
+    def update_item(
+        self,
+        id: "str",
+        partition_key: "Optional[Any]",
+        fn: "Callable[[Item], Optional[Dict[str, Any]]]",
+        *,
+        max_attempts: "int" = 10,
+        backoff: "float" = 0.01,
+        max_backoff: "float" = 1.0,
+    ) -> "Item":
+        """ Read-modify-write an item with optimistic concurrency.
+
+        The item is read, passed to `fn`, and the result is written back only if the item hasn't
+        changed on the server in the meantime (`If-Match` on its `_etag`). If it has, the whole cycle
+        is retried after a jittered, exponentially growing delay. `fn` may therefore be called
+        more than once, and should not have side effects.
+
+        Conflicts are counted in `conflict_stats`.
+
+        :param id: Id of the item to update.
+        :param partition_key: Partition key of the item, or None if the container isn't partitioned.
+        :param fn: Called with the current item. Returns the new body, or None if it modified the item in place.
+        :param max_attempts: Maximum number of read-modify-write cycles.
+        :param backoff: Base delay, in seconds, before retrying after a conflict.
+        :param max_backoff: Maximum delay, in seconds, between two attempts.
+        :raises `HTTPFailure`: With status_code 412 if the item still conflicted after `max_attempts`.
+
+        .. code-block:: python
+
+            def add_visit(item):
+                item['visits'] = item.get('visits', 0) + 1
+
+            container.update_item('item1', partition_key='Account1', fn=add_visit)
 
-    def upsert_item(self, body: "Dict[str, Any]") -> "Item":
+        """
+        doc_link = f"{self.collection_link}/docs/{id}"
+        options = {} if partition_key is None else {"partitionKey": partition_key}
+        for attempt in range(max_attempts):
+            current = self.client_context.ReadItem(document_link=doc_link, options=dict(options))
+            item = Item(headers=self.client_context.last_response_headers, data=current)
+            body = fn(item)
+            if body is None:
+                body = item
+            self.conflict_stats.record_attempt()
+            try:
+                result = self.client_context.ReplaceItem(
+                    document_link=doc_link,
+                    new_document=compress_fields(body, self.compressed_fields),
+                    options=dict(
+                        options,
+                        accessCondition=dict(type="IfMatch", condition=current["_etag"]),
+                    ),
+                )
+            except HTTPFailure as e:
+                if e.status_code != 412:
+                    raise
+                self.conflict_stats.record_conflict(id)
+                if attempt + 1 == max_attempts:
+                    self.conflict_stats.record_exhausted()
+                    raise
+                _deadlines.sleep(backoff_delay(attempt, backoff, max_backoff))
+                continue
+            self.conflict_stats.record_update()
+            return self._written(result)
+
+    @cancellable
+    @profiled
+    @prioritized
+    def upsert_item(self, body: "Dict[str, Any]") -> "Union[Item, Future]":
+        """ Insert or replace an item in the container.
+
+        :param body: A dict-like object representing the item to upsert.
+        :returns: The upserted item, or a future for it if write-behind is enabled (see :func:`Container.enable_write_behind`).
+        """
+        if self.write_behind is not None:
+            return self.write_behind.upsert(body)
+        return self._upsert_item(body)
+
+    def _upsert_item(self, body: "Dict[str, Any]") -> "Item":
+        body = compress_fields(body, self.compressed_fields)
         result = self.client_context.UpsertItem(
             database_or_Container_link=self.collection_link, document=body
         )
-        return Item(headers=self.client_context.last_response_headers, data=result)
+        return self._written(result)
 
-    def create_item(self, body: "Dict[str, Any]") -> "Item":
+    @cancellable
+    @profiled
+    @prioritized
+    def create_item(self, body: "Dict[str, Any]") -> "Union[Item, Future]":
         """ Create an item in the container.
 
         :param body: A dict-like object or string representing the item to create.
+        :returns: The created item, or a future for it if write-behind is enabled (see :func:`Container.enable_write_behind`).
         :raises `HTTPFailure`: 
 
         In order to replace an existing item, use the :func:`Collection.upsert_item` method.
 
         """
+        if self.write_behind is not None:
+            return self.write_behind.create(body)
+        return self._create_item(body)
+
+    def _create_item(self, body: "Dict[str, Any]") -> "Item":
+        body = compress_fields(body, self.compressed_fields)
         result = self.client_context.CreateItem(
             database_or_Container_link=self.collection_link, document=body
         )
-        return Item(headers=self.client_context.last_response_headers, data=result)
+        return self._written(result)
 
-    def delete_item(self, item: "Item") -> "None":
+    @cancellable
+    @profiled
+    @prioritized
+    def delete_item(self, item: "Item") -> "Optional[Future]":
+        if self.write_behind is not None:
+            return self.write_behind.delete(item)
+        self._delete_item(item)
+
+    def _delete_item(self, item: "Item") -> "None":
         document_link = Container._document_link(item)
         self.client_context.DeleteItem(document_link=document_link)
 
+    def _partition_key_path_list(self) -> "List[str]":
+        """ Paths of the container's partition key, read from the server on first use. """
+        if self._partition_key_paths is None:
+            properties = getattr(self, "properties", None) or self.get_properties()
+            self._partition_key_paths = properties.get("partitionKey", {}).get("paths", [])
+        return self._partition_key_paths
+
+    def _partition_key_of(self, body: "Dict[str, Any]") -> "Any":
+        """ The value of the container's partition key in `body`, or None. """
+        for path in self._partition_key_path_list():
+            value = body
+            for segment in path.strip("/").split("/"):
+                if not isinstance(value, dict):
+                    return None
+                value = dict.get(value, segment)
+            return value
+        return None
+
+    def get_properties(self) -> "Dict[str, Any]":
+        """ Get the properties of this container as stored on the server. """
+        return self.client_context.ReadContainer(self.collection_link)
+
+    def partition_stats(self) -> "PartitionStats":
+        """ Traffic of this container per partition key value and partition key range.
+
+        Requires a client created with `track_partitions=True`.
+
+        .. code-block:: python
+
+            stats = container.partition_stats()
+            print(stats.skew(), stats.hot_keys(5))
+
+        """
+        tracker = self.client_context.transport.partitions
+        if tracker is None:
+            raise ValueError("Partition tracking requires a client created with track_partitions=True")
+        return tracker.get(self.collection_link)
+
+    def analyze_partition_key(self, path: "str", **kwargs) -> "Dict[str, Any]":
+        """ Estimate the storage skew of the container's documents if they were partitioned on `path`.
+
+        :param path: Candidate partition key path, such as '/AccountNumber'.
+        :param kwargs: `sample_size`, `partitions` and `top`, see :func:`azure.cosmos.partitions.analyze_partition_key`.
+        """
+        return analyze_partition_key(self, path, **kwargs)
+
+    def with_priority(self, name: "str") -> "Container":
+        """ A handle to this container whose requests are sent with priority class `name`.
+
+        Requires a client created with a :class:`Scheduler`. Requests made within a
+        :func:`CosmosClient.priority` block use that block's priority instead.
+        """
+        scheduler = self.client_context.scheduler
+        if scheduler is None:
+            raise ValueError("Priorities require a client created with a scheduler")
+        scheduler._class_of(name)
+        container = copy.copy(self)
+        container.priority = name
+        return container
+
+    def enable_write_behind(self, **kwargs) -> "BufferedWriter":
+        """ Queue upserts, creates and deletes and send them in the background, in batches.
+
+        Once enabled, :func:`Container.upsert_item`, :func:`Container.create_item` and
+        :func:`Container.delete_item` return immediately with a
+        :class:`concurrent.futures.Future` for the outcome of the write. Call sites that don't
+        use the return value need no changes. Their `timeout` then bounds only queueing the write;
+        wait on the future with a timeout to bound the write itself.
+
+        :param kwargs: Batching options - `max_batch_size`, `max_batch_bytes`, `linger`, `max_buffered`
+            and `concurrency`. See :class:`azure.cosmos.batching.BufferedWriter`.
+        :returns: The writer, which also has `flush()`, `close()` and `stats()`.
+
+        .. code-block:: python
+
+            writer = container.enable_write_behind(linger=0.1)
+            for event in events:
+                container.upsert_item(event)
+            writer.flush()
+
+        """
+        self.write_behind = BufferedWriter(
+            self._write_now, self._partition_key_of, **kwargs
+        )
+        return self.write_behind
+
+    def disable_write_behind(self):
+        """ Flush all queued writes, and go back to writing synchronously. """
+        writer, self.write_behind = self.write_behind, None
+        if writer is not None:
+            writer.close()
+
+    @prioritized
+    def _write_now(self, kind: "str", argument: "Any") -> "Any":
+        if kind == "upsert":
+            return self._upsert_item(argument)
+        if kind == "create":
+            return self._create_item(argument)
+        return self._delete_item(argument)
+
     def list_stored_procedures(self, query):
         pass
 
@@ -0,0 +1,257 @@
+"""
+Write-behind buffering of item writes
+"""
+
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from typing import Any, Callable, Dict, List, Optional
+
+
+class _Operation:
+    __slots__ = ("kind", "id", "partition_key", "argument", "size", "future")
+
+    def __init__(self, kind, id, partition_key, argument, size):
+        self.kind = kind
+        self.id = id
+        self.partition_key = partition_key
+        self.argument = argument
+        self.size = size
+        self.future = Future()  # type: Future
+
+
+class BufferedWriter:
+    """ Queue item writes and send them in the background, in batches grouped by partition key.
+
+    A batch is flushed as soon as it holds `max_batch_size` operations or `max_batch_bytes` of
+    documents, or its oldest operation has waited `linger` seconds. Partition key groups of a batch
+    are written concurrently; writes to the same partition key are applied in the order they were
+    queued. Consecutive upserts of the same item within a batch are collapsed into the last one.
+
+    At most `max_buffered` operations are queued or in flight; beyond that, queueing blocks until
+    earlier writes complete. A `timeout` given to :func:`Container.upsert_item` and the like bounds
+    only that queueing, not the write itself; bound the write by waiting on the returned future,
+    e.g. `future.result(timeout=...)`.
+
+    Instances are not created directly; use :func:`Container.enable_write_behind`.
+
+    :param write: Called as `write(kind, argument)` to perform one operation, where kind is one of 'upsert', 'create' or 'delete'.
+    :param partition_key_of: Returns the partition key value of a document.
+    """
+
+    def __init__(
+        self,
+        write: "Callable[[str, Any], Any]",
+        partition_key_of: "Callable[[Dict[str, Any]], Any]",
+        *,
+        max_batch_size: "int" = 100,
+        max_batch_bytes: "int" = 2 * 1024 * 1024,
+        linger: "float" = 0.05,
+        max_buffered: "int" = 10000,
+        concurrency: "int" = 16,
+    ):
+        self._write = write
+        self._partition_key_of = partition_key_of
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.linger = linger
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.collapsed = 0
+        self.batches = 0
+        self._pending = deque()  # type: deque
+        self._pending_bytes = 0
+        self._oldest = None  # type: Optional[float]
+        self._outstanding = set()  # type: set
+        self._groups_in_flight = {}  # type: Dict[str, deque]
+        self._flush_requested = False
+        self._closed = False
+        self._capacity = threading.BoundedSemaphore(max_buffered)
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def upsert(self, body: "Dict[str, Any]") -> "Future":
+        """ Queue an upsert. The future resolves to the upserted :class:`Item`. """
+        return self._enqueue("upsert", body.get("id"), self._partition_key_of(body), body)
+
+    def create(self, body: "Dict[str, Any]") -> "Future":
+        """ Queue a create. The future resolves to the created :class:`Item`. """
+        return self._enqueue("create", body.get("id"), self._partition_key_of(body), body)
+
+    def delete(self, item: "Any") -> "Future":
+        """ Queue a delete. The future resolves to None once the item is deleted. """
+        if isinstance(item, dict):
+            return self._enqueue("delete", item.get("id"), self._partition_key_of(item), item)
+        return self._enqueue("delete", item, None, item)
+
+    def _enqueue(self, kind, id, partition_key, argument) -> "Future":
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The writer has been closed")
+        size = len(json.dumps(argument, separators=(",", ":"))) if kind != "delete" else 0
+        self._capacity.acquire()
+        operation = _Operation(kind, id, partition_key, argument, size)
+        with self._condition:
+            # Checked again under the lock close() takes: once the background thread has been told
+            # to stop, nothing would ever resolve an operation queued now
+            if self._closed:
+                self._capacity.release()
+                raise RuntimeError("The writer has been closed")
+            self._pending.append(operation)
+            self._pending_bytes += size
+            self._outstanding.add(operation.future)
+            self.enqueued += 1
+            if self._oldest is None:
+                # The background thread waits without a timeout while the queue is empty; wake it
+                # up to start the linger timer of this batch
+                self._oldest = time.monotonic()
+                self._condition.notify()
+            elif (
+                len(self._pending) >= self.max_batch_size
+                or self._pending_bytes >= self.max_batch_bytes
+            ):
+                self._condition.notify()
+        return operation.future
+
+    def flush(self, timeout: "Optional[float]" = None):
+        """ Send everything queued so far and wait for it to complete. """
+        with self._condition:
+            waiting_for = list(self._outstanding)
+            self._flush_requested = True
+            self._condition.notify()
+        wait(waiting_for, timeout=timeout)
+
+    def close(self):
+        """ Flush all queued writes and stop the background thread. """
+        if self._closed:
+            return
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    if self._pending and (
+                        self._flush_requested
+                        or self._closed
+                        or len(self._pending) >= self.max_batch_size
+                        or self._pending_bytes >= self.max_batch_bytes
+                        or time.monotonic() - self._oldest >= self.linger
+                    ):
+                        break
+                    self._flush_requested = False
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self._oldest + self.linger - time.monotonic())
+                    self._condition.wait(timeout)
+                batch = []
+                batch_bytes = 0
+                while (
+                    self._pending
+                    and len(batch) < self.max_batch_size
+                    and (not batch or batch_bytes + self._pending[0].size <= self.max_batch_bytes)
+                ):
+                    operation = self._pending.popleft()
+                    batch.append(operation)
+                    batch_bytes += operation.size
+                self._pending_bytes -= batch_bytes
+                self._oldest = time.monotonic() if self._pending else None
+                if not self._pending:
+                    self._flush_requested = False
+                self.batches += 1
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: "List[_Operation]"):
+        groups = OrderedDict()  # type: OrderedDict
+        for operation in batch:
+            groups.setdefault(json.dumps(operation.partition_key, default=str), []).append(operation)
+        for key, operations in groups.items():
+            with self._condition:
+                # A group for this partition key from an earlier batch may still be running;
+                # queue behind it to keep writes to the same partition key in order.
+                queued = self._groups_in_flight.get(key)
+                if queued is not None:
+                    queued.append(operations)
+                    continue
+                self._groups_in_flight[key] = deque()
+            self._executor.submit(self._drain, key, operations)
+
+    def _drain(self, key: "str", operations: "List[_Operation]"):
+        while operations is not None:
+            self._write_group(operations)
+            with self._condition:
+                queued = self._groups_in_flight[key]
+                if queued:
+                    operations = queued.popleft()
+                else:
+                    del self._groups_in_flight[key]
+                    operations = None
+
+    def _write_group(self, operations: "List[_Operation]"):
+        for index, operation in enumerate(operations):
+            following = operations[index + 1] if index + 1 < len(operations) else None
+            if (
+                following is not None
+                and operation.kind == following.kind == "upsert"
+                and operation.id is not None
+                and operation.id == following.id
+            ):
+                # Superseded by the next upsert of the same item; resolved with a copy of its outcome
+                following.future.add_done_callback(_forward_to(operation.future))
+                self._complete(operation, collapsed=True)
+                continue
+            try:
+                operation.future.set_result(self._write(operation.kind, operation.argument))
+            except Exception as e:
+                operation.future.set_exception(e)
+                with self._condition:
+                    self.failed += 1
+            self._complete(operation)
+
+    def _complete(self, operation: "_Operation", collapsed: "bool" = False):
+        with self._condition:
+            self.completed += 1
+            self.collapsed += collapsed
+            self._outstanding.discard(operation.future)
+        self._capacity.release()
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            enqueued=self.enqueued,
+            completed=self.completed,
+            failed=self.failed,
+            collapsed=self.collapsed,
+            batches=self.batches,
+            buffered=len(self._pending),
+        )
+
+
+def _forward_to(target: "Future") -> "Callable[[Future], None]":
+    def forward(source: "Future"):
+        if source.exception() is not None:
+            target.set_exception(source.exception())
+        else:
+            # Each caller gets its own copy, so changes to one result don't show up in the others
+            target.set_result(copy.deepcopy(source.result()))
+
+    return forward
@@ -0,0 +1,276 @@
+"""
+Per-endpoint health tracking and circuit breaking
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Responses that say the endpoint, rather than the request, is in trouble. Throttling (429) is not one.
+FAILURE_STATUS_CODES = frozenset([408, 500, 502, 503, 504])
+
+_logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(RuntimeError):
+    """ A request was not sent, because the circuit breaker of its endpoint is open. """
+
+    def __init__(self, endpoint: "str", retry_in: "float"):
+        super().__init__(f"Circuit breaker for {endpoint} is open; retrying in {max(retry_in, 0):.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """ Health of one endpoint, from the outcome and latency of the last `window` calls to it.
+
+    Once at least `min_calls` calls were seen, the breaker opens (trips) if the share of failed calls
+    reaches `failure_rate`, or the share of calls that took `slow_call_duration` or longer reaches
+    `slow_call_rate`. While open, calls are rejected with :class:`CircuitOpen` without being sent.
+    After `open_duration` seconds it is half open: `half_open_calls` trial calls are let through, the
+    others still rejected. If all trials succeed it closes again; if any fails it opens again.
+
+    Instances are not created directly; see :class:`CircuitBreakers`.
+    """
+
+    def __init__(
+        self,
+        endpoint: "str",
+        *,
+        failure_rate: "float" = 0.5,
+        slow_call_duration: "Optional[float]" = None,
+        slow_call_rate: "float" = 0.8,
+        window: "int" = 50,
+        min_calls: "int" = 20,
+        open_duration: "float" = 10.0,
+        half_open_calls: "int" = 3,
+        on_transition: "Optional[Callable[[str, str, str, str], None]]" = None,
+        history: "int" = 20,
+    ):
+        if half_open_calls < 1:
+            raise ValueError("half_open_calls must be at least 1")
+        self.endpoint = endpoint
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.on_transition = on_transition
+        self.state = CLOSED
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self.transitions = deque(maxlen=history)  # type: deque
+        # (failed, slow) outcome of recent calls
+        self._outcomes = deque(maxlen=window)  # type: deque
+        self._opened_at = 0.0
+        # Calls admitted in a previous state don't count towards the current one
+        self._generation = 0
+        self._trials_started = 0
+        self._trials_succeeded = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: "str", reason: "str") -> "Tuple[str, str, str]":
+        previous = self.state
+        self.state = state
+        self._generation += 1
+        now = time.time()
+        if state == OPEN:
+            self.times_opened += 1
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._trials_started = 0
+            self._trials_succeeded = 0
+        else:
+            self._outcomes.clear()
+        self.transitions.append(dict(time=now, from_state=previous, to_state=state, reason=reason))
+        return previous, state, reason
+
+    def _notify(self, transition: "Optional[Tuple[str, str, str]]"):
+        if transition is not None and self.on_transition is not None:
+            # A failing callback must not fail the call whose outcome caused the transition
+            try:
+                self.on_transition(self.endpoint, *transition)
+            except Exception:
+                _logger.exception("Reporting the circuit breaker transition of %s failed", self.endpoint)
+
+    def acquire(self) -> "int":
+        """ Permission to send a call to the endpoint; pass the result to :func:`CircuitBreaker.release`.
+
+        :raises CircuitOpen: If the breaker is open, or half open with all trial calls under way.
+        """
+        transition = None
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.open_duration - time.monotonic()
+                if retry_in > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(self.endpoint, retry_in)
+                transition = self._transition(HALF_OPEN, f"open for {self.open_duration:.1f}s")
+            if self.state == HALF_OPEN:
+                if self._trials_started >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpen(self.endpoint, 0.0)
+                self._trials_started += 1
+            generation = self._generation
+        self._notify(transition)
+        return generation
+
+    def release(self, permit: "int", duration: "float", failed: "Optional[bool]"):
+        """ Record the outcome of a call admitted by :func:`CircuitBreaker.acquire`.
+
+        :param failed: Whether the endpoint failed the call. None if the call ended for reasons that
+            say nothing about the endpoint (e.g. it was cancelled).
+        """
+        transition = None
+        with self._lock:
+            if failed is None:
+                if permit == self._generation and self.state == HALF_OPEN:
+                    self._trials_started -= 1
+                return
+            slow = self.slow_call_duration is not None and duration >= self.slow_call_duration
+            self.calls += 1
+            self.failures += failed
+            self.slow_calls += slow
+            if permit != self._generation:
+                return
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    transition = self._transition(OPEN, "trial call " + ("failed" if failed else "was slow"))
+                else:
+                    self._trials_succeeded += 1
+                    if self._trials_succeeded >= self.half_open_calls:
+                        transition = self._transition(CLOSED, f"{self.half_open_calls} trial calls succeeded")
+            elif self.state == CLOSED:
+                self._outcomes.append((failed, slow))
+                transition = self._check_rates()
+        self._notify(transition)
+
+    def _check_rates(self) -> "Optional[Tuple[str, str, str]]":
+        total = len(self._outcomes)
+        if total < self.min_calls:
+            return None
+        failure_rate = sum(failed for failed, _ in self._outcomes) / total
+        if failure_rate >= self.failure_rate:
+            return self._transition(OPEN, f"failure rate {failure_rate:.0%} over {total} calls")
+        if self.slow_call_duration is not None:
+            slow_rate = sum(slow for _, slow in self._outcomes) / total
+            if slow_rate >= self.slow_call_rate:
+                return self._transition(
+                    OPEN, f"{slow_rate:.0%} of {total} calls slower than {self.slow_call_duration}s"
+                )
+        return None
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._lock:
+            total = len(self._outcomes)
+            return dict(
+                state=self.state,
+                calls=self.calls,
+                failures=self.failures,
+                slow_calls=self.slow_calls,
+                rejected=self.rejected,
+                times_opened=self.times_opened,
+                failure_rate=sum(f for f, _ in self._outcomes) / total if total else 0.0,
+                slow_call_rate=sum(s for _, s in self._outcomes) / total if total else 0.0,
+                transitions=list(self.transitions),
+            )
+
+
+class CircuitBreakers:
+    """ A :class:`CircuitBreaker` per endpoint (scheme, host and port) requests are sent to.
+
+    Reads to an endpoint whose breaker is open are rerouted to the first of `alternate_endpoints`
+    (e.g. read regions) whose breaker lets them through; other requests fail fast with
+    :class:`CircuitOpen`.
+
+    :param alternate_endpoints: Endpoints to reroute reads to, in order of preference.
+    :param on_transition: Called with (endpoint, previous state, new state, reason) whenever a breaker
+        changes state, e.g. to export metrics.
+    :param breaker_options: Thresholds of every breaker; see :class:`CircuitBreaker`.
+
+    .. code-block:: python
+
+        breakers = CircuitBreakers(failure_rate=0.5, slow_call_duration=2.0, open_duration=10)
+        client = CosmosClient(url, key, circuit_breakers=breakers)
+        ...
+        print(breakers.stats())
+    """
+
+    def __init__(
+        self,
+        *,
+        alternate_endpoints: "Optional[List[str]]" = None,
+        on_transition: "Optional[Callable[[str, str, str, str], None]]" = None,
+        **breaker_options: "Any",
+    ):
+        self.alternate_endpoints = [_endpoint(url) for url in alternate_endpoints or []]
+        self.on_transition = on_transition
+        self.breaker_options = breaker_options
+        self.rerouted = 0
+        self._breakers = {}  # type: Dict[str, CircuitBreaker]
+        self._lock = threading.Lock()
+
+    def get(self, url: "str") -> "CircuitBreaker":
+        endpoint = _endpoint(url)
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    endpoint, on_transition=self.on_transition, **self.breaker_options
+                )
+            return breaker
+
+    def acquire(self, url: "str", read: "bool") -> "Tuple[str, CircuitBreaker, int]":
+        """ The URL to send a request to, the breaker of its endpoint, and the breaker's permit.
+
+        :raises CircuitOpen: If the request's endpoint, and every alternate for reads, is open.
+        """
+        breaker = self.get(url)
+        try:
+            return url, breaker, breaker.acquire()
+        except CircuitOpen:
+            if not read:
+                raise
+            for endpoint in self.alternate_endpoints:
+                if endpoint == breaker.endpoint:
+                    continue
+                alternate = self.get(endpoint)
+                try:
+                    permit = alternate.acquire()
+                except CircuitOpen:
+                    continue
+                with self._lock:
+                    self.rerouted += 1
+                return _with_endpoint(url, endpoint), alternate, permit
+            raise
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._lock:
+            breakers = dict(self._breakers)
+        return dict(
+            rerouted=self.rerouted,
+            endpoints={endpoint: breaker.stats() for endpoint, breaker in breakers.items()},
+        )
+
+
+def _endpoint(url: "str") -> "str":
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _with_endpoint(url: "str", endpoint: "str") -> "str":
+    target = urlsplit(endpoint)
+    parts = urlsplit(url)
+    return urlunsplit((target.scheme, target.netloc, parts.path, parts.query, parts.fragment))
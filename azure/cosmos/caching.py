@@ -0,0 +1,300 @@
+"""
+Client-side caches shared by the Azure Cosmos SQL object model
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Change feed continuation meaning "from now on": the service gets it as If-None-Match: *
+_FROM_NOW = "*"
+
+
+class LRUCache:
+    """ A thread safe, bounded, least-recently-used mapping.
+
+    :param maxsize: Maximum number of entries to keep. Once exceeded, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: "int" = 128):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def get(self, key: "Hashable", default: "Any" = None) -> "Any":
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: "Hashable", value: "Any"):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_add(self, key: "Hashable", factory: "Callable[[], Any]") -> "Any":
+        """ Return the value for `key`, calling `factory` to create (and cache) it if missing.
+
+        The factory is invoked outside the cache lock; if two threads race to create the same
+        entry, the first one stored wins and both callers get that value.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+        value = factory()
+        with self._lock:
+            existing = self._entries.get(key, sentinel)
+            if existing is not sentinel:
+                return existing
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def pop(self, key: "Hashable", default: "Any" = None) -> "Any":
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __contains__(self, key: "Hashable") -> "bool":
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> "int":
+        return len(self._entries)
+
+
+class QueryResultCache:
+    """ A bounded, time-to-live cache of query results for a single container.
+
+    Results are stored as their compact JSON encoding rather than as :class:`Item` instances,
+    and the least recently used entries are evicted once the total size exceeds `max_bytes`.
+    While the cache's `invalidator` can't read the change feed, the cache is bypassed.
+
+    :param ttl: Default number of seconds a result stays valid.
+    :param max_bytes: Memory budget for the encoded results.
+    """
+
+    def __init__(self, ttl: "float" = 60.0, max_bytes: "int" = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.request_charge_saved = 0.0
+        # Incremented by clear(), so that results read before a clear aren't stored after it
+        self.generation = 0
+        self.invalidator = None  # type: Optional[ChangeFeedInvalidator]
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query, parameters=None, partition_key=None, options=None) -> "str":
+        return json.dumps(
+            [query, parameters, partition_key, options],
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str,
+        )
+
+    def get(self, key: "str") -> "Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]":
+        """ Return the cached `(headers, results)` for `key`, or None if absent or expired. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic() or self._bypassed:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.request_charge_saved += entry[3]
+            expires, payload, headers, request_charge = entry
+        return headers, json.loads(payload.decode("utf-8"))
+
+    def put(
+        self,
+        key: "str",
+        headers: "Dict[str, Any]",
+        results: "List[Dict[str, Any]]",
+        request_charge: "float" = 0.0,
+        ttl: "Optional[float]" = None,
+        generation: "Optional[int]" = None,
+    ):
+        """ Store the results of a query.
+
+        :param generation: The cache's `generation` when the query was started. The results are
+            dropped if the cache was cleared since.
+        """
+        if self._bypassed:
+            return
+        payload = json.dumps(results, separators=(",", ":")).encode("utf-8")
+        if len(payload) > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, payload, dict(headers or {}), request_charge)
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    @property
+    def _bypassed(self) -> "bool":
+        # Changes can't be seen, so cached results may be out of date
+        return self.invalidator is not None and self.invalidator.failing
+
+    def _remove(self, key: "str"):
+        entry = self._entries.pop(key)
+        self.size -= len(entry[1])
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            entries=len(self._entries),
+            size=self.size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            request_charge_saved=self.request_charge_saved,
+        )
+
+    def __len__(self) -> "int":
+        return len(self._entries)
+
+
+class ChangeFeedInvalidator:
+    """ Detect changes to a container by tailing its change feed in a background thread.
+
+    The change feed of every partition key range is polled every `poll_interval` seconds, starting
+    from where it ends when the invalidator is started; `on_change` is called after each poll that
+    found changes, and after each poll that failed, since changes may have been missed. The
+    invalidator is `failing` from a failed poll until a poll succeeds.
+
+    :param client_context: Client used to read the change feed.
+    :param collection_link: Link to the container to watch.
+    :param poll_interval: Number of seconds between two polls.
+    :param on_change: Called when the container changed.
+    """
+
+    def __init__(
+        self,
+        client_context,
+        collection_link: "str",
+        poll_interval: "float" = 1.0,
+        on_change: "Optional[Callable[[], None]]" = None,
+    ):
+        self.client_context = client_context
+        self.collection_link = collection_link
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.polls = 0
+        self.changes = 0
+        self.last_error = None  # type: Optional[Exception]
+        self.failing = False
+        self._continuations = None  # type: Optional[Dict[str, str]]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def start(self):
+        """ Note where the change feed ends, and start polling it in the background. """
+        self.poll()
+        self._thread = threading.Thread(
+            target=self._run, name="cosmos-cache-invalidator", daemon=True
+        )
+        self._thread.start()
+
+    def poll(self) -> "bool":
+        """ Return True if the container changed since the previous poll.
+
+        The first poll only notes where the change feed of every partition key range ends.
+        """
+        with self._lock:
+            try:
+                changed = self._poll()
+            except Exception:
+                self.failing = True
+                raise
+            self.failing = False
+            self.polls += 1
+            self.changes += changed
+            return changed
+
+    def _poll(self) -> "bool":
+        if self._continuations is None:
+            self._continuations = {
+                pk_range["id"]: _FROM_NOW
+                for pk_range in self.client_context._ReadPartitionKeyRanges(
+                    self.collection_link
+                )
+            }
+        changed = False
+        for range_id, continuation in self._continuations.items():
+            changes = self.client_context.QueryItemsChangeFeed(
+                self.collection_link,
+                options={"partitionKeyRangeId": range_id, "continuation": continuation},
+            )
+            # Read to the end, so that the next poll only sees newer changes
+            while changes.fetch_next_block():
+                changed = True
+            headers = self.client_context.last_response_headers or {}
+            self._continuations[range_id] = headers.get("etag", continuation)
+        return changed
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                changed = self.poll()
+            except Exception as e:
+                self.last_error = e
+                changed = True
+            try:
+                if changed and self.on_change is not None:
+                    self.on_change()
+            except Exception as e:
+                self.last_error = e
+
+    def close(self):
+        """ Stop polling the change feed. """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            polls=self.polls,
+            changes=self.changes,
+            failing=self.failing,
+            last_error=repr(self.last_error) if self.last_error else None,
+        )
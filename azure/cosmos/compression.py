@@ -0,0 +1,43 @@
+"""
+Compressed storage of large document fields
+"""
+
+import base64
+import json
+import zlib
+
+from typing import Any, Dict, Iterable
+
+# A compressed field is stored as a single-property object holding the base64 encoded,
+# zlib compressed JSON of the original value.
+COMPRESSED_MARKER = "$zlib"
+
+
+def compress_value(value: "Any", level: "int" = 6) -> "Dict[str, str]":
+    data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    return {COMPRESSED_MARKER: base64.b64encode(zlib.compress(data, level)).decode("ascii")}
+
+
+def is_compressed(value: "Any") -> "bool":
+    return type(value) is dict and len(value) == 1 and COMPRESSED_MARKER in value
+
+
+def decompress_value(value: "Dict[str, str]") -> "Any":
+    data = zlib.decompress(base64.b64decode(value[COMPRESSED_MARKER]))
+    return json.loads(data.decode("utf-8"))
+
+
+def compress_fields(body: "Dict[str, Any]", fields: "Iterable[str]") -> "Dict[str, Any]":
+    """ Return a shallow copy of `body` with the given top-level fields compressed.
+
+    Fields that are missing, None or already compressed are left as they are.
+    """
+    compressed = None
+    for name in fields:
+        value = dict.get(body, name)
+        if value is None or is_compressed(value):
+            continue
+        if compressed is None:
+            compressed = dict(body)
+        compressed[name] = compress_value(value)
+    return body if compressed is None else compressed
@@ -0,0 +1,134 @@
+"""
+Helpers for concurrent access to items
+"""
+
+import copy
+import random
+import threading
+from collections import Counter
+
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from . import deadlines
+
+
+def backoff_delay(attempt: "int", base: "float", maximum: "float") -> "float":
+    """ Exponential backoff with full jitter: a random delay in [0, min(maximum, base * 2**attempt)). """
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+
+class ConflictStats:
+    """ Counters for optimistic concurrency updates (see :func:`Container.update_item`).
+
+    Conflicts are also counted per item id, so that hot items can be spotted. Only the
+    `max_tracked` items with the most conflicts are remembered.
+    """
+
+    def __init__(self, max_tracked: "int" = 1000):
+        self.max_tracked = max_tracked
+        self.updates = 0
+        self.attempts = 0
+        self.conflicts = 0
+        self.exhausted = 0
+        self._conflicts_by_id = Counter()  # type: Counter
+        self._lock = threading.Lock()
+
+    def record_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+    def record_update(self):
+        with self._lock:
+            self.updates += 1
+
+    def record_conflict(self, id: "str"):
+        with self._lock:
+            self.conflicts += 1
+            self._conflicts_by_id[id] += 1
+            if len(self._conflicts_by_id) > 2 * self.max_tracked:
+                self._conflicts_by_id = Counter(
+                    dict(self._conflicts_by_id.most_common(self.max_tracked))
+                )
+
+    def record_exhausted(self):
+        with self._lock:
+            self.exhausted += 1
+
+    @property
+    def conflict_rate(self) -> "float":
+        """ Fraction of conditional writes that failed because the item had changed. """
+        return self.conflicts / self.attempts if self.attempts else 0.0
+
+    def hot_items(self, n: "int" = 10) -> "List[Tuple[str, int]]":
+        """ The `n` item ids with the most conflicts, with their conflict counts. """
+        with self._lock:
+            return self._conflicts_by_id.most_common(n)
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            updates=self.updates,
+            attempts=self.attempts,
+            conflicts=self.conflicts,
+            exhausted=self.exhausted,
+            conflict_rate=self.conflict_rate,
+        )
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # type: Any
+        self.error = None  # type: Optional[BaseException]
+
+
+class SingleFlight:
+    """ Coalesce concurrent identical calls into one.
+
+    While a call for a given key is in flight, other callers with the same key wait for it
+    and share its outcome instead of making their own call. Waiting callers get a deep copy
+    of the result, so that no two callers share mutable state. If the call ran out of its
+    caller's deadline or was cancelled, waiting callers make it again.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._in_flight = {}  # type: Dict[Hashable, _Call]
+        self._lock = threading.Lock()
+
+    def do(self, key: "Hashable", fn: "Callable[[], Any]") -> "Any":
+        while True:
+            with self._lock:
+                self.calls += 1
+                call = self._in_flight.get(key)
+                leader = call is None
+                if leader:
+                    call = self._in_flight[key] = _Call()
+                    self.executions += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                try:
+                    call.result = fn()
+                except BaseException as e:
+                    call.error = e
+                finally:
+                    with self._lock:
+                        del self._in_flight[key]
+                    call.done.set()
+                break
+            # Followers give up at their own deadline; the leader's request carries on
+            deadlines.wait(call.done)
+            # The leader's deadline or cancellation isn't the followers': they call again, and the
+            # first of them leads the new call
+            if not isinstance(call.error, (deadlines.DeadlineExceeded, deadlines.OperationCancelled)):
+                break
+        if call.error is not None:
+            raise call.error
+        return call.result if leader else copy.deepcopy(call.result)
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(calls=self.calls, executions=self.executions, coalesced=self.coalesced)
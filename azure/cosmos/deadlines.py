@@ -0,0 +1,342 @@
+"""
+End-to-end deadlines and cancellation of operations
+"""
+
+import contextlib
+import functools
+import inspect
+import itertools
+import socket
+import threading
+import time
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+# The deadline of the operation being run on the current thread, and the connections it has in flight
+_local = threading.local()
+# Longest a cancellable operation blocks on a lock or condition before noticing it was cancelled
+CANCELLATION_POLL_INTERVAL = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """ An operation ran out of time. Requests it had in flight were abandoned. """
+
+
+class OperationCancelled(RuntimeError):
+    """ An operation was cancelled through its :class:`CancellationToken`. """
+
+
+class CancellationToken:
+    """ Cancels the operations it is passed to, from any thread.
+
+    Cancelling stops retries, backoff sleeps and page fetches, and shuts down the connections of
+    requests in flight, so that their callers fail with :class:`OperationCancelled` right away.
+
+    .. code-block:: python
+
+        token = CancellationToken()
+        threading.Timer(2.0, token.cancel).start()
+        for item in container.query_items('SELECT * FROM c', cancellation=token):
+            print(item['id'])
+
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = {}  # type: Dict[int, Callable[[], None]]
+        self._handles = itertools.count()
+
+    @property
+    def cancelled(self) -> "bool":
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # A connection that is already closed can't be shut down; nothing else to do
+                pass
+
+    def register(self, callback: "Callable[[], None]") -> "Optional[int]":
+        """ Call `callback` when the token is cancelled, right away if it already is.
+
+        :returns: A handle for :func:`CancellationToken.unregister`.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                handle = next(self._handles)
+                self._callbacks[handle] = callback
+                return handle
+        callback()
+        return None
+
+    def unregister(self, handle: "Optional[int]"):
+        with self._lock:
+            self._callbacks.pop(handle, None)
+
+    def wait(self, timeout: "Optional[float]" = None) -> "bool":
+        """ Wait until the token is cancelled or `timeout` seconds have passed. True if cancelled. """
+        return self._event.wait(timeout)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled("The operation was cancelled")
+
+
+class Deadline:
+    """ The time an operation must complete by, and the token that cancels it.
+
+    A deadline created within another one (see :func:`deadline`) is never later than the outer one,
+    and is cancelled along with it.
+
+    :param timeout: Number of seconds from now. None for no time limit.
+    :param cancellation: Token that cancels the operation.
+    :param parent: The enclosing deadline, if any.
+    """
+
+    def __init__(
+        self,
+        timeout: "Optional[float]" = None,
+        cancellation: "Optional[CancellationToken]" = None,
+        parent: "Optional[Deadline]" = None,
+    ):
+        self.expires = None if timeout is None else time.monotonic() + timeout
+        self._links = []  # type: List[Tuple[CancellationToken, Optional[int]]]
+        if parent is not None:
+            if parent.expires is not None and (self.expires is None or parent.expires < self.expires):
+                self.expires = parent.expires
+            if cancellation is None:
+                cancellation = parent.cancellation
+            elif parent.cancellation is not None and parent.cancellation is not cancellation:
+                # Cancelling the outer operation cancels this one too
+                linked = CancellationToken()
+                for token in (cancellation, parent.cancellation):
+                    self._links.append((token, token.register(linked.cancel)))
+                cancellation = linked
+        self.cancellation = cancellation
+
+    def remaining(self) -> "Optional[float]":
+        """ Seconds left, None if there is no time limit. """
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    @property
+    def expired(self) -> "bool":
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    @property
+    def cancelled(self) -> "bool":
+        return self.cancellation is not None and self.cancellation.cancelled
+
+    def check(self):
+        """ :raises OperationCancelled: If the operation was cancelled.
+        :raises DeadlineExceeded: If there is no time left.
+        """
+        if self.cancellation is not None:
+            self.cancellation.raise_if_cancelled()
+        if self.expired:
+            raise DeadlineExceeded("The operation's deadline was exceeded")
+
+    def clamp(
+        self, timeout: "Union[None, float, Tuple[Optional[float], Optional[float]]]"
+    ) -> "Union[None, float, Tuple[Optional[float], Optional[float]]]":
+        """ Lower a `requests` timeout (seconds, or a (connect, read) tuple) to the time left. """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.001)
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def close(self):
+        """ Stop following the cancellation of the enclosing deadline. """
+        for token, handle in self._links:
+            token.unregister(handle)
+        self._links = []
+
+
+def current_deadline() -> "Optional[Deadline]":
+    """ The deadline of the operation being run on this thread, if any. """
+    return getattr(_local, "deadline", None)
+
+
+@contextlib.contextmanager
+def _activated(active: "Optional[Deadline]") -> "Iterator[Optional[Deadline]]":
+    previous = current_deadline()
+    _local.deadline = active
+    try:
+        yield active
+    finally:
+        _local.deadline = previous
+
+
+@contextlib.contextmanager
+def deadline(
+    timeout: "Optional[float]" = None, cancellation: "Optional[CancellationToken]" = None
+) -> "Iterator[Deadline]":
+    """ Complete the operations run on this thread within the `with` block in `timeout` seconds, or
+    until `cancellation` is cancelled.
+
+    The deadline covers every request, retry, backoff sleep, wait for admission and page fetch, and
+    is lowered to that of an enclosing block if that one is earlier.
+    """
+    active = Deadline(timeout, cancellation, current_deadline())
+    try:
+        with _activated(active):
+            yield active
+    finally:
+        active.close()
+
+
+def check():
+    """ Raise if the operation running on this thread was cancelled or ran out of time. """
+    active = current_deadline()
+    if active is not None:
+        active.check()
+
+
+def remaining() -> "Optional[float]":
+    """ Seconds left to the operation running on this thread, None if it has no time limit. """
+    active = current_deadline()
+    return None if active is None else active.remaining()
+
+
+def bound(timeout: "Optional[float]") -> "Optional[float]":
+    """ Lower the timeout of a blocking wait so that the waiter wakes up at the deadline, and
+    regularly if the operation can be cancelled. Call :func:`check` after waking up. """
+    active = current_deadline()
+    if active is None:
+        return timeout
+    limits = [timeout, active.remaining()]
+    if active.cancellation is not None:
+        limits.append(CANCELLATION_POLL_INTERVAL)
+    limits = [limit for limit in limits if limit is not None]
+    return max(min(limits), 0.0) if limits else None
+
+
+def sleep(seconds: "float"):
+    """ `time.sleep`, that fails fast if the operation's deadline would pass while sleeping, and wakes
+    up when the operation is cancelled. """
+    active = current_deadline()
+    if active is None:
+        time.sleep(seconds)
+        return
+    active.check()
+    left = active.remaining()
+    if left is not None and seconds >= left:
+        raise DeadlineExceeded(f"The operation's deadline would be exceeded by waiting {seconds:.3f}s")
+    if active.cancellation is None:
+        time.sleep(seconds)
+    elif active.cancellation.wait(seconds):
+        active.cancellation.raise_if_cancelled()
+
+
+def wait(event: "threading.Event", timeout: "Optional[float]" = None) -> "bool":
+    """ `event.wait(timeout)`, within the operation's deadline.
+
+    :raises DeadlineExceeded: If the deadline passed before the event was set.
+    """
+    active = current_deadline()
+    if active is None:
+        return event.wait(timeout)
+    while True:
+        active.check()
+        started = time.monotonic()
+        if event.wait(bound(timeout)):
+            return True
+        if timeout is not None:
+            timeout -= time.monotonic() - started
+            if timeout <= 0:
+                return False
+
+
+def propagate(fn: "Callable") -> "Callable":
+    """ Wrap `fn` to run with the current thread's deadline, when called on another thread. """
+    active = current_deadline()
+    if active is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _activated(active):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def track_connection(connection: "Any"):
+    """ Shut down `connection` if the operation sending a request over it is cancelled. """
+    active = current_deadline()
+    if active is None or active.cancellation is None:
+        return
+    handle = active.cancellation.register(functools.partial(_shutdown, connection))
+    tracked = getattr(_local, "connections", None)
+    if tracked is None:
+        tracked = _local.connections = []
+    tracked.append((active.cancellation, handle))
+
+
+def release_connections():
+    """ Stop tracking the connections used by the requests this thread completed. """
+    tracked = getattr(_local, "connections", None)
+    while tracked:
+        token, handle = tracked.pop()
+        token.unregister(handle)
+
+
+def _shutdown(connection: "Any"):
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        # Unblocks the thread waiting on the response; the pool then discards the connection
+        sock.shutdown(socket.SHUT_RDWR)
+
+
+def cancellable(method: "Callable") -> "Callable":
+    """ Give a method the keyword arguments `timeout` (seconds) and `cancellation` (a
+    :class:`CancellationToken`), applied as a :func:`deadline` to everything the method does.
+
+    The deadline of a generator method starts when it is called, and covers producing every result.
+    """
+    if inspect.isgeneratorfunction(method):
+
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, timeout=None, cancellation=None, **kwargs):
+            if timeout is None and cancellation is None:
+                yield from method(self, *args, **kwargs)
+                return
+            active = Deadline(timeout, cancellation, current_deadline())
+            results = method(self, *args, **kwargs)
+            try:
+                while True:
+                    with _activated(active):
+                        active.check()
+                        try:
+                            result = next(results)
+                        except StopIteration:
+                            return
+                    yield result
+            finally:
+                results.close()
+                active.close()
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, timeout=None, cancellation=None, **kwargs):
+        if timeout is None and cancellation is None:
+            return method(self, *args, **kwargs)
+        with deadline(timeout, cancellation) as active:
+            active.check()
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,328 @@
+"""
+Parallel, resumable export of a container to JSON lines or Parquet files.
+
+Every partition key range is read page by page into its own shard(s), so memory use is bounded by
+`parallelism` pages (or Parquet files) regardless of the size of the container. Once a page is
+durably written, the range's continuation token and shard position are recorded in a state file;
+an interrupted export picks up from there. A range that is split, during the export or while it was
+interrupted, is continued on the ranges it was split into from its last recorded continuation.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Callable, Dict, List, Optional
+
+from .partitions import is_range_gone
+
+STATE_FILE = "_export_state.json"
+FORMATS = ("jsonl", "parquet")
+
+
+class ExportStats:
+    """ Progress and outcome of a :func:`export_container` run. """
+
+    def __init__(self, ranges_total: "int" = 0):
+        self.started = time.monotonic()
+        self.ranges_total = ranges_total
+        self.ranges_completed = 0
+        self.pages = 0
+        self.documents = 0
+        self.bytes_written = 0
+        self.request_charge = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> "float":
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> "float":
+        """ Documents exported per second. """
+        return self.documents / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return (
+            f"{self.documents} documents, {self.ranges_completed}/{self.ranges_total} ranges, "
+            f"{self.bytes_written / 1024 / 1024:.1f} MB written in {self.elapsed:.1f}s "
+            f"({self.throughput:.0f} docs/s, {self.request_charge:.0f} RU)"
+        )
+
+
+class _ExportState:
+    """ Per partition key range progress, persisted next to the shards. """
+
+    def __init__(self, directory: "str", format: "str", resume: "bool"):
+        self.path = os.path.join(directory, STATE_FILE)
+        self.ranges = {}  # type: Dict[str, Dict[str, Any]]
+        self._lock = threading.Lock()
+        if resume and os.path.exists(self.path):
+            with open(self.path, "r", encoding="UTF-8") as f:
+                state = json.load(f)
+            if state.get("format") != format:
+                raise ValueError(
+                    f"Cannot resume a {state.get('format')} export of {directory} as {format}"
+                )
+            self.ranges = state["ranges"]
+        self.format = format
+
+    def get(self, range_id: "str") -> "Dict[str, Any]":
+        with self._lock:
+            return dict(
+                self.ranges.setdefault(
+                    range_id, dict(continuation=None, done=False, size=0, parts=0, documents=0)
+                )
+            )
+
+    def update(self, range_id: "str", **progress):
+        with self._lock:
+            self.ranges[range_id].update(progress)
+            self._save()
+
+    def split(self, range_id: "str", children: "List[str]"):
+        """ Record that `range_id` was split into `children`, which carry on from its recorded progress
+        into shards of their own. """
+        with self._lock:
+            parent = self.ranges[range_id]
+            for child in children:
+                self.ranges[child] = dict(
+                    continuation=parent["continuation"],
+                    done=parent["done"],
+                    size=0,
+                    parts=0,
+                    documents=0,
+                )
+            parent["split"] = children
+            self._save()
+
+    def discard(self, range_id: "str"):
+        """ Forget a range that no longer exists and has no ranges to carry on from it. """
+        with self._lock:
+            del self.ranges[range_id]
+            self._save()
+
+    def _save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="UTF-8") as f:
+            json.dump(dict(format=self.format, ranges=self.ranges), f)
+        os.replace(temporary, self.path)
+
+
+def export_container(
+    container: "Container",
+    path: "str",
+    *,
+    format: "str" = "jsonl",
+    parallelism: "int" = 8,
+    page_size: "int" = 1000,
+    rows_per_file: "int" = 10000,
+    resume: "bool" = True,
+    report_interval: "float" = 5.0,
+    progress: "Optional[Callable[[ExportStats], None]]" = None,
+) -> "ExportStats":
+    """ Export all items in `container` to shard files in the directory `path`.
+
+    :param container: The container to export.
+    :param path: Directory to write the shards (one or more per partition key range) to.
+    :param format: 'jsonl' for one JSON document per line, or 'parquet' (requires `pyarrow`).
+    :param parallelism: Number of partition key ranges read concurrently.
+    :param page_size: Number of items requested per page.
+    :param rows_per_file: Number of rows per Parquet file. Up to this many items are buffered per range being read. Ignored for 'jsonl'.
+    :param resume: Continue a previous, interrupted export to `path` rather than starting over.
+    :param report_interval: Seconds between two calls to `progress`.
+    :param progress: Called with the current :class:`ExportStats` every `report_interval` seconds, and
+        once the export is done.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Exporting to parquet requires the 'pyarrow' package")
+
+    os.makedirs(path, exist_ok=True)
+    client_context = container.client_context
+    shard = _JsonLinesShard if format == "jsonl" else _ParquetShard
+    ranges = list(client_context._ReadPartitionKeyRanges(container.collection_link))
+    state = _ExportState(path, format, resume)
+    stats = ExportStats(len(ranges))
+    done = threading.Event()
+
+    def children_of(range_id, pk_ranges):
+        return [pk_range["id"] for pk_range in pk_ranges if range_id in pk_range.get("parents", ())]
+
+    # Ranges of an interrupted export that were split since
+    current = {pk_range["id"] for pk_range in ranges}
+    for range_id, progress_so_far in list(state.ranges.items()):
+        if range_id in current or "split" in progress_so_far:
+            continue
+        children = children_of(range_id, ranges)
+        if children:
+            # Drop anything written after the recorded progress; the children carry on from there
+            shard(path, range_id, progress_so_far, rows_per_file)
+            state.split(range_id, children)
+        else:
+            # Gone without children to carry on from it: its documents are exported again, by the
+            # ranges that now hold them
+            shard(path, range_id, dict(progress_so_far, size=0, parts=0), rows_per_file)
+            state.discard(range_id)
+    stats.documents += sum(
+        progress_so_far["documents"]
+        for progress_so_far in state.ranges.values()
+        if "split" in progress_so_far
+    )
+
+    def export_range(range_id):
+        progress_so_far = state.get(range_id)
+        with stats._lock:
+            stats.documents += progress_so_far["documents"]
+        if progress_so_far["done"]:
+            with stats._lock:
+                stats.ranges_completed += 1
+            return
+        writer = shard(path, range_id, progress_so_far, rows_per_file)
+        continuation = progress_so_far["continuation"]
+        documents = progress_so_far["documents"]
+        while True:
+            options = dict(maxItemCount=page_size)
+            if continuation:
+                options["continuation"] = continuation
+            try:
+                page, headers = client_context.QueryItemsPage(
+                    container.collection_link,
+                    options=options,
+                    partition_key_range_id=range_id,
+                )
+            except Exception as e:
+                if not is_range_gone(e):
+                    raise
+                children = children_of(
+                    range_id, client_context._ReadPartitionKeyRanges(container.collection_link)
+                )
+                if not children:
+                    raise
+                # Split: pages read since the last recorded progress are read again by the children
+                with stats._lock:
+                    stats.documents -= documents - state.get(range_id)["documents"]
+                    stats.ranges_total += len(children) - 1
+                state.split(range_id, children)
+                for child in children:
+                    export_range(child)
+                return
+            continuation = headers.get("x-ms-continuation")
+            written = writer.write(page, last=not continuation)
+            documents += len(page)
+            with stats._lock:
+                stats.pages += 1
+                stats.documents += len(page)
+                stats.bytes_written += written
+                stats.request_charge += float(headers.get("x-ms-request-charge", 0))
+            if writer.is_durable:
+                state.update(
+                    range_id,
+                    continuation=continuation,
+                    done=not continuation,
+                    documents=documents,
+                    **writer.position(),
+                )
+            if not continuation:
+                break
+        with stats._lock:
+            stats.ranges_completed += 1
+
+    def reporter():
+        while not done.wait(report_interval):
+            progress(stats)
+
+    if progress is not None:
+        threading.Thread(target=reporter, daemon=True).start()
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            for result in [pool.submit(export_range, pk_range["id"]) for pk_range in ranges]:
+                result.result()
+    finally:
+        done.set()
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+class _JsonLinesShard:
+    """ All documents of a partition key range, one per line. Every page is durable once written. """
+
+    is_durable = True
+
+    def __init__(self, directory, range_id, progress, rows_per_file):
+        self.path = os.path.join(directory, f"{range_id}.jsonl")
+        # Drop anything written after the last recorded page, so a resumed export has no duplicates
+        with open(self.path, "ab") as f:
+            f.truncate(progress["size"])
+        self.size = progress["size"]
+
+    def write(self, documents: "List[Dict[str, Any]]", last: "bool") -> "int":
+        data = "".join(
+            json.dumps(document, separators=(",", ":")) + "\n" for document in documents
+        ).encode("utf-8")
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def position(self) -> "Dict[str, Any]":
+        return dict(size=self.size)
+
+
+class _ParquetShard:
+    """ Parquet files of (up to) `rows_per_file` documents each.
+
+    Pages are buffered until a file is complete, and only then is the range's progress recorded:
+    a resumed export re-reads the pages of the incomplete file.
+    """
+
+    def __init__(self, directory, range_id, progress, rows_per_file):
+        self.directory = directory
+        self.range_id = range_id
+        self.rows_per_file = rows_per_file
+        self.parts = progress["parts"]
+        self._rows = []  # type: List[Dict[str, Any]]
+        part = self.parts
+        while os.path.exists(self._part_path(part)):
+            os.remove(self._part_path(part))
+            part += 1
+
+    @property
+    def is_durable(self) -> "bool":
+        return not self._rows
+
+    def _part_path(self, part: "int") -> "str":
+        return os.path.join(self.directory, f"{self.range_id}-{part:06d}.parquet")
+
+    def write(self, documents: "List[Dict[str, Any]]", last: "bool") -> "int":
+        self._rows.extend(documents)
+        if len(self._rows) < self.rows_per_file and not last:
+            return 0
+        rows, self._rows = self._rows, []
+        return self._flush(rows) if rows else 0
+
+    def _flush(self, rows: "List[Dict[str, Any]]") -> "int":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            table = pa.Table.from_pylist(rows)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Properties with different types in different documents: store the values as JSON text
+            table = pa.Table.from_pylist(
+                [{key: json.dumps(value) for key, value in row.items()} for row in rows]
+            )
+        path = self._part_path(self.parts)
+        pq.write_table(table, path)
+        self.parts += 1
+        return os.path.getsize(path)
+
+    def position(self) -> "Dict[str, Any]":
+        return dict(parts=self.parts)
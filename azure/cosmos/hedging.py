@@ -0,0 +1,273 @@
+"""
+Hedged (speculative) reads
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+from typing import Any, Callable, Dict, List, Optional
+
+from . import deadlines, profiling
+
+_PRIMARY = "primary"
+_HEDGE = "hedge"
+
+
+class _Race:
+    """ A read and its hedge: the first to get a response wins, and cancels the other. """
+
+    def __init__(self):
+        self.tokens = {_PRIMARY: deadlines.CancellationToken(), _HEDGE: deadlines.CancellationToken()}
+        self.primary_done = False
+        # The hedge's future, once it was sent
+        self.hedge = None  # type: Optional[Future]
+        self.winner = None  # type: Optional[str]
+        self._lock = threading.Lock()
+
+    def start_hedge(self, submit: "Callable[[], Optional[Future]]") -> "bool":
+        """ Send the hedge with `submit`, unless the read is done. True if it was sent. """
+        with self._lock:
+            if not self.primary_done:
+                self.hedge = submit()
+            return self.hedge is not None
+
+    def end_primary(self) -> "Optional[Future]":
+        """ Note the read is done, so its hedge isn't sent anymore. Returns the hedge if it was sent. """
+        with self._lock:
+            self.primary_done = True
+            return self.hedge
+
+    def finish(self, attempt: "str", response: "Any") -> "bool":
+        """ Record the response of `attempt`. True if it won; a losing response is closed. """
+        with self._lock:
+            won = self.winner is None
+            if won:
+                self.winner = attempt
+        if won:
+            self.tokens[_HEDGE if attempt == _PRIMARY else _PRIMARY].cancel()
+        else:
+            response.close()
+        return won
+
+
+class HedgingPolicy:
+    """ Send a duplicate of a slow read, and use whichever response arrives first.
+
+    A read that hasn't completed after the `percentile` latency of recent reads is sent again,
+    either over another connection to the same endpoint or to the next of `alternate_endpoints`.
+    As soon as one of them has a response, the other is cancelled and its connection shut down.
+
+    Hedges are paid for with a budget that grows by `budget` for every read, so duplicates never
+    exceed that fraction of the read traffic.
+
+    :param percentile: Latency percentile (0-1) of recent reads after which a read is hedged.
+    :param budget: Maximum fraction of reads that may be duplicated.
+    :param min_delay: Lower bound, in seconds, on the delay before hedging.
+    :param max_delay: Upper bound, in seconds, on the delay before hedging.
+    :param window: Number of recent read latencies the threshold is computed from.
+    :param alternate_endpoints: Endpoints (e.g. read regions) to send hedges to, in turn.
+    :param max_workers: Number of threads available to send hedges on.
+
+    Hedges are scheduled on a single timer thread, and only take a worker thread once they are
+    sent. :func:`HedgingPolicy.close` stops these threads.
+
+    .. code-block:: python
+
+        hedging = HedgingPolicy(percentile=0.95, budget=0.05)
+        client = CosmosClient(url, key, hedging=hedging)
+        ...
+        print(hedging.stats())
+        hedging.close()
+    """
+
+    # Number of latency samples needed before reads are hedged at all
+    MIN_SAMPLES = 50
+    # Number of new samples after which the threshold is recomputed
+    REFRESH_EVERY = 50
+
+    def __init__(
+        self,
+        percentile: "float" = 0.95,
+        budget: "float" = 0.05,
+        *,
+        min_delay: "float" = 0.001,
+        max_delay: "float" = 1.0,
+        window: "int" = 1000,
+        alternate_endpoints: "Optional[List[str]]" = None,
+        max_workers: "int" = 64,
+    ):
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1")
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.alternate_endpoints = list(alternate_endpoints or [])
+        self.reads = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0
+        self._latencies = deque(maxlen=window)  # type: deque
+        self._samples_since_refresh = 0
+        self._threshold = None  # type: Optional[float]
+        self._tokens = 0.0
+        self._next_endpoint = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cosmos-hedge")
+        # Hedges waiting for their delay, as a heap of (due, sequence, race, hedge)
+        self._scheduled = []  # type: List[Any]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._timer = None  # type: Optional[threading.Thread]
+        self._closed = False
+
+    @property
+    def threshold(self) -> "Optional[float]":
+        """ Current delay, in seconds, before a read is hedged; None until enough reads were observed. """
+        return self._threshold
+
+    def _observe(self, latency: "float"):
+        with self._lock:
+            self._latencies.append(latency)
+            self._samples_since_refresh += 1
+            if (
+                len(self._latencies) >= self.MIN_SAMPLES
+                and self._samples_since_refresh >= self.REFRESH_EVERY
+            ):
+                self._samples_since_refresh = 0
+                ordered = sorted(self._latencies)
+                value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+                self._threshold = min(self.max_delay, max(self.min_delay, value))
+
+    def _take_token(self) -> "bool":
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.hedges_fired += 1
+                return True
+            self.hedges_denied += 1
+            return False
+
+    def _hedge_url(self, url: "str") -> "str":
+        if not self.alternate_endpoints:
+            return url
+        with self._lock:
+            endpoint = self.alternate_endpoints[self._next_endpoint % len(self.alternate_endpoints)]
+            self._next_endpoint += 1
+        target = urlsplit(endpoint)
+        parts = urlsplit(url)
+        return urlunsplit((target.scheme, target.netloc, parts.path, parts.query, parts.fragment))
+
+    def execute(self, send: "Callable[[str], Any]", url: "str") -> "Any":
+        """ Run `send(url)`, hedging it with `send(alternate url)` if it is slow.
+
+        The read is sent from the calling thread, and the hedge from a worker thread, each within a
+        :func:`azure.cosmos.deadlines.deadline` of its own that the other attempt cancels once it has
+        a response. `send` must therefore track its connections for cancellation, and return a
+        streamed `requests.Response`, so that the losing response can be closed without reading its body.
+        """
+        with self._lock:
+            self.reads += 1
+            # Cap the accumulated budget, so that a quiet period can't fund a burst of hedges
+            self._tokens = min(self._tokens + self.budget, 10.0)
+            threshold = self._threshold
+        start = time.monotonic()
+        if threshold is None or self._closed:
+            response = send(url)
+            self._observe(time.monotonic() - start)
+            return response
+
+        race = _Race()
+        # Wrapped here, to run the hedge within this thread's deadline and profiled operation
+        hedge = deadlines.propagate(profiling.propagate(self._hedge, _HEDGE))
+        self._schedule(start + threshold, race, lambda: hedge(send, url, race))
+        try:
+            with deadlines.deadline(cancellation=race.tokens[_PRIMARY]):
+                response = send(url)
+        except Exception:
+            # Cancelled because the hedge won, or failed: use the hedge's response if it gets one.
+            # A hedge still queued for a worker is dropped rather than waited for.
+            sent = race.end_primary()
+            hedged = None
+            if sent is not None and not sent.cancel():
+                try:
+                    hedged = sent.result()
+                except Exception:
+                    hedged = None
+            if hedged is None:
+                raise
+            self._observe(time.monotonic() - start)
+            return hedged
+        sent = race.end_primary()
+        if not race.finish(_PRIMARY, response):
+            response = sent.result()
+        self._observe(time.monotonic() - start)
+        return response
+
+    def _schedule(self, due: "float", race: "_Race", hedge: "Callable[[], Any]"):
+        with self._condition:
+            heapq.heappush(self._scheduled, (due, next(self._sequence), race, hedge))
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._run_timer, name="cosmos-hedge-timer", daemon=True
+                )
+                self._timer.start()
+            elif self._scheduled[0][2] is race:
+                self._condition.notify()
+
+    def _run_timer(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._scheduled:
+                        delay = self._scheduled[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self._condition.wait(delay)
+                if self._closed:
+                    return
+                due, _, race, hedge = heapq.heappop(self._scheduled)
+            # Only hedges still needed, and paid for, take a worker
+            race.start_hedge(
+                lambda: self._executor.submit(hedge) if self._take_token() else None
+            )
+
+    def _hedge(self, send: "Callable[[str], Any]", url: "str", race: "_Race") -> "Any":
+        """ Send the hedge of a read. Returns the hedge's response if it won, None if it lost. """
+        try:
+            with deadlines.deadline(cancellation=race.tokens[_HEDGE]):
+                response = send(self._hedge_url(url))
+        finally:
+            deadlines.release_connections()
+        if not race.finish(_HEDGE, response):
+            return None
+        with self._lock:
+            self.hedges_won += 1
+        return response
+
+    def close(self):
+        """ Stop the timer and worker threads. Reads are no longer hedged afterwards. """
+        with self._condition:
+            self._closed = True
+            self._scheduled = []
+            self._condition.notify()
+        if self._timer is not None:
+            self._timer.join()
+        self._executor.shutdown()
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            reads=self.reads,
+            threshold=self._threshold,
+            hedges_fired=self.hedges_fired,
+            hedges_won=self.hedges_won,
+            hedges_denied=self.hedges_denied,
+        )
+
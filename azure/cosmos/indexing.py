@@ -0,0 +1,251 @@
+"""
+Indexing policy recommendations from an observed workload
+"""
+
+import threading
+from collections import Counter
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .patch import SYSTEM_PROPERTIES
+from .query import QueryPlan
+
+# Rough share of a write's request charge that goes to maintaining the index, as opposed to storing
+# the document. Used to estimate what excluding paths from the index saves.
+INDEX_SHARE_OF_WRITE_CHARGE = 0.5
+
+DEFAULT_POLICY = {
+    "indexingMode": "consistent",
+    "automatic": True,
+    "includedPaths": [{"path": "/*"}],
+    "excludedPaths": [{"path": '/"_etag"/?'}],
+}
+
+
+def _leaf_paths(value: "Any", path: "str" = "") -> "Iterable[str]":
+    """ The path of every scalar in a document, arrays elements as '[]'. """
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if path or key not in SYSTEM_PROPERTIES:
+                yield from _leaf_paths(child, f"{path}/{key}")
+    elif isinstance(value, list):
+        for child in value:
+            yield from _leaf_paths(child, f"{path}/[]")
+    else:
+        yield path
+
+
+def _match(pattern: "str", path: "str") -> "Optional[int]":
+    """ How precisely an index policy path matches a document path; None if it doesn't match. """
+    pattern = pattern.replace('"', "")
+    if pattern.endswith("/?"):
+        return len(pattern) if path == pattern[:-2] else None
+    if pattern.endswith("/*"):
+        prefix = pattern[:-2]
+        if path == prefix or path.startswith(prefix + "/"):
+            return len(prefix)
+    return None
+
+
+def is_indexed(policy: "Dict[str, Any]", path: "str") -> "bool":
+    """ Whether `policy` indexes the scalar at `path`. The most precise matching path decides. """
+    if policy.get("indexingMode", "consistent") == "none":
+        return False
+    best = None  # type: Optional[Tuple[int, bool]]
+    for included, entries in (
+        (True, policy.get("includedPaths", [])),
+        (False, policy.get("excludedPaths", [])),
+    ):
+        for entry in entries:
+            precision = _match(entry["path"], path)
+            if precision is not None and (best is None or precision > best[0]):
+                best = (precision, included)
+    return best is not None and best[1]
+
+
+class _QueryShape:
+    __slots__ = ("plan", "count", "request_charge")
+
+    def __init__(self, plan: "QueryPlan"):
+        self.plan = plan
+        self.count = 0
+        self.request_charge = 0.0
+
+
+class WorkloadRecorder:
+    """ Record the shape of the queries and writes made through a container.
+
+    Instances are not created directly; use :func:`Container.enable_workload_recording`.
+
+    :param sample_every: Only inspect the paths of every n-th written document.
+    """
+
+    def __init__(self, sample_every: "int" = 1):
+        self.sample_every = sample_every
+        self.writes = 0
+        self.write_charge = 0.0
+        self.sampled_writes = 0
+        self._queries = {}  # type: Dict[str, _QueryShape]
+        # Number of scalars per path over the sampled documents
+        self._terms = Counter()  # type: Counter
+        self._lock = threading.Lock()
+
+    def record_query(self, plan: "QueryPlan", headers: "Optional[Dict[str, Any]]"):
+        charge = float((headers or {}).get("x-ms-request-charge", 0) or 0)
+        with self._lock:
+            shape = self._queries.get(plan.query)
+            if shape is None:
+                shape = self._queries[plan.query] = _QueryShape(plan)
+            shape.count += 1
+            shape.request_charge += charge
+
+    def record_write(self, document: "Dict[str, Any]", headers: "Optional[Dict[str, Any]]"):
+        charge = float((headers or {}).get("x-ms-request-charge", 0) or 0)
+        with self._lock:
+            self.writes += 1
+            self.write_charge += charge
+            sample = self.writes % self.sample_every == 0
+        if sample:
+            terms = Counter(_leaf_paths(document))
+            with self._lock:
+                self.sampled_writes += 1
+                self._terms.update(terms)
+
+    def queries(self) -> "List[Dict[str, Any]]":
+        """ The recorded query shapes, most expensive first. """
+        with self._lock:
+            shapes = sorted(self._queries.values(), key=lambda shape: -shape.request_charge)
+            return [
+                dict(
+                    query=shape.plan.query,
+                    count=shape.count,
+                    request_charge=shape.request_charge,
+                    filter_paths=shape.plan.filter_paths,
+                    order_by=shape.plan.order_by,
+                    projection_paths=shape.plan.projection_paths,
+                )
+                for shape in shapes
+            ]
+
+    def recommend(
+        self, current_policy: "Optional[Dict[str, Any]]" = None
+    ) -> "IndexingRecommendation":
+        """ Recommend an indexing policy that serves the recorded queries and indexes nothing else.
+
+        :param current_policy: The container's indexing policy, to estimate savings against. Defaults to indexing every path.
+        """
+        with self._lock:
+            plans = [shape.plan for shape in self._queries.values()]
+            terms = Counter(self._terms)
+            sampled = self.sampled_writes
+            writes = self.writes
+            write_charge = self.write_charge
+
+        indexed = []  # type: List[str]
+        for plan in plans:
+            for path in plan.filter_paths + [path for path, _ in plan.order_by]:
+                if path not in indexed:
+                    indexed.append(path)
+        # Paths that hold objects or arrays in the written documents are indexed with everything below them
+        nested = {path for path in indexed if any(leaf.startswith(path + "/") for leaf in terms)}
+        included = [
+            dict(path=f"{path}/*" if path in nested else f"{path}/?") for path in indexed
+        ]
+
+        composites = []  # type: List[List[Dict[str, str]]]
+        for plan in plans:
+            # Several ORDER BY paths need a composite index; a filter followed by ORDER BY benefits from one.
+            # Composite indexes only cover scalars.
+            order_paths = [path for path, _ in plan.order_by]
+            composite = [
+                (path, "ASC")
+                for path in plan.filter_paths
+                if path not in order_paths and path not in nested
+            ] + list(plan.order_by)
+            if plan.order_by and len(composite) >= 2 and not nested & set(order_paths):
+                entry = [
+                    dict(path=path, order="descending" if direction == "DESC" else "ascending")
+                    for path, direction in composite
+                ]
+                if entry not in composites:
+                    composites.append(entry)
+
+        policy = dict(
+            indexingMode="consistent",
+            automatic=True,
+            includedPaths=included,
+            excludedPaths=[dict(path="/*"), dict(path='/"_etag"/?')],
+        )  # type: Dict[str, Any]
+        if composites:
+            policy["compositeIndexes"] = composites
+
+        current_policy = current_policy or DEFAULT_POLICY
+        terms_before = sum(
+            count for path, count in terms.items() if is_indexed(current_policy, path)
+        )
+        terms_after = sum(count for path, count in terms.items() if is_indexed(policy, path))
+        return IndexingRecommendation(
+            policy,
+            writes=writes,
+            mean_write_charge=write_charge / writes if writes else 0.0,
+            terms_before=terms_before / sampled if sampled else 0.0,
+            terms_after=terms_after / sampled if sampled else 0.0,
+            queries=len(plans),
+        )
+
+    def reset(self):
+        with self._lock:
+            self.writes = 0
+            self.write_charge = 0.0
+            self.sampled_writes = 0
+            self._queries.clear()
+            self._terms.clear()
+
+
+class IndexingRecommendation:
+    """ A recommended indexing policy, and its estimated effect on the request charge of writes.
+
+    :ivar policy: The recommended indexing policy.
+    :ivar mean_write_charge: Observed mean request charge of a write.
+    :ivar terms_before: Mean number of indexed values per written document under the current policy.
+    :ivar terms_after: Mean number of indexed values per written document under the recommended policy.
+    """
+
+    def __init__(
+        self,
+        policy: "Dict[str, Any]",
+        *,
+        writes: "int",
+        mean_write_charge: "float",
+        terms_before: "float",
+        terms_after: "float",
+        queries: "int",
+    ):
+        self.policy = policy
+        self.writes = writes
+        self.mean_write_charge = mean_write_charge
+        self.terms_before = terms_before
+        self.terms_after = terms_after
+        self.queries = queries
+
+    @property
+    def estimated_savings(self) -> "float":
+        """ Estimated fraction of the request charge of writes saved by the recommended policy. """
+        if not self.terms_before:
+            return 0.0
+        return INDEX_SHARE_OF_WRITE_CHARGE * (1 - self.terms_after / self.terms_before)
+
+    @property
+    def estimated_write_charge(self) -> "float":
+        """ Estimated mean request charge of a write under the recommended policy. """
+        return self.mean_write_charge * (1 - self.estimated_savings)
+
+    def __str__(self):
+        included = ", ".join(entry["path"] for entry in self.policy["includedPaths"]) or "nothing"
+        composites = len(self.policy.get("compositeIndexes", []))
+        return (
+            f"Index {included} ({composites} composite indexes) for {self.queries} query shapes. "
+            f"Indexed values per write: {self.terms_before:.1f} -> {self.terms_after:.1f}; "
+            f"estimated write charge {self.mean_write_charge:.2f} -> {self.estimated_write_charge:.2f} RU "
+            f"({self.estimated_savings:.0%} saved, over {self.writes} writes observed)"
+        )
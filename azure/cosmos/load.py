@@ -0,0 +1,392 @@
+"""
+High-throughput ingestion of JSON and JSON lines files into a container.
+
+Files are split into chunks that are parsed in a pool of worker processes, while a pool of writer
+threads streams the parsed documents into the container. A bounded queue between the two applies
+backpressure, so parsing never runs more than `queue_size` documents ahead of the writes.
+
+From the command line::
+
+    python -m azure.cosmos.load --database mydb --container mycontainer 'data/**/*.jsonl'
+
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Size of the chunks JSON lines files are split into for parsing
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files (or chunks) at least this large are memory-mapped rather than read
+MMAP_THRESHOLD = 1024 * 1024
+
+_JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+class LoadStats:
+    """ Progress and outcome of a :func:`load_files` run. """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.units_total = 0
+        self.units_skipped = 0
+        self.units_completed = 0
+        self.bytes_parsed = 0
+        self.documents_parsed = 0
+        self.documents_written = 0
+        self.documents_failed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def elapsed(self) -> "float":
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> "float":
+        """ Documents written per second. """
+        return self.documents_written / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return (
+            f"{self.documents_written} written, {self.documents_failed} failed, "
+            f"{self.units_completed + self.units_skipped}/{self.units_total} chunks, "
+            f"{self.bytes_parsed / 1024 / 1024:.1f} MB parsed in {self.elapsed:.1f}s "
+            f"({self.throughput:.0f} docs/s)"
+        )
+
+
+def _is_json_lines(path: "str") -> "bool":
+    return path.lower().endswith(_JSON_LINES_EXTENSIONS)
+
+
+def _read(path: "str", offset: "int", length: "int") -> "bytes":
+    with open(path, "rb") as f:
+        if length >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[offset : offset + length]
+        f.seek(offset)
+        return f.read(length)
+
+
+def split_file(path: "str", chunk_size: "int" = CHUNK_SIZE) -> "List[Tuple[str, int, int]]":
+    """ Split a file into `(path, offset, length)` units that can be parsed independently.
+
+    JSON lines files are split on line boundaries into chunks of roughly `chunk_size` bytes;
+    any other file is a single unit.
+    """
+    size = os.path.getsize(path)
+    if not _is_json_lines(path) or size <= chunk_size:
+        return [(path, 0, size)]
+    units = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        offset = 0
+        while offset < size:
+            end = mapped.find(b"\n", min(offset + chunk_size, size) - 1)
+            end = size if end < 0 else end + 1
+            units.append((path, offset, end - offset))
+            offset = end
+    return units
+
+
+def parse_unit(
+    path: "str", offset: "int", length: "int", id_from_path: "bool" = False
+) -> "Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]":
+    """ Parse one unit returned by :func:`split_file`. Runs in a worker process.
+
+    :returns: The parsed documents, and a list of `(source text, error)` for whatever failed to parse.
+    """
+    data = _read(path, offset, length)
+    documents = []  # type: List[Dict[str, Any]]
+    errors = []  # type: List[Tuple[str, str]]
+    if _is_json_lines(path):
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                documents.append(json.loads(line))
+            except (ValueError, UnicodeDecodeError) as e:
+                errors.append((line.decode("utf-8", errors="replace"), str(e)))
+    else:
+        try:
+            parsed = json.loads(data)
+        except (ValueError, UnicodeDecodeError) as e:
+            return [], [(path, str(e))]
+        if isinstance(parsed, list):
+            documents.extend(parsed)
+        else:
+            if id_from_path and isinstance(parsed, dict) and "id" not in parsed:
+                parsed["id"] = path.replace(os.sep, ":")
+            documents.append(parsed)
+    for document in [d for d in documents if not isinstance(d, dict)]:
+        documents.remove(document)
+        errors.append((json.dumps(document), "document is not a JSON object"))
+    return documents, errors
+
+
+class _Checkpoint:
+    """ The set of units already loaded, persisted to a JSON file. """
+
+    def __init__(self, path: "Optional[str]", interval: "float" = 5.0):
+        self.path = path
+        self.interval = interval
+        self.completed = set()
+        self._next_save = time.monotonic() + interval
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="UTF-8") as f:
+                self.completed = set(json.load(f)["completed"])
+
+    @staticmethod
+    def key(unit: "Tuple[str, int, int]") -> "str":
+        return f"{unit[0]}:{unit[1]}"
+
+    def complete(self, key: "str"):
+        with self._lock:
+            self.completed.add(key)
+            if time.monotonic() >= self._next_save:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        self._next_save = time.monotonic() + self.interval
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="UTF-8") as f:
+            json.dump(dict(completed=sorted(self.completed)), f)
+        os.replace(temporary, self.path)
+
+
+class _DeadLetters:
+    """ JSON lines file receiving everything that could not be parsed or written. """
+
+    def __init__(self, path: "Optional[str]"):
+        self._file = open(path, "a", encoding="UTF-8") if path else None
+        self._lock = threading.Lock()
+
+    def add(self, source: "str", error: "str", **record):
+        if self._file is None:
+            return
+        line = json.dumps(dict(source=source, error=error, **record), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _print_progress(stats: "LoadStats"):
+    print(stats, file=sys.stderr)
+
+
+def load_files(
+    container: "Container",
+    patterns: "Iterable[str]",
+    *,
+    operation: "str" = "upsert",
+    processes: "Optional[int]" = None,
+    writers: "int" = 16,
+    queue_size: "int" = 1000,
+    chunk_size: "int" = CHUNK_SIZE,
+    id_from_path: "bool" = False,
+    checkpoint: "Optional[str]" = None,
+    dead_letter: "Optional[str]" = None,
+    report_interval: "float" = 5.0,
+    progress: "Optional[Callable[[LoadStats], None]]" = None,
+) -> "LoadStats":
+    """ Load all JSON (one document, or an array of documents, per file) and JSON lines files matching
+    `patterns` into `container`.
+
+    :param container: The container to load the documents into.
+    :param patterns: File names or (recursive) glob patterns.
+    :param operation: Either 'upsert' or 'create'.
+    :param processes: Number of parser processes. Defaults to the number of CPUs.
+    :param writers: Number of concurrent writes to the container.
+    :param queue_size: Maximum number of parsed documents waiting to be written.
+    :param chunk_size: Approximate size of the chunks JSON lines files are parsed in.
+    :param id_from_path: Give single-document JSON files without an `id` one derived from their path.
+    :param checkpoint: File recording the chunks already loaded. Chunks listed in it are skipped, so an interrupted load can be resumed.
+    :param dead_letter: JSON lines file receiving the documents (or lines) that failed to parse or write, with the error.
+    :param report_interval: Seconds between two calls to `progress`.
+    :param progress: Called with the current :class:`LoadStats` every `report_interval` seconds, and once
+        the load is done.
+
+    With write-behind enabled on `container` (see :func:`Container.enable_write_behind`), a document
+    only counts as written once its buffered write completed.
+
+    .. code-block:: python
+
+        stats = load_files(container, ['specification/**/*.json'], id_from_path=True,
+                           dead_letter='failed.jsonl', progress=print)
+        print(stats)
+    """
+    if operation not in ("upsert", "create"):
+        raise ValueError("operation must be either 'upsert' or 'create'")
+    write = container.upsert_item if operation == "upsert" else container.create_item
+
+    stats = LoadStats()
+    progress_points = _Checkpoint(checkpoint)
+    dead_letters = _DeadLetters(dead_letter)
+    documents = queue.Queue(maxsize=queue_size)  # type: queue.Queue
+    pending = {}  # type: Dict[str, int]
+    pending_lock = threading.Lock()
+    done = threading.Event()
+
+    def finished(key):
+        with pending_lock:
+            pending[key] -= 1
+            if pending[key]:
+                return
+            del pending[key]
+            stats.units_completed += 1
+        progress_points.complete(key)
+
+    def writer():
+        while True:
+            entry = documents.get()
+            if entry is None:
+                return
+            key, document = entry
+            try:
+                written = write(document)
+                if isinstance(written, Future):
+                    # Queued by a write-behind buffer: only written, or failed, once it completes
+                    written.result()
+                with stats._lock:
+                    stats.documents_written += 1
+            except Exception as e:
+                dead_letters.add(key, str(e), document=document)
+                with stats._lock:
+                    stats.documents_failed += 1
+            finished(key)
+
+    def reporter():
+        while not done.wait(report_interval):
+            progress(stats)
+
+    units = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path):
+                units.extend(split_file(path, chunk_size))
+    stats.units_total = len(units)
+    units = [unit for unit in units if _Checkpoint.key(unit) not in progress_points.completed]
+    stats.units_skipped = stats.units_total - len(units)
+
+    threads = [threading.Thread(target=writer, daemon=True) for _ in range(writers)]
+    if progress is not None:
+        threads.append(threading.Thread(target=reporter, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            # Keep a bounded window of chunks being parsed ahead of the writers
+            window = 2 * (processes or os.cpu_count() or 1)
+            in_flight = deque()  # type: deque
+            for unit in units:
+                in_flight.append((unit, pool.submit(parse_unit, *unit, id_from_path)))
+                if len(in_flight) < window:
+                    continue
+                _enqueue(in_flight.popleft(), stats, pending, pending_lock, documents, dead_letters, finished)
+            while in_flight:
+                _enqueue(in_flight.popleft(), stats, pending, pending_lock, documents, dead_letters, finished)
+    finally:
+        for _ in range(writers):
+            documents.put(None)
+        for thread in threads[:writers]:
+            thread.join()
+        done.set()
+        progress_points.save()
+        dead_letters.close()
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+def _enqueue(entry, stats, pending, pending_lock, documents, dead_letters, finished):
+    unit, future = entry
+    key = _Checkpoint.key(unit)
+    try:
+        parsed, errors = future.result()
+    except Exception as e:
+        # Not checkpointed, so the chunk is retried when the load is resumed
+        dead_letters.add(key, str(e))
+        with stats._lock:
+            stats.documents_failed += 1
+        return
+    for source, error in errors:
+        dead_letters.add(key, error, text=source)
+    with stats._lock:
+        stats.bytes_parsed += unit[2]
+        stats.documents_parsed += len(parsed)
+        stats.documents_failed += len(errors)
+    with pending_lock:
+        # One extra count for the unit itself, so it can't complete before all documents are queued
+        pending[key] = len(parsed) + 1
+    for document in parsed:
+        documents.put((key, document))
+    finished(key)
+
+
+def main(argv: "Optional[List[str]]" = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m azure.cosmos.load",
+        description="Load JSON and JSON lines files into an Azure Cosmos SQL container.",
+    )
+    parser.add_argument("patterns", nargs="+", help="Files or (recursive) glob patterns to load")
+    parser.add_argument("--url", default=os.environ.get("ACCOUNT_HOST"), help="Account URL (default: $ACCOUNT_HOST)")
+    parser.add_argument("--key", default=os.environ.get("ACCOUNT_KEY"), help="Account key (default: $ACCOUNT_KEY)")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--container", required=True)
+    parser.add_argument("--create", action="store_true", help="Create documents instead of upserting them")
+    parser.add_argument("--processes", type=int, default=None, help="Number of parser processes")
+    parser.add_argument("--writers", type=int, default=16, help="Number of concurrent writes")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--id-from-path", action="store_true")
+    parser.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted load")
+    parser.add_argument("--dead-letter", help="File receiving documents that failed to load")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if not args.url or not args.key:
+        parser.error("--url and --key (or ACCOUNT_HOST and ACCOUNT_KEY) are required")
+
+    from . import CosmosClient
+
+    client = CosmosClient(url=args.url, key=args.key)
+    container = client.get_database(args.database).get_container(args.container)
+    stats = load_files(
+        container,
+        args.patterns,
+        operation="create" if args.create else "upsert",
+        processes=args.processes,
+        writers=args.writers,
+        queue_size=args.queue_size,
+        chunk_size=args.chunk_size,
+        id_from_path=args.id_from_path,
+        checkpoint=args.checkpoint,
+        dead_letter=args.dead_letter,
+        report_interval=args.report_interval,
+        progress=_print_progress,
+    )
+    return 1 if stats.documents_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""
+Streaming cross-partition ORDER BY and DISTINCT within a memory budget
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import marshal
+import re
+import struct
+import tempfile
+import threading
+
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+from .query import QueryPlan
+
+# Number of files DISTINCT state is split into when it outgrows the memory budget
+_FANOUT = 64
+# Approximate memory held per distinct value remembered: a 16 byte digest and its set slot
+_SEEN_ENTRY_BYTES = 96
+# Spill file record header: whether the record only marks a digest as returned, and item length
+_RECORD = struct.Struct("<?I")
+_DIGEST_SIZE = 16
+# Stands in for the item of a record that only marks its digest as already returned
+_RETURNED = object()
+_AS_NAME = re.compile(r"^(?P<expression>.*?)\s+AS\s+(?P<name>\w+)$", re.IGNORECASE | re.DOTALL)
+_LAST_SEGMENT = re.compile(r"(?:\.\s*(\w+)|\[\s*\"([^\"]*)\"\s*\]|\[\s*'([^']*)'\s*\])\s*$")
+
+# Sort order of values of different types, as in Azure Cosmos SQL
+_UNDEFINED, _NULL, _BOOLEAN, _NUMBER, _STRING, _OTHER = range(6)
+
+
+def sort_key(value: "Any", defined: "bool" = True) -> "Tuple[int, Any]":
+    """ Key that orders JSON values the way the service does: undefined, null, booleans, numbers, strings. """
+    if not defined:
+        return (_UNDEFINED, 0)
+    if value is None:
+        return (_NULL, 0)
+    if isinstance(value, bool):
+        return (_BOOLEAN, value)
+    if isinstance(value, (int, float)):
+        return (_NUMBER, value)
+    if isinstance(value, str):
+        return (_STRING, value)
+    return (_OTHER, json.dumps(value, sort_keys=True))
+
+
+class _Descending:
+    """ Sort key wrapper that reverses the order of the key it wraps. """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def _digest(value: "Any") -> "bytes":
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=_DIGEST_SIZE).digest()
+
+
+def _split_top_level(text: "str") -> "List[str]":
+    """ Split a SELECT list on the commas that aren't nested in brackets, parentheses or strings. """
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    escaped = False
+    for i, char in enumerate(text):
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _payload_expression(plan: "QueryPlan") -> "str":
+    """ An expression evaluating to what the query's SELECT list returns for one row. """
+    projection = plan.projection.strip()
+    if projection == "*":
+        return plan.alias or ""
+    if plan.select_value:
+        return projection[len("VALUE "):].strip()
+    properties = []
+    unnamed = 0
+    for term in _split_top_level(projection):
+        named = _AS_NAME.match(term)
+        if named:
+            expression, name = named.group("expression"), named.group("name")
+        else:
+            expression = term
+            segment = _LAST_SEGMENT.search(term)
+            if segment:
+                name = next(part for part in segment.groups() if part is not None)
+            elif re.fullmatch(r"\w+", term):
+                name = term
+            else:
+                unnamed += 1
+                name = f"${unnamed}"
+        properties.append(f"{json.dumps(name)}: {expression}")
+    return "{" + ", ".join(properties) + "}"
+
+
+def rewrite_for_merge(plan: "QueryPlan") -> "str":
+    """ Rewrite an ORDER BY query so that every result carries its sort values next to the projected row.
+
+    Results of the rewritten query are `{"orderByItems": {"0": ..., "1": ...}, "payload": ...}`; sort
+    values that are undefined for a row are missing from `orderByItems`.
+    """
+    if not plan.sort_terms or not plan.alias:
+        raise ValueError(f"Not an ORDER BY query: {plan.query}")
+    prefix = "SELECT "
+    if plan.distinct:
+        prefix += "DISTINCT "
+    if plan.top is not None:
+        prefix += f"TOP {plan.top} "
+    items = ", ".join(
+        f'"{i}": {expression}' for i, (expression, _) in enumerate(plan.sort_terms)
+    )
+    return (
+        f'{prefix}VALUE {{"orderByItems": {{{items}}}, "payload": {_payload_expression(plan)}}} '
+        f"FROM {plan.source}"
+    )
+
+
+class _SpillFile:
+    """ Temporary file of (digest, item) records, items encoded with :mod:`marshal`. """
+
+    def __init__(self, directory: "Optional[str]"):
+        self._file = tempfile.TemporaryFile(dir=directory)  # type: IO[bytes]
+        self.bytes = 0
+
+    def write(self, digest: "bytes", item: "Any" = _RETURNED):
+        returned = item is _RETURNED
+        payload = b"" if returned else marshal.dumps(item)
+        record = _RECORD.pack(returned, len(payload)) + digest + payload
+        self._file.write(record)
+        self.bytes += len(record)
+
+    def read(self) -> "Iterator[Tuple[bytes, Any]]":
+        self._file.flush()
+        self._file.seek(0)
+        header_size = _RECORD.size
+        while True:
+            header = self._file.read(header_size)
+            if len(header) < header_size:
+                return
+            returned, length = _RECORD.unpack(header)
+            digest = self._file.read(_DIGEST_SIZE)
+            payload = self._file.read(length)
+            yield digest, _RETURNED if returned else marshal.loads(payload)
+
+    def close(self):
+        self._file.close()
+
+
+class CrossPartitionMerge:
+    """ Run a cross-partition ORDER BY or DISTINCT query as one query per partition key range, and
+    merge the results on the client as they stream in, in bounded memory.
+
+    Every partition key range returns its results sorted, so an ORDER BY is a k-way merge that only
+    holds one page per range. Page sizes are lowered as needed to keep those pages within
+    `max_memory`. DISTINCT remembers a digest of every result returned; once those outgrow
+    `max_memory`, they and all further results are spilled to temporary files, hash partitioned, and
+    deduplicated one file at a time. With ORDER BY, duplicates have equal sort values, so DISTINCT
+    only remembers the results that share the current sort values.
+
+    Instances are not usually created directly; pass `max_memory` to :func:`Container.query_items`.
+
+    :param container: The container to query.
+    :param query: The query, with ORDER BY and/or DISTINCT, and without aggregates, GROUP BY or OFFSET.
+    :param parameters: Query parameters, as a list of `dict(name=..., value=...)`.
+    :param options: Request options. `maxItemCount` is the largest page size requested.
+    :param max_memory: Approximate number of bytes of results and DISTINCT state held in memory.
+    :param directory: Directory for spill files. Defaults to the system's temporary directory.
+    :param plan: The plan of `query`. Taken from the client's query plan cache if omitted.
+    :param ranges: The container's partition key ranges. Read from the service if omitted.
+    """
+
+    def __init__(
+        self,
+        container: "Container",
+        query: "str",
+        parameters: "Optional[List[Dict[str, Any]]]" = None,
+        *,
+        options: "Optional[Dict[str, Any]]" = None,
+        max_memory: "int" = 64 * 1024 * 1024,
+        directory: "Optional[str]" = None,
+        plan: "Optional[QueryPlan]" = None,
+        ranges: "Optional[List[Dict[str, Any]]]" = None,
+    ):
+        self.container = container
+        self.plan = plan or container.client_context.query_plans.get_or_add(
+            query, lambda: QueryPlan(query)
+        )
+        if self.plan.aggregates or self.plan.group_by_paths or self.plan.offset:
+            raise ValueError(f"Aggregates, GROUP BY and OFFSET can't be merged on the client: {query}")
+        self._ranges = ranges
+        self.parameters = parameters
+        self.options = dict(options or {})
+        self.max_memory = max_memory
+        self.directory = directory
+        self.last_response_headers = {}  # type: Dict[str, Any]
+        self.ranges = 0
+        self.pages = 0
+        self.results = 0
+        self.request_charge = 0.0
+        self.spilled_bytes = 0
+        self.spill_files = 0
+        self._lock = threading.Lock()
+
+    def _top(self) -> "Optional[int]":
+        top = self.plan.top
+        if isinstance(top, str):
+            values = {p["name"]: p["value"] for p in self.parameters or []}
+            top = values.get(top)
+        return None if top is None else int(top)
+
+    def _read_range(
+        self, query: "Dict[str, Any]", range_id: "str", page_size: "int"
+    ) -> "Iterator[Any]":
+        client_context = self.container.client_context
+        max_page_size = page_size
+        continuation = None
+        while True:
+            options = dict(self.options, maxItemCount=page_size)
+            if continuation:
+                options["continuation"] = continuation
+            page, headers = client_context.QueryItemsPage(
+                self.container.collection_link, query, options, range_id
+            )
+            with self._lock:
+                self.pages += 1
+                self.request_charge += float(headers.get("x-ms-request-charge", 0) or 0)
+                self.last_response_headers = headers
+            if page:
+                # Keep the next page of every range within the memory budget
+                item_bytes = max(1, len(json.dumps(page, separators=(",", ":"))) // len(page))
+                page_size = max(
+                    1, min(max_page_size, self.max_memory // (self.ranges * item_bytes))
+                )
+            yield from page
+            continuation = headers.get("x-ms-continuation")
+            if not continuation:
+                return
+
+    def _distinct(
+        self, records: "Iterable[Tuple[bytes, Any]]", level: "int" = 0
+    ) -> "Iterator[Any]":
+        """ Unique items of (digest, item) records; records of `_RETURNED` mark digests already returned. """
+        max_entries = max(1, self.max_memory // _SEEN_ENTRY_BYTES)
+        seen = set()
+        records = iter(records)
+        for digest, item in records:
+            if digest in seen:
+                continue
+            seen.add(digest)
+            if item is not _RETURNED:
+                yield item
+            if len(seen) >= max_entries and level < _DIGEST_SIZE:
+                break
+        else:
+            return
+
+        # Out of memory: partition what was seen and everything still to come on the next digest byte
+        buckets = [_SpillFile(self.directory) for _ in range(_FANOUT)]
+        try:
+            for digest in seen:
+                buckets[digest[level] % _FANOUT].write(digest)
+            seen = None
+            for digest, item in records:
+                buckets[digest[level] % _FANOUT].write(digest, item)
+            with self._lock:
+                self.spill_files += len(buckets)
+                self.spilled_bytes += sum(bucket.bytes for bucket in buckets)
+            for bucket in buckets:
+                yield from self._distinct(bucket.read(), level + 1)
+                bucket.close()
+        finally:
+            for bucket in buckets:
+                bucket.close()
+
+    def __iter__(self) -> "Iterator[Any]":
+        ranges = self._ranges
+        if ranges is None:
+            client_context = self.container.client_context
+            ranges = list(client_context._ReadPartitionKeyRanges(self.container.collection_link))
+        self.ranges = max(1, len(ranges))
+        page_size = int(self.options.get("maxItemCount", 0) or 0) or 100
+        ordered = bool(self.plan.sort_terms)
+        query = dict(
+            query=rewrite_for_merge(self.plan) if ordered else self.plan.query,
+            parameters=self.parameters or [],
+        )
+        streams = [self._read_range(query, pk_range["id"], page_size) for pk_range in ranges]
+
+        if ordered:
+            directions = [direction for _, direction in self.plan.sort_terms]
+
+            def key(result):
+                values = result.get("orderByItems") or {}
+                keys = []
+                for i, direction in enumerate(directions):
+                    name = str(i)
+                    column = sort_key(values.get(name), name in values)
+                    keys.append(_Descending(column) if direction == "DESC" else column)
+                return tuple(keys)
+
+            # Rows whose projection is undefined return nothing, as they would without the rewrite
+            merged = (
+                result for result in heapq.merge(*streams, key=key) if "payload" in result
+            )
+            if self.plan.distinct:
+                results = itertools.chain.from_iterable(
+                    self._distinct((_digest(r["payload"]), r["payload"]) for r in group)
+                    for _, group in itertools.groupby(merged, key=key)
+                )
+            else:
+                results = (result["payload"] for result in merged)
+        else:
+            merged = itertools.chain.from_iterable(streams)
+            results = self._distinct((_digest(item), item) for item in merged)
+
+        top = self._top()
+        for result in itertools.islice(results, top):
+            self.results += 1
+            yield result
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._lock:
+            return dict(
+                ranges=self.ranges,
+                pages=self.pages,
+                results=self.results,
+                request_charge=self.request_charge,
+                spill_files=self.spill_files,
+                spilled_bytes=self.spilled_bytes,
+            )
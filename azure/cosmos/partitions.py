@@ -0,0 +1,365 @@
+"""
+Partition key traffic and storage skew
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+from urllib.parse import unquote, urlsplit
+
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+PARTITION_KEY_HEADER = "x-ms-documentdb-partitionkey"
+PARTITION_KEY_RANGE_HEADER = "x-ms-documentdb-partitionkeyrangeid"
+
+
+class SpaceSaving:
+    """ Bounded memory heavy hitter sketch (Metwally et al's Space-Saving), with weighted updates.
+
+    At most `capacity` keys are tracked. A key that isn't tracked replaces the one with the lowest
+    count, and inherits that count as its error, so estimates never under count: a key with more
+    than `total / capacity` weight is guaranteed to be tracked.
+
+    :param capacity: Number of keys tracked.
+    """
+
+    def __init__(self, capacity: "int" = 1000):
+        if capacity <= 0:
+            raise ValueError("capacity must be a positive integer")
+        self.capacity = capacity
+        self.total = 0.0
+        self._counts = {}  # type: Dict[Hashable, float]
+        self._errors = {}  # type: Dict[Hashable, float]
+        # (count, key) entries; entries whose count is out of date are skipped when popped
+        self._heap = []  # type: List[Tuple[float, Any]]
+        self._lock = threading.Lock()
+
+    def add(self, key: "Hashable", weight: "float" = 1.0):
+        with self._lock:
+            self.total += weight
+            if key not in self._counts and len(self._counts) >= self.capacity:
+                while True:
+                    count, entry = heapq.heappop(self._heap)
+                    victim = entry.key
+                    if self._counts.get(victim) == count:
+                        break
+                del self._counts[victim]
+                del self._errors[victim]
+                self._counts[key] = count
+                self._errors[key] = count
+            count = self._counts.get(key, 0.0) + weight
+            self._counts[key] = count
+            self._errors.setdefault(key, 0.0)
+            heapq.heappush(self._heap, (count, _Key(key)))
+            if len(self._heap) > 4 * self.capacity:
+                self._heap = [(count, _Key(key)) for key, count in self._counts.items()]
+                heapq.heapify(self._heap)
+
+    def top(self, k: "int" = 10) -> "List[Tuple[Any, float, float]]":
+        """ The `k` heaviest keys, as (key, estimated weight, maximum over estimation). """
+        with self._lock:
+            heaviest = heapq.nlargest(k, self._counts.items(), key=lambda item: item[1])
+            return [(key, count, self._errors[key]) for key, count in heaviest]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class _Key:
+    """ Heap entry key that never compares, so that keys of any (mixed) type can share a heap. """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return False
+
+
+class PartitionStats:
+    """ Requests, request charge and throttled (429) responses of a container, per partition key
+    value and per partition key range.
+
+    Partition key values are tracked with :class:`SpaceSaving` sketches of `capacity` keys;
+    partition key ranges are few, and counted exactly.
+    """
+
+    DIMENSIONS = ("requests", "request_charge", "throttled")
+
+    def __init__(self, capacity: "int" = 1000):
+        self.keys = {name: SpaceSaving(capacity) for name in self.DIMENSIONS}
+        self.ranges = defaultdict(lambda: dict.fromkeys(self.DIMENSIONS, 0.0))  # type: Dict[str, Dict[str, float]]
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        partition_key: "Optional[str]",
+        range_id: "Optional[str]",
+        request_charge: "float",
+        throttled: "bool",
+    ):
+        if partition_key is not None:
+            self.keys["requests"].add(partition_key)
+            if request_charge:
+                self.keys["request_charge"].add(partition_key, request_charge)
+            if throttled:
+                self.keys["throttled"].add(partition_key)
+        if range_id is not None:
+            with self._lock:
+                counters = self.ranges[range_id]
+                counters["requests"] += 1
+                counters["request_charge"] += request_charge
+                counters["throttled"] += throttled
+
+    def hot_keys(self, k: "int" = 10, by: "str" = "request_charge") -> "List[Dict[str, Any]]":
+        """ The `k` partition key values with the most `by` ('requests', 'request_charge' or 'throttled').
+
+        Values are the JSON encoded partition key, as sent in the partition key header.
+        """
+        sketch = self.keys[by]
+        return [
+            dict(
+                partition_key=key,
+                share=count / sketch.total if sketch.total else 0.0,
+                estimate=count,
+                error=error,
+            )
+            for key, count, error in sketch.top(k)
+        ]
+
+    def skew(self, by: "str" = "request_charge") -> "Optional[float]":
+        """ Load of the busiest partition key range relative to the mean over all ranges seen.
+
+        1.0 means evenly spread; the number of ranges means all load is on one range. None until a range was seen.
+        """
+        with self._lock:
+            loads = [counters[by] for counters in self.ranges.values()]
+        if not loads or not sum(loads):
+            return None
+        return max(loads) / (sum(loads) / len(loads))
+
+    def stats(self, k: "int" = 10) -> "Dict[str, Any]":
+        with self._lock:
+            ranges = {range_id: dict(counters) for range_id, counters in self.ranges.items()}
+        return dict(
+            requests=self.keys["requests"].total,
+            request_charge=self.keys["request_charge"].total,
+            throttled=self.keys["throttled"].total,
+            skew=self.skew(),
+            hot_keys=self.hot_keys(k),
+            throttled_keys=self.hot_keys(k, by="throttled"),
+            ranges=ranges,
+        )
+
+
+class PartitionTracker:
+    """ :class:`PartitionStats` per container, fed from the requests sent by a :class:`CosmosSession`.
+
+    :param capacity: Number of partition key values tracked per container and dimension.
+    """
+
+    def __init__(self, capacity: "int" = 1000):
+        self.capacity = capacity
+        self._containers = {}  # type: Dict[str, PartitionStats]
+        self._lock = threading.Lock()
+
+    def get(self, collection_link: "str") -> "PartitionStats":
+        collection_link = collection_link.strip("/")
+        with self._lock:
+            stats = self._containers.get(collection_link)
+            if stats is None:
+                stats = self._containers[collection_link] = PartitionStats(self.capacity)
+            return stats
+
+    def record(
+        self,
+        url: "str",
+        request_headers: "Optional[Dict[str, Any]]",
+        status_code: "int",
+        response_headers: "Dict[str, Any]",
+    ):
+        segments = [unquote(segment) for segment in urlsplit(url).path.strip("/").split("/")]
+        if len(segments) < 4 or segments[0] != "dbs" or segments[2] != "colls":
+            return
+        request_headers = {key.lower(): value for key, value in (request_headers or {}).items()}
+        range_id = response_headers.get(PARTITION_KEY_RANGE_HEADER) or request_headers.get(
+            PARTITION_KEY_RANGE_HEADER
+        )
+        self.get("/".join(segments[:4])).record(
+            request_headers.get(PARTITION_KEY_HEADER),
+            range_id,
+            float(response_headers.get("x-ms-request-charge", 0) or 0),
+            status_code == 429,
+        )
+
+
+def is_range_gone(error: "BaseException") -> "bool":
+    """ True if `error` is the service's answer to a request for a partition key range that was split
+    (410 Gone, sub-status 1002). The ranges have to be read again. """
+    return getattr(error, "status_code", None) == 410 and getattr(error, "sub_status", None) == 1002
+
+
+def _value_at(document: "Dict[str, Any]", path: "str") -> "Any":
+    value = document
+    for segment in path.strip("/").split("/"):
+        if not isinstance(value, dict) or segment not in value:
+            return None
+        value = value[segment]
+    return value
+
+
+def _sample_range(
+    client_context: "Any", collection_link: "str", range_id: "str", size: "int", strata: "int"
+) -> "Iterator[Dict[str, Any]]":
+    """ About `size` documents of one partition key range, spread over windows of its `_ts` span.
+    A window with fewer documents than its share leaves the rest to the following windows. """
+
+    def query(text, parameters, limit=None):
+        continuation = None
+        read = 0
+        while limit is None or read < limit:
+            options = dict(maxItemCount=1000 if limit is None else min(1000, limit - read))
+            if continuation:
+                options["continuation"] = continuation
+            page, headers = client_context.QueryItemsPage(
+                collection_link,
+                dict(query=text, parameters=parameters),
+                options=options,
+                partition_key_range_id=range_id,
+            )
+            yield from page
+            read += len(page)
+            continuation = headers.get("x-ms-continuation")
+            if not continuation:
+                return
+
+    bounds = [
+        [value for value in query(f"SELECT VALUE {function}(c._ts) FROM c", []) if value is not None]
+        for function in ("MIN", "MAX")
+    ]
+    if not all(bounds):
+        return
+    first, last = min(bounds[0]), max(bounds[1]) + 1
+    strata = max(1, min(strata, size, last - first))
+    read = 0
+    for stratum in range(strata):
+        start = first + (last - first) * stratum // strata
+        end = first + (last - first) * (stratum + 1) // strata
+        share = size * (stratum + 1) // strata - read
+        if share <= 0:
+            continue
+        for document in query(
+            "SELECT * FROM c WHERE c._ts >= @start AND c._ts < @end",
+            [dict(name="@start", value=start), dict(name="@end", value=end)],
+            share,
+        ):
+            read += 1
+            yield document
+
+
+def analyze_partition_key(
+    container: "Container",
+    path: "str",
+    *,
+    sample_size: "int" = 10000,
+    partitions: "Optional[int]" = None,
+    top: "int" = 10,
+    strata: "int" = 10,
+) -> "Dict[str, Any]":
+    """ Estimate how evenly the documents of `container` would be stored if partitioned on `path`.
+
+    An even share of `sample_size` documents is read from every partition key range, and grouped by
+    their value at `path`. Rather than the first documents of a range in storage order, which tend to
+    be its oldest, the share is spread over the range's span of modification times (`_ts`), in up to
+    `strata` windows of equal length. The values are hashed into `partitions` buckets (by default,
+    the number of partition key ranges the container has now), standing in for physical partitions.
+
+    :param container: The container to sample.
+    :param path: Candidate partition key path, such as '/AccountNumber'.
+    :param sample_size: Approximate number of documents to read.
+    :param partitions: Number of physical partitions to estimate the spread over.
+    :param top: Number of largest partition key values to report.
+    :param strata: Number of `_ts` windows the sample of each range is spread over.
+    :returns: The number of documents sampled, of distinct values and of documents without a value,
+        the largest values with their share of the sampled bytes, and `skew`: the largest bucket's
+        bytes relative to the mean bucket.
+    """
+    client_context = container.client_context
+    ranges = list(client_context._ReadPartitionKeyRanges(container.collection_link))
+    per_range = max(1, sample_size // max(1, len(ranges)))
+    sizes = defaultdict(int)  # type: Dict[str, int]
+    documents = 0
+    missing = 0
+    for pk_range in ranges:
+        sample = _sample_range(
+            client_context, container.collection_link, pk_range["id"], per_range, strata
+        )
+        for document in sample:
+            value = _value_at(document, path)
+            if value is None:
+                missing += 1
+            sizes[json.dumps(value)] += len(json.dumps(document, separators=(",", ":")))
+            documents += 1
+
+    buckets = [0] * (partitions or max(1, len(ranges)))
+    for value, size in sizes.items():
+        bucket = int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+        buckets[bucket % len(buckets)] += size
+    total = sum(sizes.values())
+    largest = sorted(sizes.items(), key=lambda item: -item[1])[:top]
+    return dict(
+        path=path,
+        documents=documents,
+        distinct_values=len(sizes),
+        missing=missing,
+        partitions=len(buckets),
+        skew=max(buckets) / (total / len(buckets)) if total else None,
+        largest=[
+            dict(partition_key=value, bytes=size, share=size / total) for value, size in largest
+        ],
+    )
+
+
+def main(argv: "Optional[List[str]]" = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m azure.cosmos.partitions",
+        description="Estimate the storage skew of candidate partition key paths from a sample of a container.",
+    )
+    parser.add_argument("paths", nargs="+", help="Candidate partition key paths, such as /AccountNumber")
+    parser.add_argument("--url", default=os.environ.get("ACCOUNT_HOST"), help="Account URL (default: $ACCOUNT_HOST)")
+    parser.add_argument("--key", default=os.environ.get("ACCOUNT_KEY"), help="Account key (default: $ACCOUNT_KEY)")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--container", required=True)
+    parser.add_argument("--sample-size", type=int, default=10000)
+    parser.add_argument("--partitions", type=int, default=None, help="Number of physical partitions to assume")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--strata", type=int, default=10, help="Number of _ts windows to spread the sample of each range over")
+    args = parser.parse_args(argv)
+    if not args.url or not args.key:
+        parser.error("--url and --key (or ACCOUNT_HOST and ACCOUNT_KEY) are required")
+
+    from . import CosmosClient
+
+    client = CosmosClient(url=args.url, key=args.key)
+    container = client.get_database(args.database).get_container(args.container)
+    for path in args.paths:
+        result = analyze_partition_key(
+            container,
+            path,
+            sample_size=args.sample_size,
+            partitions=args.partitions,
+            top=args.top,
+            strata=args.strata,
+        )
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Partial document update (patch) operations
+"""
+
+from typing import Any, Dict, List
+
+# Properties maintained by the service; they are never part of a patch
+SYSTEM_PROPERTIES = frozenset(["id", "_rid", "_self", "_etag", "_ts", "_attachments"])
+
+# Maximum number of operations the service accepts in a single patch request
+MAX_OPERATIONS = 10
+
+
+class PatchOperation:
+    """ Factory for the operations accepted by :func:`Container.patch_item`.
+
+    Paths are JSON pointers into the document, e.g. ``/address/state`` or ``/children/0``.
+
+    .. code-block:: python
+
+        container.patch_item(item, [
+            PatchOperation.set('/firstName', 'David'),
+            PatchOperation.increment('/visits'),
+            PatchOperation.remove('/nickname'),
+        ])
+    """
+
+    @staticmethod
+    def set(path: "str", value: "Any") -> "Dict[str, Any]":
+        """ Set the value at `path`, creating the property if it doesn't exist. """
+        return dict(op="set", path=path, value=value)
+
+    @staticmethod
+    def add(path: "str", value: "Any") -> "Dict[str, Any]":
+        """ Add a property, or insert into an array at the given index (``/tags/-`` appends). """
+        return dict(op="add", path=path, value=value)
+
+    @staticmethod
+    def replace(path: "str", value: "Any") -> "Dict[str, Any]":
+        """ Replace the value at `path`, which must already exist. """
+        return dict(op="replace", path=path, value=value)
+
+    @staticmethod
+    def remove(path: "str") -> "Dict[str, Any]":
+        """ Remove the property (or array element) at `path`. """
+        return dict(op="remove", path=path)
+
+    @staticmethod
+    def increment(path: "str", value: "int" = 1) -> "Dict[str, Any]":
+        """ Increment the number at `path` by `value` on the server. """
+        return dict(op="incr", path=path, value=value)
+
+
+def _escape(key: "str") -> "str":
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def diff(original: "Dict[str, Any]", updated: "Dict[str, Any]") -> "List[Dict[str, Any]]":
+    """ Compute the patch operations that turn `original` into `updated`.
+
+    Nested objects are compared property by property; arrays and scalars that changed are replaced
+    as a whole. Top-level system properties are ignored.
+    """
+    operations = []  # type: List[Dict[str, Any]]
+    _diff_object(original, updated, "", operations, top_level=True)
+    return operations
+
+
+def _diff_object(original, updated, prefix, operations, top_level=False):
+    for key, value in original.items():
+        if top_level and key in SYSTEM_PROPERTIES:
+            continue
+        if key not in updated:
+            operations.append(PatchOperation.remove(f"{prefix}/{_escape(key)}"))
+    for key, value in updated.items():
+        if top_level and key in SYSTEM_PROPERTIES:
+            continue
+        path = f"{prefix}/{_escape(key)}"
+        if key not in original:
+            operations.append(PatchOperation.add(path, value))
+        elif isinstance(value, dict) and isinstance(original[key], dict):
+            _diff_object(original[key], value, path, operations)
+        elif value != original[key] or type(value) is not type(original[key]):
+            operations.append(PatchOperation.set(path, value))
@@ -0,0 +1,269 @@
+"""
+Permissions and client-side caching of the resource tokens they grant
+"""
+
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from .concurrency import SingleFlight
+
+# Lifetime the service gives resource tokens unless asked otherwise
+DEFAULT_TOKEN_EXPIRY = 3600
+# Tokens this close to expiry are not handed out: a caller must have time to use them
+MIN_TOKEN_LIFETIME = 30.0
+
+_MODES = {"read": "Read", "all": "All"}
+
+
+def permission_mode(mode: "str") -> "str":
+    """ The service's name for a permission mode: 'Read' or 'All'. """
+    try:
+        return _MODES[mode.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown permission mode {mode}; expected 'read' or 'all'")
+
+
+def resource_link(resource: "Any") -> "str":
+    """ The link of a container, database or item, or of a link, without surrounding slashes. """
+    if isinstance(resource, str):
+        return resource.strip("/")
+    for attribute in ("collection_link", "database_link", "self_link"):
+        link = getattr(resource, attribute, None)
+        if link:
+            return link.strip("/")
+    raise TypeError(f"Can't tell the resource link of {resource!r}")
+
+
+class Permission:
+    """ A user's permission on a resource, and the resource token it grants.
+
+    Instances are not created directly; use :func:`User.create_permission` or :func:`User.get_permission`.
+
+    :ivar id: Id of the permission.
+    :ivar permission_link: Link of the permission.
+    :ivar permission_mode: 'Read' or 'All'.
+    :ivar resource_link: Link of the resource access is granted to, and to everything below it.
+    :ivar resource_partition_key: If set, access is restricted to items with this partition key.
+    :ivar token: The resource token, if it was read along with the permission.
+    :ivar expires: Time (as from `time.time()`) at which the token expires.
+    """
+
+    def __init__(
+        self,
+        user_link: "str",
+        properties: "Dict[str, Any]",
+        expiry_seconds: "Optional[int]" = None,
+        read_at: "Optional[float]" = None,
+    ):
+        self.properties = properties
+        self.id = properties["id"]
+        self.permission_link = f"{user_link}/permissions/{self.id}"
+        self.permission_mode = properties.get("permissionMode")
+        self.resource_link = resource_link(properties.get("resource", ""))
+        self.resource_partition_key = properties.get("resourcePartitionKey")
+        self.token = properties.get("_token")
+        self.expires = (read_at or time.time()) + (expiry_seconds or DEFAULT_TOKEN_EXPIRY)
+
+    def covers(self, link: "str", partition_key: "Optional[Any]" = None) -> "bool":
+        """ Whether the token grants access to the resource at `link` (with `partition_key`, if given). """
+        link = link.strip("/")
+        if link != self.resource_link and not link.startswith(self.resource_link + "/"):
+            return False
+        if self.resource_partition_key is None or partition_key is None:
+            return True
+        return self.resource_partition_key == [partition_key] or self.resource_partition_key == partition_key
+
+    def __repr__(self):
+        return f"Permission({self.permission_link!r}, {self.permission_mode!r}, {self.resource_link!r})"
+
+
+class _UserTokens:
+    __slots__ = ("permissions", "expires", "refresh_at", "last_used")
+
+    def __init__(self, permissions: "List[Permission]", expires: "float", refresh_at: "float"):
+        self.permissions = permissions
+        self.expires = expires
+        self.refresh_at = refresh_at
+        self.last_used = time.time()
+
+
+class ResourceTokenCache:
+    """ Resource tokens of users, read once per user and refreshed in the background before they expire.
+
+    All of a user's permissions are read in one request, with tokens valid for `expiry_seconds`.
+    Once a user's tokens are `refresh_before` (a fraction of their lifetime) from expiry, they are
+    read again by a background thread, while the current ones are still handed out. Only a user
+    without valid tokens (never seen, or idle for longer than their lifetime) makes the caller
+    wait; concurrent callers then share a single read.
+
+    Users that haven't asked for a token within `idle_timeout` seconds are not refreshed.
+
+    Instances are not created directly; use :func:`CosmosClient.enable_resource_token_cache`.
+
+    :param client_context: The client to read permissions with.
+    :param expiry_seconds: Requested lifetime of the tokens, in seconds (the service accepts 600 to 18000).
+    :param refresh_before: Fraction (0-1) of a token's lifetime before its expiry at which it is refreshed.
+    :param idle_timeout: Seconds after its last use that a user's tokens stop being refreshed.
+        Defaults to `expiry_seconds`.
+    """
+
+    def __init__(
+        self,
+        client_context,
+        *,
+        expiry_seconds: "int" = DEFAULT_TOKEN_EXPIRY,
+        refresh_before: "float" = 0.25,
+        idle_timeout: "Optional[float]" = None,
+    ):
+        if not 0 < refresh_before < 1:
+            raise ValueError("refresh_before must be between 0 and 1")
+        self.client_context = client_context
+        self.expiry_seconds = expiry_seconds
+        self.refresh_before = refresh_before
+        self.idle_timeout = expiry_seconds if idle_timeout is None else idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._users = {}  # type: Dict[str, _UserTokens]
+        self._flight = SingleFlight()
+        self._condition = threading.Condition()
+        self._refresher = None  # type: Optional[threading.Thread]
+        self._closed = False
+
+    def get(
+        self, user: "Any", resource: "Any", partition_key: "Optional[Any]" = None
+    ) -> "Permission":
+        """ The permission, with its token, that grants `user` access to `resource`.
+
+        :param user: A :class:`User`, or the link of one.
+        :param resource: A container or database, or the link of a resource.
+        :param partition_key: If given, the partition key the token must give access to.
+        :raises LookupError: If the user has no permission on the resource.
+        """
+        user_link = resource_link(getattr(user, "user_link", user))
+        link = resource_link(resource)
+        now = time.time()
+        with self._condition:
+            tokens = self._users.get(user_link)
+            usable = tokens is not None and now < tokens.expires - MIN_TOKEN_LIFETIME
+            if usable:
+                self.hits += 1
+                tokens.last_used = now
+            else:
+                self.misses += 1
+        if not usable:
+            tokens = self._flight.do(user_link, lambda: self._read(user_link))
+            with self._condition:
+                # The tokens may have been invalidated or dropped from the cache since; use them anyway
+                tokens = self._users.get(user_link, tokens)
+                tokens.last_used = now
+        self._start_refresher()
+
+        # The most specific permission wins, e.g. one on a container over one on its database
+        matches = [p for p in tokens.permissions if p.covers(link, partition_key)]
+        if not matches:
+            raise LookupError(f"User {user_link} has no permission on {link}")
+        return max(matches, key=lambda p: len(p.resource_link))
+
+    def token(self, user: "Any", resource: "Any", partition_key: "Optional[Any]" = None) -> "str":
+        """ The resource token that grants `user` access to `resource`; see :func:`ResourceTokenCache.get`. """
+        return self.get(user, resource, partition_key).token
+
+    def invalidate(self, user: "Optional[Any]" = None):
+        """ Forget the tokens of `user`, or of every user, e.g. after their permissions changed. """
+        with self._condition:
+            if user is None:
+                self._users.clear()
+            else:
+                self._users.pop(resource_link(getattr(user, "user_link", user)), None)
+
+    def _read(self, user_link: "str") -> "_UserTokens":
+        read_at = time.time()
+        permissions = [
+            Permission(user_link, properties, self.expiry_seconds, read_at)
+            for properties in self.client_context.ReadPermissions(
+                user_link, dict(resourceTokenExpirySeconds=self.expiry_seconds)
+            )
+        ]
+        expires = read_at + self.expiry_seconds
+        tokens = _UserTokens(
+            permissions, expires, expires - self.refresh_before * self.expiry_seconds
+        )
+        with self._condition:
+            previous = self._users.get(user_link)
+            if previous is not None:
+                tokens.last_used = previous.last_used
+            self._users[user_link] = tokens
+            self._condition.notify_all()
+        return tokens
+
+    def _start_refresher(self):
+        if self._refresher is not None or self._closed:
+            return
+        with self._condition:
+            if self._refresher is None:
+                self._refresher = threading.Thread(
+                    target=self._refresh_loop, name="cosmos-resource-tokens", daemon=True
+                )
+                self._refresher.start()
+
+    def _due(self, now: "float") -> "Tuple[List[str], Optional[float]]":
+        """ Users whose tokens should be refreshed now, and when the next ones will be due. """
+        due = []
+        upcoming = []
+        for user_link, tokens in list(self._users.items()):
+            if now - tokens.last_used > self.idle_timeout:
+                if now >= tokens.expires:
+                    del self._users[user_link]
+                continue
+            if now >= tokens.refresh_at:
+                due.append(user_link)
+            else:
+                upcoming.append(tokens.refresh_at)
+        return due, min(upcoming) if upcoming else None
+
+    def _refresh_loop(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                due, next_due = self._due(time.time())
+                if not due:
+                    self._condition.wait(None if next_due is None else next_due - time.time())
+                    continue
+            for user_link in due:
+                try:
+                    self._flight.do(user_link, lambda: self._read(user_link))
+                    self.refreshes += 1
+                except Exception:
+                    # Keep handing out the current tokens, and try again halfway to their expiry
+                    self.refresh_errors += 1
+                    with self._condition:
+                        tokens = self._users.get(user_link)
+                        if tokens is not None:
+                            now = time.time()
+                            tokens.refresh_at = now + max(1.0, (tokens.expires - now) / 2)
+
+    def close(self):
+        """ Stop refreshing tokens in the background. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._condition:
+            users = len(self._users)
+        return dict(
+            users=users,
+            hits=self.hits,
+            misses=self.misses,
+            refreshes=self.refreshes,
+            refresh_errors=self.refresh_errors,
+            coalesced=self._flight.coalesced,
+        )
+
+    def __len__(self) -> "int":
+        return len(self._users)
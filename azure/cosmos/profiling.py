@@ -0,0 +1,323 @@
+"""
+Per-phase timing of client operations
+"""
+
+import functools
+import inspect
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Phases an operation's time is split into, in the order they normally occur. Time not spent in any
+# of these (argument handling, building headers, retries' bookkeeping) is reported as 'other'.
+PHASES = ("serialize", "sign", "send", "wait", "decode", "other")
+
+# The span of the operation being profiled on the current thread, if any
+_local = threading.local()
+_logger = logging.getLogger(__name__)
+
+
+class Span:
+    """ Timings of a single profiled operation.
+
+    :ivar operation: Name of the operation, e.g. 'Container.upsert_item'.
+    :ivar start_time: Wall clock time the operation started at, in nanoseconds since the epoch.
+    :ivar duration: Elapsed time of the operation, in seconds.
+    :ivar cpu_time: CPU time the calling thread spent on the operation, in seconds.
+    :ivar phases: Elapsed time per phase, in seconds.
+    :ivar cpu_phases: CPU time per phase, in seconds.
+    :ivar segments: The operation's timeline as (phase, start, end) tuples, in nanoseconds since the epoch.
+    :ivar profiler: The profiler the span is reported to.
+    """
+
+    def __init__(self, operation: "str", profiler: "Optional[Profiler]" = None):
+        self.operation = operation
+        self.profiler = profiler
+        self.start_time = time.time_ns()
+        self.duration = 0.0
+        self.cpu_time = 0.0
+        self.phases = defaultdict(float)  # type: Dict[str, float]
+        self.cpu_phases = defaultdict(float)  # type: Dict[str, float]
+        self.segments = []  # type: List[Tuple[str, int, int]]
+        self._phase = "other"
+        self._started = self._mark = time.perf_counter_ns()
+        self._cpu_started = self._cpu_mark = time.thread_time_ns()
+
+    def switch(self, phase: "str") -> "str":
+        """ End the current phase and start `phase`. Returns the phase that ended. """
+        now = time.perf_counter_ns()
+        cpu_now = time.thread_time_ns()
+        previous = self._phase
+        if now > self._mark:
+            self.phases[previous] += (now - self._mark) / 1e9
+            self.cpu_phases[previous] += (cpu_now - self._cpu_mark) / 1e9
+            offset = self.start_time - self._started
+            self.segments.append((previous, self._mark + offset, now + offset))
+        self._phase = phase
+        self._mark = now
+        self._cpu_mark = cpu_now
+        return previous
+
+    def _finish(self):
+        self.switch("other")
+        self.duration = (self._mark - self._started) / 1e9
+        self.cpu_time = (self._cpu_mark - self._cpu_started) / 1e9
+
+
+def phase(name: "str", fn: "Callable", *args, **kwargs) -> "Any":
+    """ Call `fn`, attributing its time to phase `name` of the operation being profiled on this thread. """
+    span = getattr(_local, "span", None)
+    if span is None:
+        return fn(*args, **kwargs)
+    previous = span.switch(name)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        span.switch(previous)
+
+
+def enter_phase(name: "str"):
+    """ Attribute the time from now on to phase `name`, until another phase starts or the operation ends. """
+    span = getattr(_local, "span", None)
+    if span is not None:
+        span.switch(name)
+
+
+def propagate(fn: "Callable", suffix: "str") -> "Callable":
+    """ Wrap `fn` to be profiled, when called on another thread, as an operation of its own named after
+    the one being profiled on this thread, e.g. 'Container.get_item.hedge' for suffix 'hedge'. """
+    span = getattr(_local, "span", None)
+    if span is None or span.profiler is None:
+        return fn
+    profiler = span.profiler
+    operation = f"{span.operation}.{suffix}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return profiler._profile(operation, fn, *args, **kwargs)
+
+    return wrapper
+
+
+def instrument(module: "Any", attribute: "str", phase_name: "str"):
+    """ Replace the function `module.attribute`, whose first argument is the client it is called for, with
+    one whose time is attributed to `phase_name` for clients with profiling enabled. Calls for other
+    clients go straight to the original function. """
+    original = getattr(module, attribute)
+    if getattr(original, "_profiling_phase", None) is not None:
+        return
+
+    @functools.wraps(original)
+    def instrumented(client, *args, **kwargs):
+        if getattr(client, "profiler", None) is None:
+            return original(client, *args, **kwargs)
+        return phase(phase_name, original, client, *args, **kwargs)
+
+    instrumented._profiling_phase = phase_name
+    setattr(module, attribute, instrumented)
+
+
+def instrument_serialization(module: "Any"):
+    """ Replace `module.SynchronizedRequest` with one that serializes the request bodies of clients with
+    profiling enabled in the 'serialize' phase, with `module._RequestBodyFromData`, before handing them on.
+    Requests of other clients go straight to the original function. """
+    original = module.SynchronizedRequest
+    if getattr(original, "_profiling_phase", None) is not None:
+        return
+
+    @functools.wraps(original)
+    def SynchronizedRequest(client, *args, **kwargs):
+        # The request body is the 8th argument: client, request, global_endpoint_manager,
+        # connection_policy, requests_session, method, path, request_data, ...
+        if getattr(client, "profiler", None) is not None and len(args) >= 7:
+            if isinstance(args[6], (dict, list, tuple)):
+                body = phase("serialize", module._RequestBodyFromData, args[6])
+                args = args[:6] + (body,) + args[7:]
+        return original(client, *args, **kwargs)
+
+    SynchronizedRequest._profiling_phase = "serialize"
+    module.SynchronizedRequest = SynchronizedRequest
+
+
+class _OperationStats:
+    __slots__ = ("count", "duration", "cpu_time", "phases", "cpu_phases")
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.cpu_time = 0.0
+        self.phases = defaultdict(float)  # type: Dict[str, float]
+        self.cpu_phases = defaultdict(float)  # type: Dict[str, float]
+
+    def add(self, span: "Span"):
+        self.count += 1
+        self.duration += span.duration
+        self.cpu_time += span.cpu_time
+        for name, value in span.phases.items():
+            self.phases[name] += value
+        for name, value in span.cpu_phases.items():
+            self.cpu_phases[name] += value
+
+
+class Profiler:
+    """ Time the phases of client operations: serializing the request body, signing the request,
+    sending it, waiting for the response, and decoding it into results.
+
+    A `sample_rate` fraction of operations is profiled; the others only pay for checking whether
+    profiling is enabled. Totals per operation type are kept for :func:`Profiler.report`, and every
+    profiled operation's :class:`Span` is passed to `exporter`, if set.
+
+    Instances are not created directly; use :func:`CosmosClient.enable_profiling`.
+
+    :param sample_rate: Fraction (0-1) of operations to profile.
+    :param exporter: Called with the :class:`Span` of every profiled operation, e.g. an :class:`OpenTelemetryExporter`.
+    """
+
+    def __init__(
+        self,
+        sample_rate: "float" = 1.0,
+        exporter: "Optional[Callable[[Span], None]]" = None,
+    ):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self._operations = defaultdict(_OperationStats)  # type: Dict[str, _OperationStats]
+        self._lock = threading.Lock()
+
+    def run(self, operation: "str", fn: "Callable", *args, **kwargs) -> "Any":
+        """ Call `fn`, profiling it as `operation` if sampled. Nested operations count towards the outermost one. """
+        if getattr(_local, "span", None) is not None or (
+            self.sample_rate < 1 and random.random() >= self.sample_rate
+        ):
+            return fn(*args, **kwargs)
+        return self._profile(operation, fn, *args, **kwargs)
+
+    def _profile(self, operation: "str", fn: "Callable", *args, **kwargs) -> "Any":
+        span = _local.span = Span(operation, self)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.span = None
+            span._finish()
+            with self._lock:
+                self._operations[operation].add(span)
+            if self.exporter is not None:
+                try:
+                    self.exporter(span)
+                except Exception:
+                    # A failing exporter mustn't fail, or hide the outcome of, the operation
+                    _logger.exception("Exporting the profile of %s failed", operation)
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+    def stats(self) -> "Dict[str, Dict[str, Any]]":
+        """ Per operation type: number of profiled operations, and their mean elapsed and CPU time per phase, in seconds. """
+        with self._lock:
+            return {
+                operation: dict(
+                    count=totals.count,
+                    duration=totals.duration / totals.count,
+                    cpu_time=totals.cpu_time / totals.count,
+                    phases={name: totals.phases[name] / totals.count for name in PHASES},
+                    cpu_phases={name: totals.cpu_phases[name] / totals.count for name in PHASES},
+                )
+                for operation, totals in self._operations.items()
+            }
+
+    def report(self) -> "str":
+        """ A table of mean elapsed / CPU milliseconds per phase for every operation type, slowest first. """
+        stats = self.stats()
+        lines = [
+            f"{'operation':<32} {'count':>7} {'total':>15} "
+            + " ".join(f"{name:>15}" for name in PHASES)
+        ]
+        for operation, values in sorted(stats.items(), key=lambda item: -item[1]["duration"]):
+            cells = [_milliseconds(values["duration"], values["cpu_time"])] + [
+                _milliseconds(values["phases"][name], values["cpu_phases"][name])
+                for name in PHASES
+            ]
+            lines.append(
+                f"{operation:<32} {values['count']:>7} " + " ".join(f"{cell:>15}" for cell in cells)
+            )
+        lines.append("(mean elapsed / CPU milliseconds per operation)")
+        return "\n".join(lines)
+
+
+def _milliseconds(elapsed: "float", cpu: "float") -> "str":
+    return f"{elapsed * 1000:.2f}/{cpu * 1000:.2f}"
+
+
+def profiled(method: "Callable") -> "Callable":
+    """ Profile calls of a method of an object with a `client_context`, if profiling is enabled for it.
+
+    For generator methods, the time until the first result is produced is profiled.
+    """
+    if inspect.isgeneratorfunction(method):
+
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            profiler = self.client_context.profiler
+            results = method(self, *args, **kwargs)
+            if profiler is None:
+                yield from results
+                return
+            try:
+                first = profiler.run(
+                    f"{type(self).__name__}.{method.__name__}", next, results
+                )
+            except StopIteration:
+                return
+            yield first
+            yield from results
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        profiler = self.client_context.profiler
+        if profiler is None:
+            return method(self, *args, **kwargs)
+        return profiler.run(
+            f"{type(self).__name__}.{method.__name__}", method, self, *args, **kwargs
+        )
+
+    return wrapper
+
+
+class OpenTelemetryExporter:
+    """ Export profiled operations as OpenTelemetry spans, with a child span per phase.
+
+    Requires the `opentelemetry-api` package.
+
+    :param tracer: The tracer to create spans with. Defaults to the global tracer provider's tracer for 'azure.cosmos'.
+    """
+
+    def __init__(self, tracer: "Any" = None):
+        if tracer is None:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError("OpenTelemetryExporter requires the 'opentelemetry-api' package")
+            tracer = trace.get_tracer("azure.cosmos")
+        self.tracer = tracer
+
+    def __call__(self, span: "Span"):
+        from opentelemetry import trace
+
+        end_time = span.start_time + int(span.duration * 1e9)
+        parent = self.tracer.start_span(
+            span.operation,
+            start_time=span.start_time,
+            attributes={"cosmos.cpu_time_ms": span.cpu_time * 1000},
+        )
+        context = trace.set_span_in_context(parent)
+        for name, start, end in span.segments:
+            self.tracer.start_span(name, context=context, start_time=start).end(end_time=end)
+        parent.end(end_time=end_time)
@@ -0,0 +1,326 @@
+"""
+Client-side query plans and prepared (parameterized) queries
+"""
+
+import json
+import re
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .partitions import is_range_gone
+
+_QUERY_CLAUSES = re.compile(
+    r"^\s*SELECT\s+(?P<select>.*?)\s+FROM\s+(?P<from>.*?)"
+    r"(?:\s+WHERE\s+(?P<where>.*?))?"
+    r"(?:\s+GROUP\s+BY\s+(?P<group_by>.*?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order_by>.*?))?"
+    r"(?:\s+OFFSET\s+.*?)?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_TOP = re.compile(r"^TOP\s+(\d+|@\w+)\s+", re.IGNORECASE)
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|MIN|MAX|AVG)\s*\(", re.IGNORECASE)
+_PARAMETER = re.compile(r"@\w+")
+_FROM_KEYWORDS = {"JOIN", "WHERE", "GROUP", "ORDER", "IN", "OFFSET"}
+_ACCESSORS = r"(?:\s*\.\s*\w+|\s*\[\s*(?:\"[^\"]*\"|'[^']*'|\d+)\s*\])"
+_JOIN = re.compile(r"\bJOIN\s+(\w+)\s+IN\s+(\w+)(" + _ACCESSORS + r"*)", re.IGNORECASE)
+_CONSTANT = r"(@\w+|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|-?\d+(?:\.\d+)?|true|false)"
+
+
+def _path_pattern(alias: "str"):
+    return re.compile(r"(?<![\w.@])" + re.escape(alias) + r"(" + _ACCESSORS + r"+)")
+
+
+def _value_pattern(alias: "str"):
+    """ Matches `alias` used as a value by itself, such as the element of a JOIN in `t = 'red'`. """
+    return re.compile(r"(?<![\w.@])" + re.escape(alias) + r"(?![\w.\[(])")
+
+
+def _equality_pattern(alias: "str"):
+    """ Matches a condition comparing a path from `alias` with a parameter or literal, either way round. """
+    path = re.escape(alias) + r"(" + _ACCESSORS + r"+)"
+    return re.compile(
+        r"^\s*(?:" + path + r"\s*=\s*" + _CONSTANT + r"|" + _CONSTANT + r"\s*=\s*" + path + r")\s*$"
+    )
+
+
+def _constant(text: "str") -> "Any":
+    """ The value of a literal in a query. """
+    if text.startswith("'"):
+        text = '"' + text[1:-1].replace("\\'", "'").replace('"', '\\"') + '"'
+    return json.loads(text)
+
+
+def _to_path(accessors: "str") -> "str":
+    segments = []
+    for segment in re.findall(r"\.\s*(\w+)|\[\s*(?:\"([^\"]*)\"|'([^']*)'|(\d+))\s*\]", accessors):
+        name = next((part for part in segment[:3] if part), None)
+        segments.append(name if name is not None else "[]")
+    return "/" + "/".join(segments)
+
+
+class QueryPlan:
+    """ Client-side plan for an Azure Cosmos SQL query.
+
+    The plan describes the shape of the query - the document paths it filters, orders and projects on,
+    and whether results from several partitions need to be merged on the client
+    (ORDER BY, DISTINCT, TOP, aggregates and GROUP BY). Paths through the aliases of JOINs are
+    resolved to paths from the root of the documents, with '[]' for array elements. Plans only depend on the query text, so they are
+    computed once and shared through the client-wide `ClientContext.query_plans` cache.
+
+    :param query: The Azure Cosmos SQL query text.
+    """
+
+    def __init__(self, query: "str"):
+        self.query = query
+        self.parameters = frozenset(_PARAMETER.findall(_STRING_LITERAL.sub("''", query)))
+        self.alias = None  # type: Optional[str]
+        self.select_value = False
+        self.distinct = False
+        self.top = None  # type: Optional[Union[int, str]]
+        self.aggregates = []  # type: List[str]
+        self.projection_paths = []  # type: List[str]
+        self.filter_paths = []  # type: List[str]
+        self.order_by = []  # type: List[Tuple[str, str]]
+        self.group_by_paths = []  # type: List[str]
+        # Paths the filter requires to equal a parameter (by name) or literal (as written)
+        self.equality_filters = {}  # type: Dict[str, str]
+        # ORDER BY expressions as written, with their direction
+        self.sort_terms = []  # type: List[Tuple[str, str]]
+        # The SELECT list without DISTINCT and TOP (but with VALUE), and everything after FROM
+        self.projection = ""
+        self.source = ""
+        self.offset = False
+
+        # Clause boundaries are found with string literals blanked out so that a literal such as
+        # 'ORDER BY' in a filter can't confuse the split.
+        blanked = _STRING_LITERAL.sub(lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1], query)
+        clauses = _QUERY_CLAUSES.match(blanked)
+        if not clauses:
+            return
+
+        def original(name):
+            start, end = clauses.span(name)
+            return query[start:end] if start >= 0 else ""
+
+        def without_literals(name):
+            start, end = clauses.span(name)
+            return blanked[start:end] if start >= 0 else ""
+
+        from_tokens = clauses.group("from").split()
+        if len(from_tokens) >= 3 and from_tokens[1].upper() == "AS":
+            self.alias = from_tokens[2]
+        elif len(from_tokens) >= 2 and from_tokens[1].upper() not in _FROM_KEYWORDS:
+            self.alias = from_tokens[1]
+        elif from_tokens:
+            self.alias = from_tokens[0]
+
+        select = clauses.group("select").strip()
+        if select.upper().startswith("DISTINCT "):
+            self.distinct = True
+            select = select[len("DISTINCT "):].lstrip()
+        top = _TOP.match(select)
+        if top:
+            self.top = int(top.group(1)) if top.group(1).isdigit() else top.group(1)
+            select = select[top.end():]
+        projection = original("select").strip()
+        self.projection = projection[len(projection) - len(select):]
+        self.source = query[clauses.start("from"):]
+        self.offset = bool(re.search(r"\bOFFSET\b", blanked[clauses.start("from"):], re.IGNORECASE))
+        if select.upper().startswith("VALUE "):
+            self.select_value = True
+        self.aggregates = [name.upper() for name in _AGGREGATE.findall(select)]
+
+        for term in original("order_by").split(","):
+            direction = "DESC" if term.strip().upper().endswith(" DESC") else "ASC"
+            expression = re.sub(r"\s+(?:ASC|DESC)\s*$", "", term.strip(), flags=re.IGNORECASE)
+            if expression:
+                self.sort_terms.append((expression, direction))
+
+        if self.alias:
+            # Where in the documents each alias points: the root, or the elements of a JOINed array
+            roots = {self.alias: ""}
+            for alias, source, accessors in _JOIN.findall(original("from")):
+                if source in roots:
+                    roots[alias] = roots[source] + (_to_path(accessors) if accessors else "") + "/[]"
+
+            def paths(text, literals_blanked):
+                found = []
+                for alias, root in roots.items():
+                    found.extend(
+                        (m.start(), root + _to_path(m.group(1)))
+                        for m in _path_pattern(alias).finditer(text)
+                    )
+                    if root:
+                        found.extend(
+                            (m.start(), root) for m in _value_pattern(alias).finditer(literals_blanked)
+                        )
+                return [path for _, path in sorted(found)]
+
+            self.projection_paths = _unique(paths(original("select"), without_literals("select")))
+            self.filter_paths = _unique(paths(original("where"), without_literals("where")))
+            self.group_by_paths = _unique(paths(original("group_by"), without_literals("group_by")))
+            where = without_literals("where")
+            if where and not re.search(r"\b(?:OR|NOT|BETWEEN)\b", where, re.IGNORECASE):
+                # The filter is a conjunction: each of its equalities holds for every result
+                start = 0
+                where_start = clauses.start("where")
+                for separator in [*re.finditer(r"\bAND\b", where, re.IGNORECASE), None]:
+                    end = len(where) if separator is None else separator.start()
+                    equality = _equality_pattern(self.alias).match(
+                        query[where_start + start:where_start + end]
+                    )
+                    if equality:
+                        accessors, value, other_value, other_accessors = equality.groups()
+                        self.equality_filters[_to_path(accessors or other_accessors)] = (
+                            value or other_value
+                        )
+                    if separator is not None:
+                        start = separator.end()
+            for term, blanked_term in zip(
+                original("order_by").split(","), without_literals("order_by").split(",")
+            ):
+                found = paths(term, blanked_term)
+                if found:
+                    direction = "DESC" if term.strip().upper().endswith(" DESC") else "ASC"
+                    self.order_by.append((found[0], direction))
+
+    @property
+    def requires_merge(self) -> "bool":
+        """ True if results from multiple partitions have to be merged on the client. """
+        return bool(
+            self.order_by
+            or self.distinct
+            or self.top is not None
+            or self.aggregates
+            or self.group_by_paths
+        )
+
+    def __repr__(self):
+        return f"QueryPlan({self.query!r})"
+
+
+def _unique(values: "Iterable[str]") -> "List[str]":
+    return list(dict.fromkeys(values))
+
+
+class PreparedQuery:
+    """ A query prepared once against a container and executed many times with different parameters.
+
+    Instances are not created directly; use :func:`Container.prepare`.
+
+    **Example:** find families by state:
+
+    .. code-block:: python
+
+        by_state = container.prepare('SELECT * FROM Families f WHERE f.address.state = @state')
+        for state in ('NY', 'WA'):
+            for family in by_state.query_items({'@state': state}):
+                print(family['id'])
+    """
+
+    def __init__(self, container: "Container", plan: "QueryPlan"):
+        self.container = container
+        self.plan = plan
+        self._partition_key_ranges = None  # type: Optional[List[Dict[str, Any]]]
+
+    @property
+    def query(self) -> "str":
+        return self.plan.query
+
+    @property
+    def partition_key_ranges(self) -> "List[Dict[str, Any]]":
+        """ Partition key ranges targeted by this query, read from the service on first use. """
+        if self._partition_key_ranges is None:
+            self._partition_key_ranges = list(
+                self.container.client_context._ReadPartitionKeyRanges(
+                    self.container.collection_link
+                )
+            )
+        return self._partition_key_ranges
+
+    def refresh(self):
+        """ Forget the cached partition key ranges, e.g. after the container has been split. """
+        self._partition_key_ranges = None
+
+    def bind(
+        self, parameters: "Optional[Union[Dict[str, Any], List[Dict[str, Any]]]]" = None
+    ) -> "Dict[str, Any]":
+        """ Bind parameter values and return the query specification to send to the service.
+
+        :param parameters: Either a mapping from parameter name to value, or a list of `dict(name=..., value=...)`.
+        :raise ValueError: If a parameter used by the query was not given a value, or an unknown parameter was given.
+        """
+        if parameters is None:
+            parameters = {}
+        elif not isinstance(parameters, dict):
+            parameters = {p["name"]: p["value"] for p in parameters}
+        bound = {
+            (name if name.startswith("@") else f"@{name}"): value
+            for name, value in parameters.items()
+        }
+        missing = self.plan.parameters - bound.keys()
+        if missing:
+            raise ValueError(f"No value given for query parameter(s) {', '.join(sorted(missing))}")
+        unknown = bound.keys() - self.plan.parameters
+        if unknown:
+            raise ValueError(f"Unknown query parameter(s) {', '.join(sorted(unknown))}")
+        return dict(
+            query=self.plan.query,
+            parameters=[dict(name=name, value=value) for name, value in bound.items()],
+        )
+
+    def query_items(
+        self,
+        parameters: "Optional[Union[Dict[str, Any], List[Dict[str, Any]]]]" = None,
+        *,
+        partition_key: "Optional[Any]" = None,
+        options: "Optional[Dict[str, Any]]" = None,
+        max_memory: "Optional[int]" = None,
+    ) -> "Iterable[Item]":
+        """ Execute the prepared query with the given parameter values.
+
+        The query runs with its plan, against the partition key ranges read when it was first run;
+        they are read again if the container was split. A query whose filter requires the partition
+        key to equal a parameter or literal is only sent to the partition owning that value.
+
+        :param parameters: Parameter values, see :func:`PreparedQuery.bind`.
+        :param partition_key: If given, the query is only sent to the partition owning this key.
+        :param options: Additional request options.
+        :param max_memory: Merge the results of cross-partition ORDER BY and DISTINCT queries on the
+            client within about this many bytes; see :func:`Container.query_items`.
+        """
+        options = dict(options or {})
+        ranges = None
+        spec = self.bind(parameters)
+        if partition_key is None and "partitionKey" not in options:
+            partition_key = self._partition_key(spec)
+        if partition_key is not None:
+            options["partitionKey"] = partition_key
+        elif "partitionKey" not in options:
+            ranges = self.partition_key_ranges
+            if len(ranges) > 1:
+                options.setdefault("enableCrossPartitionQuery", True)
+        try:
+            yield from self.container._query_prepared(self, spec, options, ranges, max_memory)
+        except Exception as e:
+            if is_range_gone(e):
+                self.refresh()
+            raise
+
+    def _partition_key(self, spec: "Dict[str, Any]") -> "Optional[Any]":
+        """ The partition key value all results of the bound query `spec` share, if the filter pins it. """
+        if not self.plan.equality_filters:
+            return None
+        paths = self.container._partition_key_path_list()
+        if len(paths) != 1 or paths[0] not in self.plan.equality_filters:
+            return None
+        value = self.plan.equality_filters[paths[0]]
+        if value.startswith("@"):
+            return next(p["value"] for p in spec["parameters"] if p["name"] == value)
+        return _constant(value)
+
+    __call__ = query_items
+
+    def __repr__(self):
+        return f"PreparedQuery({self.container.collection_link!r}, {self.plan.query!r})"
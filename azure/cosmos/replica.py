@@ -0,0 +1,775 @@
+"""
+Local, change feed synchronized read replicas of containers
+"""
+
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .partitions import is_range_gone
+
+_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<string>'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"
+    r"|(?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+    r"|(?P<parameter>@\w+)"
+    r"|(?P<operator><>|!=|<=|>=|=|<|>|\(|\)|,|\.|\[|\]|\*|-)"
+    r"|(?P<word>\w+)"
+    r")"
+)
+_COMPARISONS = {"=": "=", "!=": "!=", "<>": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+_KEYWORDS = {"WHERE", "ORDER", "OFFSET", "AND", "OR", "NOT", "IN", "JOIN", "AS"}
+# Continuation that reads a change feed from its current end: it is sent as If-None-Match: *
+_FROM_NOW = "*"
+
+
+class UnsupportedQuery(ValueError):
+    """ The query uses SQL the local replica can't evaluate. """
+
+
+def _unquote(literal: "str") -> "str":
+    if literal[0] == "'":
+        literal = '"' + literal[1:-1].replace("\\'", "'").replace('"', '\\"') + '"'
+    return json.loads(literal)
+
+
+def _json_path(segments: "Iterable[Any]") -> "str":
+    path = "$"
+    for segment in segments:
+        if isinstance(segment, int):
+            path += f"[{segment}]"
+        else:
+            path += '."' + segment.replace('"', '\\"') + '"'
+    # Paths are embedded in SQL string literals
+    return path.replace("'", "''")
+
+
+def _json_value(path: "str") -> "str":
+    """ SQLite expression for the JSON text of the value at `path`, or NULL if there is none. """
+    return (
+        f"CASE WHEN json_type(body, '{path}') IS NULL THEN NULL "
+        f"ELSE json_quote(json_extract(body, '{path}')) END"
+    )
+
+
+# Types of Azure Cosmos SQL values, as SQL string literals
+_NUMBER, _STRING, _BOOLEAN, _NULL, _OBJECT, _ARRAY = (
+    "'number'", "'string'", "'boolean'", "'null'", "'object'", "'array'"
+)
+_CONSTANT_TYPE = re.compile(r"^'\w+'$")
+
+# An expression in SQLite, and an expression for its Azure Cosmos SQL type (NULL if undefined)
+_Operand = Tuple[str, str]
+
+
+def _cosmos_type(json_type: "str") -> "str":
+    """ SQLite expression for the Cosmos type of a value whose SQLite JSON type is `json_type`. """
+    return (
+        f"CASE {json_type} WHEN 'integer' THEN {_NUMBER} WHEN 'real' THEN {_NUMBER} "
+        f"WHEN 'text' THEN {_STRING} WHEN 'true' THEN {_BOOLEAN} WHEN 'false' THEN {_BOOLEAN} "
+        f"ELSE {json_type} END"
+    )
+
+
+def _compare(left: "_Operand", operator: "str", right: "_Operand") -> "str":
+    """ Compare two operands the way Azure Cosmos SQL does: values of different types (or undefined
+    ones) don't compare, and the comparison is undefined (NULL), rather than converted as SQLite would. """
+    (l, l_type), (r, r_type) = left, right
+    # null only equals null; SQLite's NULL doesn't even equal itself
+    null_result = "1" if operator in ("=", "<=", ">=") else "0"
+    if _CONSTANT_TYPE.match(l_type) and _CONSTANT_TYPE.match(r_type):
+        if l_type != r_type:
+            return "NULL"
+        return null_result if l_type == _NULL else f"({l} {operator} {r})"
+    return (
+        f"(CASE WHEN {l_type} = {r_type} THEN "
+        f"CASE WHEN {l_type} = {_NULL} THEN {null_result} ELSE {l} {operator} {r} END END)"
+    )
+
+
+def _sql_value(value: "Any") -> "Any":
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class _Compiler:
+    """ Translate a query of the supported subset of Azure Cosmos SQL into SQLite over the documents table.
+
+    Supported: SELECT [TOP n] (* | VALUE path | VALUE COUNT(1) | path [AS name], ...) FROM container [[AS] alias]
+    [WHERE condition] [ORDER BY path [ASC|DESC], ...] [OFFSET n LIMIT m]. Conditions combine comparisons,
+    IN lists, AND, OR, NOT and the functions IS_DEFINED, IS_NULL, STARTSWITH, ENDSWITH, CONTAINS,
+    ARRAY_CONTAINS, LOWER, UPPER and LENGTH.
+    """
+
+    def __init__(self, query: "str", parameters: "Optional[List[Dict[str, Any]]]"):
+        self.tokens = []  # type: List[Tuple[str, str]]
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = _TOKEN.match(query, position)
+            if not match or match.end() == position:
+                raise UnsupportedQuery(f"Unexpected input at {query[position:position + 20]!r}")
+            kind = match.lastgroup
+            self.tokens.append((kind, match.group(kind)))
+            position = match.end()
+        self.position = 0
+        self.parameters = {p["name"]: p["value"] for p in parameters or []}
+        self.arguments = []  # type: List[Any]
+        self.alias = None  # type: Optional[str]
+
+    def _peek(self, offset: "int" = 0) -> "Tuple[str, str]":
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else ("end", "")
+
+    def _word(self, *words: "str") -> "bool":
+        kind, value = self._peek()
+        return kind == "word" and value.upper() in words
+
+    def _take(self, kind: "Optional[str]" = None, value: "Optional[str]" = None) -> "str":
+        token_kind, token_value = self._peek()
+        if (kind is not None and token_kind != kind) or (
+            value is not None and token_value.upper() != value
+        ):
+            raise UnsupportedQuery(f"Expected {value or kind}, got {token_value or 'end of query'!r}")
+        self.position += 1
+        return token_value
+
+    def compile(self) -> "Tuple[str, List[Any], Callable[[Tuple], Any], bool]":
+        """ Returns the SQLite statement, its arguments, a function producing a result from a row (None
+        to skip the row), and whether results are values rather than documents. """
+        self._take("word", "SELECT")
+        if self._word("DISTINCT"):
+            raise UnsupportedQuery("DISTINCT is not supported")
+        top = None
+        if self._word("TOP"):
+            self._take()
+            top = self._integer()
+        select_start = self.position
+        # Skip the projection until FROM; it is compiled once the alias is known
+        depth = 0
+        while not (depth == 0 and self._word("FROM")):
+            kind, value = self._peek()
+            if kind == "end":
+                raise UnsupportedQuery("Missing FROM")
+            depth += value == "("
+            depth -= value == ")"
+            self.position += 1
+        select_end = self.position
+        self._take("word", "FROM")
+        self._take("word")
+        if self._word("AS"):
+            self._take()
+        if self._peek()[0] == "word" and self._peek()[1].upper() not in _KEYWORDS:
+            self.alias = self._take("word")
+        else:
+            self.alias = self.tokens[self.position - 1][1]
+        if self._word("JOIN"):
+            raise UnsupportedQuery("JOIN is not supported")
+        where = ""
+        if self._word("WHERE"):
+            self._take()
+            where = " WHERE " + self._expression()
+
+        order_by = []
+        if self._word("ORDER"):
+            self._take()
+            self._take("word", "BY")
+            while True:
+                term = self._path()
+                direction = ""
+                if self._word("ASC", "DESC"):
+                    direction = " " + self._take().upper()
+                order_by.append(term + direction)
+                if self._peek()[1] != ",":
+                    break
+                self._take()
+        limit = top
+        offset = None
+        if self._word("OFFSET"):
+            self._take()
+            offset = self._integer()
+            self._take("word", "LIMIT")
+            limit = self._integer() if limit is None else min(limit, self._integer())
+        if self._peek()[0] != "end":
+            raise UnsupportedQuery(f"Unexpected {self._peek()[1]!r}")
+
+        end = self.position
+        self.position = select_start
+        columns, make_result, scalar = self._projection(select_end)
+        self.position = end
+
+        statement = f"SELECT {columns} FROM docs{where}"
+        if order_by:
+            statement += " ORDER BY " + ", ".join(order_by)
+        if limit is not None or offset is not None:
+            statement += f" LIMIT {-1 if limit is None else limit}"
+            if offset is not None:
+                statement += f" OFFSET {offset}"
+        return statement, self.arguments, make_result, scalar
+
+    def _integer(self) -> "int":
+        kind, value = self._peek()
+        if kind == "parameter":
+            self._take()
+            return int(self._parameter(value))
+        return int(self._take("number"))
+
+    def _parameter(self, name: "str") -> "Any":
+        try:
+            return self.parameters[name]
+        except KeyError:
+            raise UnsupportedQuery(f"No value for parameter {name}")
+
+    def _projection(self, end: "int") -> "Tuple[str, Callable[[Tuple], Any], bool]":
+        if self._peek()[1] == "*" and self.position + 1 == end:
+            self._take()
+            return "body", lambda row: json.loads(row[0]), False
+        if self._word("VALUE"):
+            self._take()
+            if self._word("COUNT"):
+                self._take()
+                self._take("operator", "(")
+                while self._peek()[0] not in ("end",) and self._peek()[1] != ")":
+                    self._take()
+                self._take("operator", ")")
+                if self.position != end:
+                    raise UnsupportedQuery("Unsupported projection")
+                return "COUNT(*)", lambda row: row[0], True
+            if self._peek() == ("word", self.alias) and self._peek(1)[1] not in (".", "["):
+                self._take()
+                if self.position != end:
+                    raise UnsupportedQuery("Unsupported projection")
+                return "body", lambda row: json.loads(row[0]), True
+            expression = _json_value(self._json_path())
+            if self.position != end:
+                raise UnsupportedQuery("Unsupported projection")
+            # Documents without a value at the path produce no result
+            return expression, lambda row: None if row[0] is None else json.loads(row[0]), True
+        names = []
+        expressions = []
+        while True:
+            start = self.position
+            expressions.append(_json_value(self._json_path()))
+            name = self.tokens[self.position - 1][1]
+            if name == "]":
+                name = str(_unquote(self.tokens[self.position - 2][1]))
+            if self._word("AS"):
+                self._take()
+                name = self._take("word")
+            names.append(name)
+            if self.position == end:
+                break
+            if self._peek()[1] != "," or self.position == start:
+                raise UnsupportedQuery("Unsupported projection")
+            self._take()
+
+        def make_result(row):
+            return {
+                name: json.loads(value) for name, value in zip(names, row) if value is not None
+            }
+
+        return ", ".join(expressions), make_result, False
+
+    def _json_path(self) -> "str":
+        """ Parse a property path, such as c.address["state"], into a SQLite JSON path. """
+        if self._take("word") != self.alias:
+            raise UnsupportedQuery(f"Paths must start with the alias {self.alias}")
+        segments = []  # type: List[Any]
+        while self._peek()[1] in (".", "["):
+            if self._take() == ".":
+                segments.append(self._take("word"))
+            else:
+                kind, value = self._peek()
+                self._take()
+                segments.append(int(value) if kind == "number" else _unquote(value))
+                self._take("operator", "]")
+        if not segments:
+            raise UnsupportedQuery("Using whole documents in expressions is not supported")
+        return _json_path(segments)
+
+    def _path(self) -> "str":
+        return f"json_extract(body, '{self._json_path()}')"
+
+    def _argument(self, value: "Any") -> "str":
+        # Numbered, so that an argument can be used more than once in the statement
+        self.arguments.append(_sql_value(value))
+        return f"?{len(self.arguments)}"
+
+    def _expression(self) -> "str":
+        terms = [self._conjunction()]
+        while self._word("OR"):
+            self._take()
+            terms.append(self._conjunction())
+        return terms[0] if len(terms) == 1 else "(" + " OR ".join(terms) + ")"
+
+    def _conjunction(self) -> "str":
+        terms = [self._negation()]
+        while self._word("AND"):
+            self._take()
+            terms.append(self._negation())
+        return terms[0] if len(terms) == 1 else "(" + " AND ".join(terms) + ")"
+
+    def _negation(self) -> "str":
+        if self._word("NOT"):
+            self._take()
+            return f"NOT ({self._negation()})"
+        return self._comparison()
+
+    def _comparison(self) -> "str":
+        left = self._operand()
+        kind, value = self._peek()
+        if value in _COMPARISONS:
+            self._take()
+            return _compare(left, _COMPARISONS[value], self._operand())
+        negate = False
+        if self._word("NOT") and self._peek(1)[1].upper() == "IN":
+            self._take()
+            negate = True
+        if self._word("IN"):
+            self._take()
+            self._take("operator", "(")
+            values = [self._operand()]
+            while self._peek()[1] == ",":
+                self._take()
+                values.append(self._operand())
+            self._take("operator", ")")
+            matches = "(" + " OR ".join(_compare(left, "=", v) for v in values) + ")"
+            return f"NOT {matches}" if negate else matches
+        # A value by itself is a condition only if it is a boolean
+        sql, type_sql = left
+        if type_sql == _BOOLEAN:
+            return sql
+        return f"CASE WHEN {type_sql} = {_BOOLEAN} THEN {sql} END"
+
+    def _operand(self) -> "_Operand":
+        kind, value = self._peek()
+        if kind == "string":
+            self._take()
+            return self._literal(_unquote(value))
+        if kind == "number":
+            self._take()
+            return self._literal(json.loads(value))
+        if value == "-" and self._peek(1)[0] == "number":
+            self._take()
+            return self._literal(-json.loads(self._take()))
+        if kind == "parameter":
+            self._take()
+            return self._literal(self._parameter(value))
+        if value == "(":
+            self._take()
+            expression = self._expression()
+            self._take("operator", ")")
+            return f"({expression})", f"CASE WHEN ({expression}) IS NOT NULL THEN {_BOOLEAN} END"
+        if kind == "word":
+            upper = value.upper()
+            if upper in ("TRUE", "FALSE"):
+                self._take()
+                return self._literal(upper == "TRUE")
+            if upper == "NULL":
+                self._take()
+                return self._literal(None)
+            if value == self.alias:
+                path = self._json_path()
+                return f"json_extract(body, '{path}')", _cosmos_type(f"json_type(body, '{path}')")
+            if self._peek(1)[1] == "(":
+                return self._function()
+        raise UnsupportedQuery(f"Unsupported expression at {value or 'end of query'!r}")
+
+    def _literal(self, value: "Any") -> "_Operand":
+        if value is None:
+            return "NULL", _NULL
+        argument = self._argument(value)
+        if isinstance(value, (dict, list)):
+            # Compared with the minified JSON text json_extract returns for objects and arrays
+            return f"json({argument})", _OBJECT if isinstance(value, dict) else _ARRAY
+        if isinstance(value, bool):
+            return argument, _BOOLEAN
+        if isinstance(value, (int, float)):
+            return argument, _NUMBER
+        return argument, _STRING
+
+    def _function(self) -> "_Operand":
+        name = self._take("word").upper()
+        self._take("operator", "(")
+        if name in ("IS_DEFINED", "IS_NULL", "ARRAY_CONTAINS"):
+            # These look at the JSON value at a path itself
+            path = self._json_path()
+            arguments = []
+            while self._peek()[1] == ",":
+                self._take()
+                arguments.append(self._operand())
+            self._take("operator", ")")
+            if name == "IS_DEFINED":
+                return f"json_type(body, '{path}') IS NOT NULL", _BOOLEAN
+            if name == "IS_NULL":
+                return f"coalesce(json_type(body, '{path}') = 'null', 0)", _BOOLEAN
+            if len(arguments) != 1:
+                raise UnsupportedQuery("Only ARRAY_CONTAINS(path, value) is supported")
+            element = ("value", _cosmos_type("type"))
+            return (
+                f"coalesce((SELECT 1 FROM json_each(body, '{path}') "
+                f"WHERE {_compare(element, '=', arguments[0])} LIMIT 1), 0)",
+                _BOOLEAN,
+            )
+        arguments = [self._operand()]
+        while self._peek()[1] == ",":
+            self._take()
+            arguments.append(self._operand())
+        self._take("operator", ")")
+        # Functions of strings are undefined for arguments of other types
+        (a, a_type), *rest = arguments
+        strings = " AND ".join(f"{t} = {_STRING}" for _, t in arguments)
+        if name in ("STARTSWITH", "ENDSWITH", "CONTAINS") and len(rest) == 1:
+            b = rest[0][0]
+            if name == "STARTSWITH":
+                test = f"substr({a}, 1, length({b})) = {b}"
+            elif name == "ENDSWITH":
+                test = f"substr({a}, -length({b})) = {b}"
+            else:
+                test = f"instr({a}, {b}) > 0"
+            return f"CASE WHEN {strings} THEN {test} END", f"CASE WHEN {strings} THEN {_BOOLEAN} END"
+        if name in ("LOWER", "UPPER", "LENGTH") and not rest:
+            result_type = _NUMBER if name == "LENGTH" else _STRING
+            return (
+                f"CASE WHEN {strings} THEN {name.lower()}({a}) END",
+                f"CASE WHEN {strings} THEN {result_type} END",
+            )
+        raise UnsupportedQuery(f"Function {name} is not supported")
+
+
+class LocalReplica:
+    """ A local copy of a container, in SQLite, kept up to date from the container's change feed.
+
+    The replica is bootstrapped with a parallel scan of every partition key range, after which the
+    change feed of every range is polled every `poll_interval` seconds. Point reads and queries of
+    a subset of the SQL grammar (see :class:`_Compiler`) are answered locally; documents are
+    indexed by id, and by value at each of `indexes`.
+
+    The change feed doesn't report deletes: an item deleted from the container stays in the
+    replica until :func:`LocalReplica.resync`. When a partition key range is split, its change feed
+    is followed on the ranges it was split into.
+
+    :param container: The container to replicate.
+    :param path: SQLite database file. The default keeps the replica in memory.
+    :param indexes: Document paths, such as '/address/state', to index for queries.
+    :param poll_interval: Seconds between two polls of the change feed.
+    :param parallelism: Number of partition key ranges scanned concurrently while bootstrapping.
+    :param max_staleness: If set, reads that find the replica more than this many seconds stale are
+        answered by the container instead. Otherwise, reads are answered by the container while the
+        latest sync failed.
+    :param start: Bootstrap and start following the change feed right away.
+
+    .. code-block:: python
+
+        replica = LocalReplica(container, indexes=['/address/state'], max_staleness=10)
+        families = list(replica.query_items('SELECT * FROM f WHERE f.address.state = @state',
+                                            [dict(name='@state', value='NY')]))
+        print(replica.stats())
+
+    """
+
+    def __init__(
+        self,
+        container: "Container",
+        path: "str" = ":memory:",
+        *,
+        indexes: "Iterable[str]" = (),
+        poll_interval: "float" = 1.0,
+        parallelism: "int" = 8,
+        max_staleness: "Optional[float]" = None,
+        start: "bool" = True,
+    ):
+        self.container = container
+        self.poll_interval = poll_interval
+        self.parallelism = parallelism
+        self.max_staleness = max_staleness
+        self.indexes = list(indexes)
+        self.changes_applied = 0
+        self.polls = 0
+        self.local_reads = 0
+        self.fallback_reads = 0
+        self.last_error = None  # type: Optional[Exception]
+        # Wall clock time of the newest change applied, and the lag between its _ts and applying it
+        self.last_change_lag = None  # type: Optional[float]
+        self._fresh_as_of = None  # type: Optional[float]
+        self._sync_failed = False
+        self._continuations = {}  # type: Dict[str, Optional[str]]
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS docs "
+            "(id TEXT NOT NULL, pk TEXT NOT NULL, ts INTEGER NOT NULL, body TEXT NOT NULL, "
+            "PRIMARY KEY (id, pk))"
+        )
+        for number, index in enumerate(self.indexes):
+            segments = [segment for segment in index.strip("/").split("/") if segment]
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{number} "
+                f"ON docs (json_extract(body, '{_json_path(segments)}'))"
+            )
+        if start:
+            self.start()
+
+    def start(self):
+        """ Bootstrap the replica and start following the change feed in the background. """
+        self.bootstrap()
+        self._thread = threading.Thread(target=self._follow, daemon=True)
+        self._thread.start()
+
+    def bootstrap(self) -> "int":
+        """ Load every document of the container. Returns the number of documents loaded. """
+        client_context = self.container.client_context
+        collection_link = self.container.collection_link
+        started = time.monotonic()
+        ranges = [
+            pk_range["id"]
+            for pk_range in client_context._ReadPartitionKeyRanges(collection_link)
+        ]
+        # Note where every range's change feed ends before scanning, so no change is missed in between
+        continuations = {range_id: self._read_changes(range_id, _FROM_NOW)[1] for range_id in ranges}
+
+        def scan(range_id):
+            loaded = 0
+            continuation = None
+            while True:
+                options = dict(maxItemCount=1000)
+                if continuation:
+                    options["continuation"] = continuation
+                page, headers = client_context.QueryItemsPage(
+                    collection_link, options=options, partition_key_range_id=range_id
+                )
+                self._apply(page)
+                loaded += len(page)
+                continuation = headers.get("x-ms-continuation")
+                if not continuation:
+                    return loaded
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            loaded = sum(pool.map(scan, ranges))
+        with self._lock:
+            self._continuations = continuations
+            self._fresh_as_of = started
+        return loaded
+
+    def resync(self) -> "int":
+        """ Drop the replica's documents and bootstrap it again. Reads are answered by the container
+        until the replica is loaded again. """
+        with self._lock:
+            self._fresh_as_of = None
+            self._continuations = {}
+            self._connection.execute("DELETE FROM docs")
+        return self.bootstrap()
+
+    def _read_changes(
+        self, range_id: "str", continuation: "Optional[str]"
+    ) -> "Tuple[List[Dict[str, Any]], Optional[str]]":
+        client_context = self.container.client_context
+        options = {"partitionKeyRangeId": range_id}
+        if continuation:
+            options["continuation"] = continuation
+        changes = client_context.QueryItemsChangeFeed(
+            self.container.collection_link, options=options
+        )
+        documents = []
+        while True:
+            block = changes.fetch_next_block()
+            if not block:
+                break
+            documents.extend(block)
+        headers = client_context.last_response_headers or {}
+        return documents, headers.get("etag", continuation)
+
+    def sync(self) -> "int":
+        """ Apply the changes made since the previous sync. Returns the number of changes applied. """
+        started = time.monotonic()
+        applied = 0
+        newest = 0
+        with self._lock:
+            continuations = self._continuations
+        pending = deque(continuations)
+        try:
+            while pending:
+                range_id = pending.popleft()
+                try:
+                    documents, continuation = self._read_changes(range_id, continuations[range_id])
+                except Exception as e:
+                    if not is_range_gone(e):
+                        raise
+                    children = self._split(continuations, range_id)
+                    if not children:
+                        self.resync()
+                        return applied
+                    pending.extend(children)
+                    continue
+                self._apply(documents)
+                applied += len(documents)
+                newest = max([newest] + [document.get("_ts", 0) for document in documents])
+                with self._lock:
+                    continuations[range_id] = continuation
+        except Exception:
+            with self._lock:
+                self._sync_failed = True
+            raise
+        now = time.time()
+        with self._lock:
+            self.polls += 1
+            self.changes_applied += applied
+            self._sync_failed = False
+            # Unless the replica was dropped by a resync in the meantime
+            if continuations and continuations is self._continuations:
+                self._fresh_as_of = started
+            if newest:
+                self.last_change_lag = max(0.0, now - newest)
+        return applied
+
+    def _split(self, continuations: "Dict[str, Optional[str]]", range_id: "str") -> "List[str]":
+        """ Replace a range that was split by the ranges it was split into, which continue its change
+        feed from where it left off. Returns the new ranges; none if they can't be found. """
+        children = [
+            pk_range["id"]
+            for pk_range in self.container.client_context._ReadPartitionKeyRanges(
+                self.container.collection_link
+            )
+            if range_id in pk_range.get("parents", ())
+        ]
+        with self._lock:
+            for child in children:
+                continuations[child] = continuations[range_id]
+            if children:
+                del continuations[range_id]
+        return children
+
+    def _follow(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.last_error = e
+
+    def _apply(self, documents: "List[Dict[str, Any]]"):
+        if not documents:
+            return
+        rows = [
+            (
+                document["id"],
+                json.dumps(self.container._partition_key_of(document)),
+                document.get("_ts", 0),
+                json.dumps(document, separators=(",", ":")),
+            )
+            for document in documents
+        ]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT INTO docs (id, pk, ts, body) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id, pk) DO UPDATE SET ts = excluded.ts, body = excluded.body "
+                "WHERE excluded.ts >= docs.ts",
+                rows,
+            )
+            self._connection.execute("COMMIT")
+
+    @property
+    def staleness(self) -> "Optional[float]":
+        """ Upper bound, in seconds, on how out of date the replica is; None until it was bootstrapped.
+
+        Every create, replace and upsert committed to the container more than this long ago has been
+        applied (up to the change feed's own propagation delay). Deletes are not replicated.
+        """
+        if self._fresh_as_of is None:
+            return None
+        return time.monotonic() - self._fresh_as_of
+
+    def _is_fresh(self) -> "bool":
+        staleness = self.staleness
+        if staleness is None:
+            fresh = False
+        elif self.max_staleness is None:
+            fresh = not self._sync_failed
+        else:
+            fresh = staleness <= self.max_staleness
+        with self._lock:
+            if fresh:
+                self.local_reads += 1
+            else:
+                self.fallback_reads += 1
+        return fresh
+
+    def get_item(self, id: "str", partition_key: "Any" = None) -> "Item":
+        """ Get the item identified by `id` (and `partition_key`, if the container is partitioned and
+        several items share the id).
+
+        :raises KeyError: If the replica has no such item.
+        """
+        if not self._is_fresh():
+            return self.container.get_item(id, partition_key)
+        if partition_key is None:
+            statement, arguments = "SELECT body FROM docs WHERE id = ? LIMIT 1", (id,)
+        else:
+            statement = "SELECT body FROM docs WHERE id = ? AND pk = ?"
+            arguments = (id, json.dumps(partition_key))
+        with self._lock:
+            row = self._connection.execute(statement, arguments).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return self.container._item({}, json.loads(row[0]))
+
+    def query_items(
+        self, query: "str", parameters: "Optional[List[Dict[str, Any]]]" = None
+    ) -> "Iterable[Any]":
+        """ Run `query` against the replica.
+
+        :param query: A query of the supported subset of Azure Cosmos SQL: filters, ORDER BY, TOP,
+            OFFSET/LIMIT, projections and VALUE COUNT(1), over the documents of the container.
+        :param parameters: Values of the query parameters, as for :func:`Container.query_items`.
+        :raises UnsupportedQuery: If the query can't be evaluated locally.
+        """
+        if not self._is_fresh():
+            yield from self.container.query_items(query, parameters)
+            return
+        statement, arguments, make_result, scalar = _Compiler(query, parameters).compile()
+        with self._lock:
+            rows = self._connection.execute(statement, arguments).fetchall()
+        for row in rows:
+            value = make_result(row)
+            if value is not None:
+                yield value if scalar else self.container._item({}, value)
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._lock:
+            documents = self._connection.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+            return dict(
+                documents=documents,
+                staleness=self.staleness,
+                last_change_lag=self.last_change_lag,
+                changes_applied=self.changes_applied,
+                polls=self.polls,
+                local_reads=self.local_reads,
+                fallback_reads=self.fallback_reads,
+                last_error=repr(self.last_error) if self.last_error else None,
+            )
+
+    def close(self):
+        """ Stop following the change feed, and close the local store. """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,309 @@
+"""
+Priority-aware admission of requests
+"""
+
+import contextlib
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from . import deadlines
+
+# The priority class of the operation being run on the current thread, if any
+_local = threading.local()
+
+
+class RequestShed(RuntimeError):
+    """ A request was rejected by the client-side scheduler, without being sent. """
+
+    def __init__(self, priority: "str", reason: "str"):
+        super().__init__(f"{priority} request shed: {reason}")
+        self.priority = priority
+        self.reason = reason
+
+
+class PriorityClass:
+    """ A class of requests that share a priority, a concurrency cap and a queue.
+
+    :param name: Name of the class, as passed to :func:`priority` or set as :attr:`Container.priority`.
+    :param rank: Lower ranks are admitted first when requests of several classes are waiting.
+    :param max_concurrency: Maximum number of requests of this class in flight. None for no limit besides the scheduler's.
+    :param max_queued: Maximum number of requests of this class waiting to be admitted; more are shed. None for no limit.
+    :param min_budget: Fraction (0-1) of the RU budget that must be left for a request of this class to be admitted.
+        Leaves headroom for classes with a lower `min_budget`.
+    :param shed_when_throttled: Shed requests of this class, rather than send them, while the service is throttling the client.
+    """
+
+    def __init__(
+        self,
+        name: "str",
+        rank: "int",
+        *,
+        max_concurrency: "Optional[int]" = None,
+        max_queued: "Optional[int]" = None,
+        min_budget: "float" = 0.0,
+        shed_when_throttled: "bool" = False,
+    ):
+        if not 0 <= min_budget < 1:
+            raise ValueError("min_budget must be at least 0 and less than 1")
+        self.name = name
+        self.rank = rank
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self.min_budget = min_budget
+        self.shed_when_throttled = shed_when_throttled
+        self.running = 0
+        self.admitted = 0
+        self.shed = 0
+        self.throttled = 0
+        self.max_queue_depth = 0
+        self.wait_time = 0.0
+        self.request_charge = 0.0
+        self._waiting = deque()  # type: deque
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            running=self.running,
+            queued=len(self._waiting),
+            max_queue_depth=self.max_queue_depth,
+            admitted=self.admitted,
+            shed=self.shed,
+            throttled=self.throttled,
+            mean_wait=self.wait_time / self.admitted if self.admitted else 0.0,
+            request_charge=self.request_charge,
+        )
+
+
+def default_classes() -> "Iterable[PriorityClass]":
+    """ 'foreground', 'default' and 'background' classes; background requests are limited to 4 at a
+    time, stop at half the RU budget and are shed under throttling. """
+    return [
+        PriorityClass("foreground", 0),
+        PriorityClass("default", 1),
+        PriorityClass(
+            "background", 2, max_concurrency=4, min_budget=0.5, shed_when_throttled=True
+        ),
+    ]
+
+
+class Scheduler:
+    """ Admit requests by priority class, within a concurrency limit and a client-side RU budget.
+
+    Waiting requests of the lowest ranked class are admitted first, unless their operation's
+    deadline passes while they wait (see :mod:`azure.cosmos.deadlines`). The RU budget refills at
+    `ru_per_second`, up to one second's worth, and every response's request charge is taken out of
+    it; while it is exhausted, requests wait. When the service throttles the client (responds with
+    429), it is considered throttled for the retry-after period, and classes with
+    `shed_when_throttled` are shed with :class:`RequestShed`.
+
+    :param classes: The priority classes. Defaults to :func:`default_classes`.
+    :param max_concurrency: Maximum number of requests in flight, over all classes.
+    :param ru_per_second: Client-side RU budget. None for no budget.
+    :param default: Class of requests made outside of any :func:`priority` context or prioritized container.
+
+    .. code-block:: python
+
+        client = CosmosClient(url, key, scheduler=Scheduler(ru_per_second=4000))
+        reindex = client.get_database('db').get_container('items').with_priority('background')
+        for item in items:
+            reindex.upsert_item(item)
+        print(client.client_context.scheduler.stats())
+
+    """
+
+    def __init__(
+        self,
+        classes: "Optional[Iterable[PriorityClass]]" = None,
+        *,
+        max_concurrency: "int" = 64,
+        ru_per_second: "Optional[float]" = None,
+        default: "str" = "default",
+    ):
+        self.classes = {
+            priority_class.name: priority_class
+            for priority_class in (default_classes() if classes is None else classes)
+        }
+        if default not in self.classes:
+            raise ValueError(f"Unknown default priority class {default}")
+        self.default = default
+        self.max_concurrency = max_concurrency
+        self.ru_per_second = ru_per_second
+        self.running = 0
+        self._budget = ru_per_second or 0.0
+        self._refilled = time.monotonic()
+        self._throttled_until = 0.0
+        self._condition = threading.Condition()
+
+    def _class_of(self, name: "Optional[str]") -> "PriorityClass":
+        name = name or self.default
+        try:
+            return self.classes[name]
+        except KeyError:
+            raise ValueError(f"Unknown priority class {name}")
+
+    @property
+    def throttled(self) -> "bool":
+        return time.monotonic() < self._throttled_until
+
+    def _refill(self, now: "float"):
+        if self.ru_per_second is not None:
+            self._budget = min(
+                self.ru_per_second, self._budget + (now - self._refilled) * self.ru_per_second
+            )
+        self._refilled = now
+
+    def _budget_allows(self, priority_class: "PriorityClass") -> "bool":
+        if self.ru_per_second is None:
+            return True
+        return self._budget > priority_class.min_budget * self.ru_per_second
+
+    def _can_admit(self, priority_class: "PriorityClass", ticket: "object") -> "bool":
+        if priority_class._waiting[0] is not ticket or self.running >= self.max_concurrency:
+            return False
+        if (
+            priority_class.max_concurrency is not None
+            and priority_class.running >= priority_class.max_concurrency
+        ):
+            return False
+        if not self._budget_allows(priority_class):
+            return False
+        # Defer to waiting requests of better ranked classes that could run now
+        return not any(
+            other._waiting
+            and other.rank < priority_class.rank
+            and (other.max_concurrency is None or other.running < other.max_concurrency)
+            and self._budget_allows(other)
+            for other in self.classes.values()
+        )
+
+    def _check_shed(self, priority_class: "PriorityClass"):
+        if priority_class.shed_when_throttled and self.throttled:
+            priority_class.shed += 1
+            raise RequestShed(priority_class.name, "the service is throttling requests")
+
+    def acquire(self, name: "Optional[str]" = None) -> "PriorityClass":
+        """ Wait until a request of priority class `name` may be sent. """
+        priority_class = self._class_of(name)
+        ticket = object()
+        start = time.monotonic()
+        with self._condition:
+            self._check_shed(priority_class)
+            if (
+                priority_class.max_queued is not None
+                and len(priority_class._waiting) >= priority_class.max_queued
+            ):
+                priority_class.shed += 1
+                raise RequestShed(priority_class.name, "the queue is full")
+            priority_class._waiting.append(ticket)
+            priority_class.max_queue_depth = max(
+                priority_class.max_queue_depth, len(priority_class._waiting)
+            )
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._can_admit(priority_class, ticket):
+                        break
+                    self._check_shed(priority_class)
+                    # Give up waiting when the operation runs out of time or is cancelled
+                    deadlines.check()
+                    timeout = None
+                    if self.ru_per_second is not None and not self._budget_allows(priority_class):
+                        # Time until the budget has refilled enough
+                        needed = priority_class.min_budget * self.ru_per_second - self._budget
+                        timeout = max(needed / self.ru_per_second, 0.001)
+                    elif self.throttled and priority_class.shed_when_throttled:
+                        timeout = self._throttled_until - now
+                    self._condition.wait(deadlines.bound(timeout))
+            finally:
+                priority_class._waiting.remove(ticket)
+                # Whoever is next in this class's queue may be admissible now
+                self._condition.notify_all()
+            self.running += 1
+            priority_class.running += 1
+            priority_class.admitted += 1
+            priority_class.wait_time += time.monotonic() - start
+        return priority_class
+
+    def release(
+        self,
+        priority_class: "PriorityClass",
+        status_code: "Optional[int]" = None,
+        headers: "Optional[Dict[str, Any]]" = None,
+    ):
+        """ Account for the completion of a request admitted by :func:`Scheduler.acquire`. """
+        headers = headers or {}
+        charge = float(headers.get("x-ms-request-charge", 0) or 0)
+        with self._condition:
+            self.running -= 1
+            priority_class.running -= 1
+            priority_class.request_charge += charge
+            if self.ru_per_second is not None:
+                self._refill(time.monotonic())
+                self._budget -= charge
+            if status_code == 429:
+                priority_class.throttled += 1
+                retry_after = float(headers.get("x-ms-retry-after-ms", 1000) or 1000) / 1000
+                self._throttled_until = max(self._throttled_until, time.monotonic() + retry_after)
+            self._condition.notify_all()
+
+    def stats(self) -> "Dict[str, Any]":
+        with self._condition:
+            self._refill(time.monotonic())
+            return dict(
+                running=self.running,
+                throttled=self.throttled,
+                budget=self._budget if self.ru_per_second is not None else None,
+                classes={name: c.stats() for name, c in self.classes.items()},
+            )
+
+
+def current_priority() -> "Optional[str]":
+    """ The priority class requests made on this thread are sent with, if set. """
+    return getattr(_local, "priority", None)
+
+
+@contextlib.contextmanager
+def priority(name: "str") -> "Iterator[None]":
+    """ Send the requests made on this thread within the `with` block with priority class `name`. """
+    previous = current_priority()
+    _local.priority = name
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def prioritized(method: "Callable") -> "Callable":
+    """ Send the requests of a method of an object with a `priority` attribute with that priority,
+    unless it is called within a :func:`priority` context. """
+    if inspect.isgeneratorfunction(method):
+
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            results = method(self, *args, **kwargs)
+            if self.priority is None or current_priority() is not None:
+                yield from results
+                return
+            with priority(self.priority):
+                try:
+                    first = next(results)
+                except StopIteration:
+                    return
+            yield first
+            yield from results
+
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.priority is None or current_priority() is not None:
+            return method(self, *args, **kwargs)
+        with priority(self.priority):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,107 @@
+"""
+Master key request signing
+"""
+
+import base64
+import hashlib
+import hmac
+import threading
+
+from typing import Any, Dict, Optional, Tuple
+
+
+class MasterKeySigner:
+    """ Compute master key authorization tokens, as `auth.GetAuthorizationHeader` does, but cheaper.
+
+    The key is decoded once and the HMAC keyed with it is prepared once; every signature starts
+    from a copy of that state. Signatures are cached for the current date window: requests with
+    the same verb, resource type and resource within the same second share a signature.
+
+    :param master_key: The base64 encoded master key of the account.
+    :param max_cached: Maximum number of signatures cached per date window.
+    """
+
+    def __init__(self, master_key: "str", max_cached: "int" = 4096):
+        self._hmac = hmac.new(base64.b64decode(master_key), digestmod=hashlib.sha256)
+        self.max_cached = max_cached
+        self.signed = 0
+        self.cache_hits = 0
+        # (x-ms-date, date) headers the cached signatures are valid for, and the signatures
+        self._window = ("", "")  # type: Tuple[str, str]
+        self._signatures = {}  # type: Dict[Tuple[str, str, str], str]
+        self._lock = threading.Lock()
+
+    def sign(
+        self,
+        verb: "str",
+        resource_id_or_fullname: "Optional[str]",
+        resource_type: "str",
+        headers: "Dict[str, Any]",
+    ) -> "str":
+        """ The authorization token for a request with the given (already date stamped) headers. """
+        window = (
+            headers.get("x-ms-date", "").lower(),
+            headers.get("date", "").lower(),
+        )
+        key = (
+            (verb or "").lower(),
+            (resource_type or "").lower(),
+            resource_id_or_fullname or "",
+        )
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._signatures = {}
+            token = self._signatures.get(key)
+            if token is not None:
+                self.cache_hits += 1
+                return token
+            self.signed += 1
+            signatures = self._signatures
+
+        state = self._hmac.copy()
+        state.update(f"{key[0]}\n{key[1]}\n{key[2]}\n{window[0]}\n{window[1]}\n".encode("utf-8"))
+        signature = base64.b64encode(state.digest()).decode("utf-8")
+        token = f"type=master&ver=1.0&sig={signature}"
+        with self._lock:
+            if signatures is self._signatures and len(signatures) < self.max_cached:
+                signatures[key] = token
+        return token
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(signed=self.signed, cache_hits=self.cache_hits)
+
+
+def install(auth_module: "Any"):
+    """ Make `auth_module.GetAuthorizationHeader` sign with the `signer` of the client, if it has one. """
+    original = auth_module.GetAuthorizationHeader
+    if getattr(original, "_uses_signer", False):
+        return
+
+    def GetAuthorizationHeader(
+        cosmos_client,
+        verb,
+        path,
+        resource_id_or_fullname,
+        is_name_based,
+        resource_type,
+        headers,
+    ):
+        signer = getattr(cosmos_client, "signer", None)
+        if signer is None:
+            return original(
+                cosmos_client,
+                verb,
+                path,
+                resource_id_or_fullname,
+                is_name_based,
+                resource_type,
+                headers,
+            )
+        # Resource ids are signed lower cased, names as they are
+        if resource_id_or_fullname is not None and not is_name_based:
+            resource_id_or_fullname = resource_id_or_fullname.lower()
+        return signer.sign(verb, resource_id_or_fullname, resource_type, headers)
+
+    GetAuthorizationHeader._uses_signer = True
+    auth_module.GetAuthorizationHeader = GetAuthorizationHeader
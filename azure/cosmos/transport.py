@@ -0,0 +1,261 @@
+"""
+HTTP transport used by the client context
+"""
+
+import gzip
+import threading
+import time
+
+import requests
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from typing import Any, Dict, Optional
+
+from . import deadlines, profiling
+from .breaker import FAILURE_STATUS_CODES, CircuitBreakers
+from .hedging import HedgingPolicy
+from .partitions import PartitionTracker
+from .deadlines import DeadlineExceeded
+from .scheduling import Scheduler, current_priority
+
+
+class CosmosSession(requests.Session):
+    """ The `requests` session that carries every request made by a :class:`ClientContext`.
+
+    Responses are negotiated to be gzip or deflate encoded (and transparently decoded by `requests`).
+    Request bodies of at least `compress_requests_over` bytes are sent gzip encoded.
+
+    Reads (GETs and queries) are hedged according to `hedging`, if set.
+
+    Requests are admitted by `scheduler`, if set, according to the priority class of the thread
+    sending them (see :func:`azure.cosmos.scheduling.priority`).
+
+    Requests sent within a deadline (see :func:`azure.cosmos.deadlines.deadline`) fail fast once it
+    has passed, time out when it passes, and are shut down when the operation is cancelled.
+    Throttled responses asking to retry after the deadline fail right away instead of being retried.
+
+    The health of every endpoint is tracked by `breakers`, if set: requests to an endpoint whose
+    circuit breaker is open fail fast with :class:`azure.cosmos.breaker.CircuitOpen`, or reads are
+    rerouted to an alternate endpoint. A hedged read and its hedge each go through the breaker of the
+    endpoint they are sent to.
+
+    :param compress_requests_over: Minimum body size, in bytes, to compress. None disables request compression.
+    :param compression_level: gzip compression level for request bodies.
+    :param hedging: Policy for hedging slow reads. None disables hedging.
+    :param scheduler: Scheduler to admit requests by priority. None sends every request right away.
+    :param partitions: Tracker of the traffic per partition key and partition key range. None disables tracking.
+    :param breakers: Circuit breakers of the endpoints requests are sent to. None disables circuit breaking.
+    """
+
+    def __init__(
+        self,
+        *,
+        compress_requests_over: "Optional[int]" = None,
+        compression_level: "int" = 6,
+        hedging: "Optional[HedgingPolicy]" = None,
+        scheduler: "Optional[Scheduler]" = None,
+        partitions: "Optional[PartitionTracker]" = None,
+        breakers: "Optional[CircuitBreakers]" = None,
+    ):
+        super().__init__()
+        self.hedging = hedging
+        self.scheduler = scheduler
+        self.partitions = partitions
+        self.breakers = breakers
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+        self.compress_requests_over = compress_requests_over
+        self.compression_level = compression_level
+        self.requests_sent = 0
+        self.requests_compressed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        compressed = False
+        if (
+            isinstance(data, bytes)
+            and self.compress_requests_over is not None
+            and len(data) >= self.compress_requests_over
+        ):
+            data = profiling.phase("serialize", gzip.compress, data, self.compression_level)
+            headers = _without(headers, "content-encoding", "content-length")
+            headers["Content-Encoding"] = "gzip"
+            compressed = True
+        if isinstance(data, bytes):
+            headers = _without(headers, "content-length")
+            headers["Content-Length"] = str(len(data))
+
+        active = deadlines.current_deadline()
+        if active is not None:
+            active.check()
+            kwargs["timeout"] = active.clamp(kwargs.get("timeout"))
+
+        profiling.enter_phase("wait")
+        try:
+            if self.scheduler is None:
+                response = self._send(method, url, data, headers, **kwargs)
+            else:
+                admitted = self.scheduler.acquire(current_priority())
+                try:
+                    response = self._send(method, url, data, headers, **kwargs)
+                except Exception:
+                    self.scheduler.release(admitted)
+                    raise
+                self.scheduler.release(admitted, response.status_code, response.headers)
+        except requests.RequestException as e:
+            if active is not None:
+                active.check()
+            raise
+        finally:
+            deadlines.release_connections()
+        profiling.enter_phase("decode")
+        if active is not None and response.status_code == 429:
+            # Don't let the retry policy sleep past the deadline only to give up afterwards
+            left = active.remaining()
+            retry_after = float(response.headers.get("x-ms-retry-after-ms", 0) or 0) / 1000
+            if left is not None and retry_after >= left:
+                raise DeadlineExceeded(
+                    f"Throttled, and asked to retry after {retry_after:.3f}s with {max(left, 0):.3f}s left"
+                )
+        if self.partitions is not None:
+            self.partitions.record(url, headers, response.status_code, response.headers)
+
+        received = response.headers.get("Content-Length")
+        if received is None and not kwargs.get("stream"):
+            received = len(response.content)
+        with self._stats_lock:
+            self.requests_sent += 1
+            self.requests_compressed += compressed
+            self.bytes_sent += len(data) if isinstance(data, bytes) else 0
+            self.bytes_received += int(received or 0)
+        return response
+
+    def _send(self, method, url, data, headers, **kwargs):
+        if self.hedging is not None and _is_read(method, headers):
+            kwargs["stream"] = True
+
+            def send(target):
+                # The hedge is sent from another thread, through the breaker of its own endpoint
+                profiling.enter_phase("wait")
+                return self._guarded_send(method, target, data, headers, **kwargs)
+
+            return self.hedging.execute(send, url)
+        return self._guarded_send(method, url, data, headers, **kwargs)
+
+    def _guarded_send(self, method, url, data, headers, **kwargs):
+        if self.breakers is None:
+            return super().request(method, url, data=data, headers=headers, **kwargs)
+        url, breaker, permit = self.breakers.acquire(url, _is_read(method, headers))
+        started = time.monotonic()
+        failed = None
+        try:
+            response = super().request(method, url, data=data, headers=headers, **kwargs)
+            failed = response.status_code in FAILURE_STATUS_CODES
+            return response
+        except requests.RequestException:
+            # Timeouts and cancellations of the caller's own deadline say nothing about the endpoint
+            active = deadlines.current_deadline()
+            if active is None or not (active.expired or active.cancelled):
+                failed = True
+            raise
+        finally:
+            breaker.release(permit, time.monotonic() - started, failed)
+
+    def enable_cancellation(self):
+        """ Track the connections requests are sent on, so that cancelling an operation shuts down its
+        requests in flight. Call again after replacing adapters. """
+        self._use_pools(_CANCELLABLE_POOLS, _PROFILED_POOLS)
+
+    def enable_profiling(self):
+        """ Attribute time spent connecting and writing requests to the 'send' phase of profiled operations.
+
+        Until then, everything from handing a request to `requests` until its response is read counts as 'wait'.
+        """
+        self._use_pools(_PROFILED_POOLS)
+
+    def _use_pools(self, pools: "Dict[str, Any]", *keep: "Dict[str, Any]"):
+        for adapter in self.adapters.values():
+            manager = getattr(adapter, "poolmanager", None)
+            if manager is not None and manager.pool_classes_by_scheme not in (pools,) + keep:
+                manager.pool_classes_by_scheme = pools
+                # Drop pooled connections, so that new ones are created from the new classes
+                manager.clear()
+
+    def stats(self) -> "Dict[str, Any]":
+        return dict(
+            requests_sent=self.requests_sent,
+            requests_compressed=self.requests_compressed,
+            bytes_sent=self.bytes_sent,
+            bytes_received=self.bytes_received,
+        )
+
+
+def _is_read(method: "str", headers: "Optional[Dict[str, Any]]") -> "bool":
+    if method.upper() == "GET":
+        return True
+    return any(
+        key.lower() == "x-ms-documentdb-isquery" and str(value).lower() == "true"
+        for key, value in (headers or {}).items()
+    )
+
+
+def _without(headers: "Optional[Dict[str, Any]]", *names: "str") -> "Dict[str, Any]":
+    return {
+        key: value
+        for key, value in (headers or {}).items()
+        if key.lower() not in names
+    }
+
+
+class _CancellableHTTPConnection(HTTPConnection):
+    def request(self, *args, **kwargs):
+        deadlines.track_connection(self)
+        return super().request(*args, **kwargs)
+
+
+class _CancellableHTTPSConnection(HTTPSConnection):
+    def request(self, *args, **kwargs):
+        deadlines.track_connection(self)
+        return super().request(*args, **kwargs)
+
+
+class _CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CancellableHTTPConnection
+
+
+class _CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CancellableHTTPSConnection
+
+
+_CANCELLABLE_POOLS = {
+    "http": _CancellableHTTPConnectionPool,
+    "https": _CancellableHTTPSConnectionPool,
+}
+
+
+class _ProfiledHTTPConnection(_CancellableHTTPConnection):
+    def request(self, *args, **kwargs):
+        return profiling.phase("send", super().request, *args, **kwargs)
+
+
+class _ProfiledHTTPSConnection(_CancellableHTTPSConnection):
+    def request(self, *args, **kwargs):
+        return profiling.phase("send", super().request, *args, **kwargs)
+
+
+class _ProfiledHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _ProfiledHTTPConnection
+
+
+class _ProfiledHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _ProfiledHTTPSConnection
+
+
+_PROFILED_POOLS = {
+    "http": _ProfiledHTTPConnectionPool,
+    "https": _ProfiledHTTPSConnectionPool,
+}
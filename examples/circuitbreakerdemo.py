@@ -0,0 +1,124 @@
+import http.server
+import socketserver
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from azure.cosmos.breaker import CircuitBreakers, CircuitOpen
+from azure.cosmos.transport import CosmosSession
+
+# ----------------------------------------------------------------------------------------------------------
+# Drives the transport's circuit breakers against local stub endpoints whose failure mode can be toggled:
+# healthy, failing (503), slow, and dropping connections. Reads are rerouted to a second stub while the
+# primary's breaker is open; writes fail fast. Prints the breaker transitions as they happen, and the
+# stats of every endpoint at the end of each phase.
+#
+# No account is needed.
+# ----------------------------------------------------------------------------------------------------------
+
+OK = "ok"
+ERROR = "error"
+SLOW = "slow"
+RESET = "reset"
+
+PHASE_DURATION = 3.0
+SLOW_RESPONSE = 0.1
+
+
+class FaultyEndpoint:
+    """ A local HTTP endpoint that answers every request according to its current `mode`. """
+
+    def __init__(self, mode: "str" = OK):
+        self.mode = mode
+        self.requests = 0
+        endpoint = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def _respond(self):
+                endpoint.requests += 1
+                mode = endpoint.mode
+                if mode == RESET:
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if mode == SLOW:
+                    time.sleep(SLOW_RESPONSE)
+                status = 503 if mode == ERROR else 200
+                body = b"{}"
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def run_phase(session, primary, mode, outcomes):
+    primary.mode = mode
+    deadline = time.monotonic() + PHASE_DURATION
+    while time.monotonic() < deadline:
+        for method in ("GET", "POST"):
+            try:
+                response = session.request(method, primary.url + "/dbs/demo/colls/items/docs", timeout=2)
+                outcomes[f"{method} {response.status_code}"] += 1
+            except CircuitOpen:
+                outcomes[f"{method} circuit open"] += 1
+            except requests.RequestException:
+                outcomes[f"{method} connection error"] += 1
+        time.sleep(0.01)
+
+
+def run_demo():
+    primary = FaultyEndpoint()
+    secondary = FaultyEndpoint()
+
+    def on_transition(endpoint, previous, state, reason):
+        print(f"  {endpoint}: {previous} -> {state} ({reason})")
+
+    breakers = CircuitBreakers(
+        alternate_endpoints=[secondary.url],
+        on_transition=on_transition,
+        slow_call_duration=SLOW_RESPONSE / 2,
+        slow_call_rate=0.5,
+        window=20,
+        min_calls=10,
+        open_duration=1.0,
+        half_open_calls=2,
+    )
+    session = CosmosSession(breakers=breakers)
+    session.enable_cancellation()
+    try:
+        for mode in (OK, ERROR, OK, SLOW, RESET, OK):
+            print(f"primary {mode}:")
+            outcomes = Counter()
+            run_phase(session, primary, mode, outcomes)
+            print(f"  outcomes: {dict(outcomes)}")
+            for endpoint, stats in breakers.stats()["endpoints"].items():
+                print(
+                    f"  {endpoint}: {stats['state']}, {stats['calls']} calls, {stats['failures']} failed, "
+                    f"{stats['slow_calls']} slow, {stats['rejected']} rejected, opened {stats['times_opened']} times"
+                )
+        print(f"reads rerouted: {breakers.rerouted}")
+        print(f"requests received: primary {primary.requests}, secondary {secondary.requests}")
+    finally:
+        primary.close()
+        secondary.close()
+
+
+if __name__ == "__main__":
+    run_demo()
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import random
+import statistics
+
+from azure.cosmos import CosmosClient, HTTPFailure
+from azure.cosmos.compression import compress_value
+
+# ----------------------------------------------------------------------------------------------------------
+# Measures bytes on the wire and end-to-end latency of upsert_item/get_item/query_items for documents of
+# different sizes, with and without request body compression and compressed field storage.
+#
+# The documents mimic the (large, repetitive) swagger specs uploaded by randomtest.py.
+# ----------------------------------------------------------------------------------------------------------
+
+AUTH_URL = os.environ["ACCOUNT_HOST"]
+AUTH_KEY = os.environ["ACCOUNT_KEY"]
+DATABASE_ID = "compressionbenchmarkdb"
+CONTAINER_ID = "compressionbenchmarkcontainer"
+DOCUMENT_SIZES = [1024, 16 * 1024, 128 * 1024, 1024 * 1024]
+REPETITIONS = 20
+
+
+def make_document(id, size):
+    definitions = {}
+    while len(json.dumps(definitions)) < size:
+        name = f"Definition{len(definitions)}"
+        definitions[name] = {
+            "description": f"The {name} resource definition.",
+            "type": "object",
+            "properties": {
+                "provisioningState": {"type": "string", "readOnly": True},
+                "location": {"type": "string", "description": "Resource location"},
+                "tags": {"type": "object", "additionalProperties": {"type": "string"}},
+                "count": {"type": "integer", "format": "int32", "example": random.randint(0, 1000)},
+            },
+        }
+    return {"id": id, "info": {"version": "2018-01-01"}, "definitions": definitions}
+
+
+def measure(container, document):
+    transport = container.client_context.transport
+    before = transport.stats()
+    timings = []
+    for _ in range(REPETITIONS):
+        start = time.perf_counter()
+        container.upsert_item(document)
+        item = container.get_item(document["id"])
+        item["definitions"]
+        timings.append(time.perf_counter() - start)
+    after = transport.stats()
+    sent = (after["bytes_sent"] - before["bytes_sent"]) / REPETITIONS
+    received = (after["bytes_received"] - before["bytes_received"]) / REPETITIONS
+    return sent, received, statistics.median(timings) * 1000
+
+
+def run_benchmark():
+    print(f"{'size':>10} {'mode':>18} {'sent/op':>10} {'recv/op':>10} {'p50 ms':>8}")
+    for size in DOCUMENT_SIZES:
+        document = make_document(f"benchmark-{size}", size)
+        local = len(json.dumps(compress_value(document["definitions"])))
+        print(f"{size:>10} {'local field ratio':>18} {local / size:>10.2f}")
+
+        for mode, compress_requests_over, fields in [
+            ("plain", None, ()),
+            ("gzip requests", 1024, ()),
+            ("compressed field", None, ("definitions",)),
+        ]:
+            client = CosmosClient(AUTH_URL, AUTH_KEY, compress_requests_over=compress_requests_over)
+            database = client.create_database(DATABASE_ID)
+            try:
+                container = database.create_container(CONTAINER_ID)
+            except HTTPFailure as e:
+                if e.status_code != 409:
+                    raise
+                container = database.get_container(CONTAINER_ID)
+            container.compressed_fields = fields
+            try:
+                sent, received, latency = measure(container, document)
+            except HTTPFailure as e:
+                print(f"{size:>10} {mode:>18} failed with status code {e.status_code}")
+                continue
+            print(f"{size:>10} {mode:>18} {sent:>10.0f} {received:>10.0f} {latency:>8.1f}")
+
+    CosmosClient(AUTH_URL, AUTH_KEY).delete_database(DATABASE_ID)
+
+
+if __name__ == "__main__":
+    run_benchmark()
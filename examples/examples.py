@@ -1,4 +1,4 @@
-from azure.cosmos import HTTPFailure, CosmosClient, Container, Database
+from azure.cosmos import HTTPFailure, CosmosClient, Container, Database, PatchOperation
 
 # It all starts with a client instance:
 import os
@@ -63,6 +63,15 @@ item = items[0]
 item['firstName'] = 'Some Other Name'
 updated_item = container.upsert_item(item) # ISSUE: do we update the item "in place" for system properties and  headers?
 
+# ... or only send the properties that changed, instead of the whole document:
+updated_item = container.patch_item(updated_item, [PatchOperation.set('/firstName', 'Yet Another Name')])
+
+# Containers can also compute the changes for you when replacing an item they returned:
+container.diff_replace = True
+item = container.get_item(updated_item['id'])
+item['firstName'] = 'David'
+updated_item = container.replace_item(item, item)
+
 # If you need to get the properties of a database, they are all there...
 properties = database.properties
 print(json.dumps(properties))
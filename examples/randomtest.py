@@ -47,21 +47,18 @@ print(container)
 
 def upload():
     import glob
-    import json
-
-    for file in glob.glob(
-        "/users/johanste/repos/azure-rest-api-specs/specification/Compute/**/*.json",
-        recursive=True,
-    ):
-        if not "/examples/" in file:
-            with open(file, "r", encoding="UTF-8") as f:
-                try:
-                    data = json.load(f)
-                    data["id"] = file.replace("/", ":")
-                    print(f"Uploading {file}...")
-                    item = container.upsert_item(body=data)
-                except (json.decoder.JSONDecodeError, UnicodeDecodeError):
-                    pass
+    from azure.cosmos.load import load_files
+
+    files = [
+        file
+        for file in glob.glob(
+            "/users/johanste/repos/azure-rest-api-specs/specification/Compute/**/*.json",
+            recursive=True,
+        )
+        if not "/examples/" in file
+    ]
+    # Parses the files in a process pool and upserts them concurrently
+    load_files(container, files, id_from_path=True, progress=print)
 
 def find_stuff(query):
     items = container.query_items(query)
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.batching import BufferedWriter
+
+LINGER = 0.05
+
+
+def make_writer(written, **kwargs):
+    def write(kind, argument):
+        written.append((kind, argument))
+        return argument
+
+    return BufferedWriter(write, lambda body: body.get("pk"), linger=LINGER, **kwargs)
+
+
+def test_single_write_after_idle_is_sent_within_linger():
+    written = []
+    with make_writer(written) as writer:
+        # Let the background thread go idle on an empty queue first
+        time.sleep(LINGER * 2)
+        started = time.monotonic()
+        future = writer.upsert(dict(id="a", pk=1))
+        assert future.result(timeout=2) == dict(id="a", pk=1)
+        assert time.monotonic() - started < LINGER + 0.5
+    assert written == [("upsert", dict(id="a", pk=1))]
+
+
+def test_each_write_after_idle_is_sent_within_linger():
+    written = []
+    with make_writer(written) as writer:
+        for i in range(3):
+            time.sleep(LINGER * 2)
+            writer.upsert(dict(id=str(i), pk=i)).result(timeout=2)
+    assert [argument["id"] for _, argument in written] == ["0", "1", "2"]
+
+
+def test_full_batch_is_sent_before_linger():
+    written = []
+    with make_writer(written, max_batch_size=3) as writer:
+        writer.linger = 60
+        futures = [writer.upsert(dict(id=str(i), pk=i)) for i in range(3)]
+        for future in futures:
+            future.result(timeout=2)
+    assert len(written) == 3
+
+
+def test_collapsed_upserts_resolve_to_distinct_results():
+    written = []
+    with make_writer(written) as writer:
+        writer.linger = 60
+        first = writer.upsert(dict(id="a", pk=1, value=1))
+        second = writer.upsert(dict(id="a", pk=1, value=2))
+        writer.flush()
+        assert first.result(timeout=2) == second.result(timeout=2) == dict(id="a", pk=1, value=2)
+        assert first.result() is not second.result()
+        assert writer.stats()["collapsed"] == 1
+    assert written == [("upsert", dict(id="a", pk=1, value=2))]
+
+
+def test_writes_queued_while_closing_are_written_or_rejected():
+    written = []
+    writer = make_writer(written, max_buffered=1)
+    writer.linger = 60
+    writer.upsert(dict(id="a", pk=1))
+    # The next write waits for capacity, which frees up only once close() has flushed the first
+    outcomes = []
+    blocked = threading.Thread(target=lambda: outcomes.append(_outcome(writer.upsert, dict(id="b", pk=2))))
+    blocked.start()
+    time.sleep(LINGER)
+    writer.close()
+    blocked.join(2)
+    assert not blocked.is_alive()
+    (outcome,) = outcomes
+    if isinstance(outcome, Future):
+        # Queued before the writer closed, so it was written rather than left pending
+        assert outcome.result(timeout=0) == dict(id="b", pk=2)
+    else:
+        assert isinstance(outcome, RuntimeError)
+    with pytest.raises(RuntimeError):
+        writer.upsert(dict(id="c", pk=3))
+
+
+def _outcome(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        return e
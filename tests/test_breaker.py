@@ -0,0 +1,113 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers, CircuitOpen
+
+
+def test_failing_transition_callback_is_logged(caplog):
+    def on_transition(endpoint, previous, state, reason):
+        raise ValueError("exporter down")
+
+    breaker = CircuitBreaker("https://a", min_calls=1, on_transition=on_transition)
+    breaker.release(breaker.acquire(), 0.0, True)
+    assert breaker.state == OPEN
+    assert "https://a" in caplog.text
+    assert "exporter down" in caplog.text
+
+
+def make_breaker(**kwargs):
+    transitions = []
+    options = dict(min_calls=4, window=4, failure_rate=0.5, open_duration=60, half_open_calls=2)
+    options.update(kwargs)
+    breaker = CircuitBreaker(
+        "https://a", on_transition=lambda *transition: transitions.append(transition[1:3]), **options
+    )
+    return breaker, transitions
+
+
+def call(breaker, failed, duration=0.0):
+    breaker.release(breaker.acquire(), duration, failed)
+
+
+def reopen_now(breaker):
+    breaker._opened_at -= breaker.open_duration
+
+
+def test_opens_once_the_failure_rate_is_reached_over_min_calls():
+    breaker, transitions = make_breaker()
+    for failed in (True, False, True):
+        call(breaker, failed)
+    assert breaker.state == CLOSED
+    call(breaker, False)
+    assert breaker.state == OPEN
+    assert transitions == [(CLOSED, OPEN)]
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_opens_on_slow_calls():
+    breaker, _ = make_breaker(slow_call_duration=1.0, slow_call_rate=0.75)
+    for duration in (2.0, 2.0, 0.1, 2.0):
+        call(breaker, False, duration)
+    assert breaker.state == OPEN
+
+
+def test_half_open_closes_after_all_trials_succeed():
+    breaker, transitions = make_breaker(min_calls=1)
+    call(breaker, True)
+    reopen_now(breaker)
+    first, second = breaker.acquire(), breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+    breaker.release(first, 0.0, False)
+    assert breaker.state == HALF_OPEN
+    breaker.release(second, 0.0, False)
+    assert breaker.state == CLOSED
+    assert transitions == [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)]
+
+
+def test_half_open_reopens_when_a_trial_fails():
+    breaker, transitions = make_breaker(min_calls=1)
+    call(breaker, True)
+    reopen_now(breaker)
+    call(breaker, True)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+
+def test_cancelled_trial_frees_its_slot():
+    breaker, _ = make_breaker(min_calls=1, half_open_calls=1)
+    call(breaker, True)
+    reopen_now(breaker)
+    breaker.release(breaker.acquire(), 0.0, None)
+    call(breaker, False)
+    assert breaker.state == CLOSED
+
+
+def test_calls_admitted_before_a_transition_do_not_count_after_it():
+    breaker, _ = make_breaker(min_calls=1)
+    stale = breaker.acquire()
+    call(breaker, True)
+    reopen_now(breaker)
+    trial = breaker.acquire()
+    # Admitted while closed: must neither fail the trial nor count as one
+    breaker.release(stale, 0.0, True)
+    assert breaker.state == HALF_OPEN
+    breaker.release(trial, 0.0, False)
+    assert breaker.state == HALF_OPEN
+    assert breaker.stats()["failures"] == 2
+
+
+def test_reads_are_rerouted_to_an_alternate_endpoint():
+    breakers = CircuitBreakers(alternate_endpoints=["https://b:443"], min_calls=1)
+    url, breaker, permit = breakers.acquire("https://a:443/dbs/db", read=True)
+    breaker.release(permit, 0.0, True)
+    url, breaker, _ = breakers.acquire("https://a:443/dbs/db", read=True)
+    assert url == "https://b:443/dbs/db"
+    assert breaker.endpoint == "https://b:443"
+    assert breakers.rerouted == 1
+    with pytest.raises(CircuitOpen):
+        breakers.acquire("https://a:443/dbs/db", read=False)
@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import Item
+from azure.cosmos.compression import compress_fields
+
+BODY = dict(id="1", text="x" * 1000, tags=["a", "b"])
+
+
+def test_compressed_fields_are_decompressed_for_every_accessor():
+    item = Item({}, compress_fields(BODY, ["text", "tags"]))
+    assert item["text"] == BODY["text"]
+    assert dict(item) == BODY
+    assert dict(item.items()) == BODY
+    assert list(item.values()) == list(BODY.values())
+    assert json.loads(json.dumps(item)) == BODY
+    assert {**item} == BODY
+
+
+def test_compressed_fields_round_trip():
+    stored = compress_fields(BODY, ["text"])
+    assert stored["text"] != BODY["text"]
+    assert compress_fields(stored, ["text"]) is stored
+    assert Item({}, stored)["text"] == BODY["text"]
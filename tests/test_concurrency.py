@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import deadlines
+from azure.cosmos.concurrency import SingleFlight
+
+
+def test_followers_call_again_when_the_leader_runs_out_of_time():
+    flight = SingleFlight()
+    leading = threading.Event()
+    never = threading.Event()
+    results = []
+
+    def leader():
+        def call():
+            leading.set()
+            deadlines.wait(never)
+
+        with deadlines.deadline(0.2):
+            with pytest.raises(deadlines.DeadlineExceeded):
+                flight.do("key", call)
+
+    def follower():
+        results.append(flight.do("key", lambda: "result"))
+
+    threads = [threading.Thread(target=leader)]
+    threads[0].start()
+    assert leading.wait(5)
+    threads += [threading.Thread(target=follower) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["result"] * 3
+    # The leader's call, and one call led by a follower that the others joined, if they were in time
+    assert 2 <= flight.executions <= 4
+
+
+def test_followers_share_the_leaders_error():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def call():
+        release.wait(5)
+        raise ValueError("failed")
+
+    def run():
+        try:
+            flight.do("key", call)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import deadlines
+from azure.cosmos.deadlines import (
+    CancellationToken,
+    DeadlineExceeded,
+    OperationCancelled,
+    cancellable,
+    deadline,
+)
+
+
+def test_nested_deadline_is_never_later_than_the_outer_one():
+    with deadline(0.5) as outer:
+        with deadline(60) as inner:
+            assert inner.expires == outer.expires
+        with deadline(0.1) as inner:
+            assert inner.expires < outer.expires
+            assert deadlines.current_deadline() is inner
+        assert deadlines.current_deadline() is outer
+    assert deadlines.current_deadline() is None
+    assert deadlines.remaining() is None
+
+
+def test_cancelling_the_outer_token_cancels_the_inner_one():
+    outer_token, inner_token = CancellationToken(), CancellationToken()
+    with deadline(cancellation=outer_token):
+        with deadline(cancellation=inner_token) as inner:
+            outer_token.cancel()
+            with pytest.raises(OperationCancelled):
+                inner.check()
+    assert not inner_token.cancelled
+    # Closing the inner deadline stopped following the outer token
+    assert not outer_token._callbacks and not inner_token._callbacks
+
+
+def test_sleep_fails_fast_past_the_deadline():
+    with deadline(0.2):
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            deadlines.sleep(5)
+        assert time.monotonic() - started < 0.1
+
+
+def test_sleep_wakes_up_when_cancelled():
+    token = CancellationToken()
+    threading.Timer(0.05, token.cancel).start()
+    with deadline(cancellation=token):
+        started = time.monotonic()
+        with pytest.raises(OperationCancelled):
+            deadlines.sleep(5)
+        assert time.monotonic() - started < 1
+
+
+def test_wait_raises_at_the_deadline_and_times_out_before_it():
+    event = threading.Event()
+    with deadline(0.1):
+        with pytest.raises(DeadlineExceeded):
+            deadlines.wait(event)
+    with deadline(5):
+        assert not deadlines.wait(event, 0.05)
+        event.set()
+        assert deadlines.wait(event)
+
+
+def test_bound_lowers_waits_to_the_deadline_and_poll_interval():
+    assert deadlines.bound(3.0) == 3.0
+    with deadline(1.0):
+        assert deadlines.bound(None) <= 1.0
+        assert deadlines.bound(0.5) == 0.5
+    with deadline(cancellation=CancellationToken()):
+        assert deadlines.bound(None) == deadlines.CANCELLATION_POLL_INTERVAL
+
+
+def test_clamp_lowers_request_timeouts():
+    with deadline(1.0) as active:
+        assert active.clamp(60) <= 1.0
+        connect, read = active.clamp((0.5, None))
+        assert connect == 0.5 and 0 < read <= 1.0
+    assert deadlines.Deadline().clamp((1, 2)) == (1, 2)
+
+
+def test_propagate_carries_the_deadline_to_another_thread():
+    seen = []
+    with deadline(1.0) as active:
+        record = deadlines.propagate(lambda: seen.append(deadlines.current_deadline()))
+        worker = threading.Thread(target=record)
+        worker.start()
+        worker.join()
+    assert seen == [active]
+
+
+class Service:
+    def __init__(self):
+        self.deadlines = []
+
+    @cancellable
+    def call(self):
+        self.deadlines.append(deadlines.current_deadline())
+        return "done"
+
+    @cancellable
+    def pages(self):
+        for page in range(3):
+            self.deadlines.append(deadlines.current_deadline())
+            yield page
+
+
+def test_cancellable_methods_take_timeout_and_cancellation():
+    service = Service()
+    assert service.call() == "done"
+    assert service.deadlines == [None]
+    assert service.call(timeout=5) == "done"
+    assert service.deadlines[-1].remaining() <= 5
+
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(OperationCancelled):
+        service.call(cancellation=token)
+
+
+def test_cancellable_generators_are_bounded_from_the_call():
+    service = Service()
+    pages = service.pages(timeout=0.1)
+    assert next(pages) == 0
+    time.sleep(0.15)
+    with pytest.raises(DeadlineExceeded):
+        next(pages)
+    # The deadline is only active while the generator runs
+    assert deadlines.current_deadline() is None
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.export import STATE_FILE, export_container
+
+
+class _Gone(Exception):
+    status_code = 410
+    sub_status = 1002
+
+
+class FakeClientContext:
+    """ Range "0" holds documents 0-3 in two pages; once split, range "1" holds what is left of 2-3 and
+    range "2" is empty. """
+
+    def __init__(self, split=False):
+        self.split = split
+        self.requests = []
+
+    def _ReadPartitionKeyRanges(self, collection_link):
+        if self.split:
+            return [dict(id="1", parents=["0"]), dict(id="2", parents=["0"])]
+        return [dict(id="0")]
+
+    def QueryItemsPage(self, collection_link, query=None, options=None, partition_key_range_id=None):
+        continuation = options.get("continuation")
+        self.requests.append((partition_key_range_id, continuation))
+        if partition_key_range_id == "0":
+            if continuation is None:
+                return [dict(id="0"), dict(id="1")], {"x-ms-continuation": "page-2"}
+            if self.split:
+                raise _Gone()
+            return [dict(id="2"), dict(id="3")], {}
+        assert continuation == "page-2"
+        return ([dict(id="2"), dict(id="3")] if partition_key_range_id == "1" else []), {}
+
+
+class FakeContainer:
+    collection_link = "dbs/db/colls/coll"
+
+    def __init__(self, client_context):
+        self.client_context = client_context
+
+
+def exported_ids(path):
+    ids = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".jsonl"):
+            with open(os.path.join(path, name), encoding="UTF-8") as f:
+                ids.extend(json.loads(line)["id"] for line in f)
+    return sorted(ids)
+
+
+def test_range_split_during_the_export_continues_on_its_children(tmp_path):
+    client_context = FakeClientContext()
+    pages = client_context.QueryItemsPage
+
+    def split_after_first_page(*args, **kwargs):
+        documents, headers = pages(*args, **kwargs)
+        client_context.split = True
+        return documents, headers
+
+    client_context.QueryItemsPage = split_after_first_page
+    stats = export_container(FakeContainer(client_context), str(tmp_path), parallelism=1)
+    assert exported_ids(tmp_path) == ["0", "1", "2", "3"]
+    assert stats.documents == 4
+    assert stats.ranges_completed == stats.ranges_total == 2
+
+
+def test_resumed_export_continues_split_ranges_on_their_children(tmp_path):
+    client_context = FakeClientContext()
+    pages = client_context.QueryItemsPage
+
+    def interrupted(*args, **kwargs):
+        if kwargs["options"].get("continuation"):
+            raise KeyboardInterrupt
+        return pages(*args, **kwargs)
+
+    client_context.QueryItemsPage = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        export_container(FakeContainer(client_context), str(tmp_path), parallelism=1)
+    # Written past the recorded progress before the interruption
+    with open(tmp_path / "0.jsonl", "a", encoding="UTF-8") as f:
+        f.write(json.dumps(dict(id="2")) + "\n")
+
+    client_context = FakeClientContext(split=True)
+    stats = export_container(FakeContainer(client_context), str(tmp_path), parallelism=1)
+    assert exported_ids(tmp_path) == ["0", "1", "2", "3"]
+    assert stats.documents == 4
+    assert ("0", "page-2") not in client_context.requests
+    with open(tmp_path / STATE_FILE, encoding="UTF-8") as f:
+        assert json.load(f)["ranges"]["0"]["split"] == ["1", "2"]
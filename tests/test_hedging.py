@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import deadlines
+from azure.cosmos.hedging import HedgingPolicy
+
+PRIMARY = "https://primary/dbs/db/colls/coll/docs/1"
+ALTERNATE = "https://alternate"
+
+
+class _Response:
+    def __init__(self, url):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_policy(threshold, **kwargs):
+    policy = HedgingPolicy(budget=1.0, alternate_endpoints=[ALTERNATE], **kwargs)
+    policy._threshold = threshold
+    return policy
+
+
+def slow(url):
+    # Blocks until cancelled by the other attempt
+    deadlines.wait(threading.Event(), 5)
+    raise AssertionError("not cancelled")
+
+
+def test_reads_are_not_hedged_until_latencies_are_known():
+    policy = make_policy(None)
+    sent = []
+    assert policy.execute(lambda url: sent.append(url) or _Response(url), PRIMARY).url == PRIMARY
+    assert sent == [PRIMARY]
+    policy.close()
+
+
+def test_slow_read_is_hedged_and_cancelled_when_the_hedge_wins():
+    policy = make_policy(0.01)
+    cancelled = []
+
+    def send(url):
+        if url.startswith(ALTERNATE):
+            return _Response(url)
+        try:
+            return slow(url)
+        except deadlines.OperationCancelled:
+            cancelled.append(url)
+            raise
+
+    started = time.monotonic()
+    response = policy.execute(send, PRIMARY)
+    assert response.url == ALTERNATE + "/dbs/db/colls/coll/docs/1"
+    assert time.monotonic() - started < 1
+    assert cancelled == [PRIMARY]
+    assert policy.stats()["hedges_won"] == 1
+    policy.close()
+
+
+def test_hedge_is_cancelled_when_the_read_wins():
+    policy = make_policy(0.01)
+    cancelled = threading.Event()
+
+    def send(url):
+        if url.startswith(ALTERNATE):
+            try:
+                return slow(url)
+            except deadlines.OperationCancelled:
+                cancelled.set()
+                raise
+        # Answer once the hedge was sent
+        deadlines.sleep(0.1)
+        return _Response(url)
+
+    assert policy.execute(send, PRIMARY).url == PRIMARY
+    assert cancelled.wait(5)
+    assert policy.stats()["hedges_fired"] == 1
+    assert policy.stats()["hedges_won"] == 0
+    policy.close()
+
+
+def test_fast_read_takes_no_worker():
+    policy = make_policy(0.05)
+    submitted = []
+    submit = policy._executor.submit
+    policy._executor.submit = lambda *args: submitted.append(args) or submit(*args)
+    for _ in range(5):
+        policy.execute(_Response, PRIMARY)
+    time.sleep(0.1)
+    assert submitted == []
+    assert policy.stats()["hedges_fired"] == 0
+    policy.close()
+
+
+def test_failed_read_does_not_wait_for_its_hedge():
+    policy = make_policy(5.0)
+
+    def send(url):
+        raise ConnectionError("reset")
+
+    started = time.monotonic()
+    with pytest.raises(ConnectionError):
+        policy.execute(send, PRIMARY)
+    assert time.monotonic() - started < 1
+    policy.close()
+
+
+def test_hedges_are_limited_by_the_budget():
+    policy = make_policy(0.01)
+    policy.budget = 0.0
+    assert policy.execute(lambda url: deadlines.sleep(0.05) or _Response(url), PRIMARY).url == PRIMARY
+    assert policy.stats()["hedges_fired"] == 0
+    assert policy.stats()["hedges_denied"] == 1
+    policy.close()
+
+
+def test_closed_policy_stops_hedging():
+    policy = make_policy(0.01)
+    policy.execute(_Response, PRIMARY)
+    timer = policy._timer
+    policy.close()
+    assert not timer.is_alive()
+    assert policy.execute(lambda url: deadlines.sleep(0.05) or _Response(url), PRIMARY).url == PRIMARY
+    assert policy.stats()["hedges_fired"] == 0
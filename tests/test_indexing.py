@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.indexing import DEFAULT_POLICY, WorkloadRecorder, is_indexed
+from azure.cosmos.query import QueryPlan
+
+
+@pytest.mark.parametrize(
+    "path, indexed",
+    [
+        ("/name", True),
+        ("/address/city", True),
+        ("/address/zip", False),
+        ("/address/geo/lat", False),
+        ("/tags/[]", False),
+        ("/_etag", False),
+    ],
+)
+def test_most_precise_policy_path_decides(path, indexed):
+    policy = dict(
+        includedPaths=[dict(path="/*"), dict(path="/address/city/?")],
+        excludedPaths=[dict(path="/address/*"), dict(path="/tags/*"), dict(path='/"_etag"/?')],
+    )
+    assert is_indexed(policy, path) is indexed
+
+
+def test_nothing_is_indexed_without_indexing():
+    assert not is_indexed(dict(DEFAULT_POLICY, indexingMode="none"), "/name")
+    assert not is_indexed(dict(includedPaths=[], excludedPaths=[]), "/name")
+
+
+def record(recorder, query, charge=10.0):
+    recorder.record_query(QueryPlan(query), {"x-ms-request-charge": str(charge)})
+
+
+def test_recommendation_indexes_only_queried_paths():
+    recorder = WorkloadRecorder()
+    record(recorder, "SELECT * FROM c WHERE c.name = @name")
+    record(recorder, "SELECT * FROM c WHERE c.address.city = 'Oslo'")
+    document = dict(id="1", name="a", address=dict(city="Oslo", zip="0150"), tags=["x", "y"], notes="...")
+    for _ in range(4):
+        recorder.record_write(document, {"x-ms-request-charge": "10"})
+
+    recommendation = recorder.recommend()
+    assert recommendation.policy["includedPaths"] == [dict(path="/name/?"), dict(path="/address/city/?")]
+    assert "compositeIndexes" not in recommendation.policy
+    # name, city, zip, two tags and notes under the default policy (not the system property id);
+    # name and city after
+    assert recommendation.terms_before == 6
+    assert recommendation.terms_after == 2
+    assert recommendation.estimated_savings == pytest.approx(0.5 * (1 - 2 / 6))
+    assert recommendation.estimated_write_charge == pytest.approx(10 * (1 - 0.5 * (1 - 2 / 6)))
+
+
+def test_object_paths_are_indexed_with_everything_below():
+    recorder = WorkloadRecorder()
+    record(recorder, "SELECT * FROM c WHERE IS_DEFINED(c.address) ORDER BY c.address")
+    recorder.record_write(dict(id="1", address=dict(city="Oslo")), None)
+    policy = recorder.recommend().policy
+    assert policy["includedPaths"] == [dict(path="/address/*")]
+    assert "compositeIndexes" not in policy
+
+
+def test_filter_with_order_by_gets_a_composite_index():
+    recorder = WorkloadRecorder()
+    record(recorder, "SELECT * FROM c WHERE c.name = @name ORDER BY c.age DESC")
+    record(recorder, "SELECT * FROM c WHERE c.name = @other ORDER BY c.age DESC")
+    policy = recorder.recommend().policy
+    assert policy["compositeIndexes"] == [
+        [dict(path="/name", order="ascending"), dict(path="/age", order="descending")]
+    ]
+
+
+def test_queries_are_listed_most_expensive_first():
+    recorder = WorkloadRecorder()
+    record(recorder, "SELECT * FROM c WHERE c.a = 1", charge=1.0)
+    record(recorder, "SELECT * FROM c WHERE c.b = 1", charge=3.0)
+    record(recorder, "SELECT * FROM c WHERE c.a = 1", charge=1.0)
+    queries = recorder.queries()
+    assert [(query["filter_paths"], query["count"]) for query in queries] == [(["/b"], 1), (["/a"], 2)]
@@ -0,0 +1,40 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.load import load_files
+
+
+class WriteBehindContainer:
+    """ Answers writes with futures, as a container with write-behind enabled does; writes of
+    documents with `fail` set fail. """
+
+    def __init__(self):
+        self.written = []
+
+    def upsert_item(self, body):
+        future = Future()
+        if body.get("fail"):
+            future.set_exception(ValueError("rejected"))
+        else:
+            self.written.append(body["id"])
+            future.set_result(body)
+        return future
+
+
+def test_failed_buffered_writes_are_dead_lettered(tmp_path):
+    source = tmp_path / "documents.jsonl"
+    source.write_text("\n".join(json.dumps(dict(id=str(i), fail=i == 2)) for i in range(4)) + "\n")
+    dead_letter = tmp_path / "failed.jsonl"
+    container = WriteBehindContainer()
+
+    stats = load_files(container, [str(source)], processes=1, dead_letter=str(dead_letter))
+
+    assert sorted(container.written) == ["0", "1", "3"]
+    assert stats.documents_written == 3
+    assert stats.documents_failed == 1
+    [failed] = [json.loads(line) for line in dead_letter.read_text().splitlines()]
+    assert failed["document"]["id"] == "2"
@@ -0,0 +1,131 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.merge import CrossPartitionMerge, rewrite_for_merge, sort_key
+from azure.cosmos.query import QueryPlan
+
+
+class FakeClientContext:
+    """ Answers the query of each partition key range with its results, `page_size` at a time. """
+
+    def __init__(self, results_by_range, page_size=2):
+        self.results_by_range = results_by_range
+        self.page_size = page_size
+        self.queries = []
+
+    def QueryItemsPage(self, collection_link, query, options, partition_key_range_id):
+        self.queries.append(query["query"])
+        results = self.results_by_range[partition_key_range_id]
+        start = int(options.get("continuation", 0))
+        end = start + min(self.page_size, options["maxItemCount"])
+        headers = {"x-ms-request-charge": "1"}
+        if end < len(results):
+            headers["x-ms-continuation"] = str(end)
+        return results[start:end], headers
+
+
+class FakeContainer:
+    collection_link = "dbs/db/colls/coll"
+
+    def __init__(self, client_context):
+        self.client_context = client_context
+
+
+def merge(query, results_by_range, parameters=None, **kwargs):
+    client_context = FakeClientContext(results_by_range)
+    merger = CrossPartitionMerge(
+        FakeContainer(client_context),
+        query,
+        parameters,
+        plan=QueryPlan(query),
+        ranges=[dict(id=range_id) for range_id in results_by_range],
+        **kwargs,
+    )
+    return list(merger), merger, client_context
+
+
+def row(payload, *values):
+    """ A result of the rewritten query; `Ellipsis` stands for an undefined sort value. """
+    items = {str(i): value for i, value in enumerate(values) if value is not Ellipsis}
+    return dict(orderByItems=items, payload=payload)
+
+
+def test_values_sort_by_type_first():
+    values = ["b", 2, None, True, "a", False, 1.5]
+    ordered = sorted(values, key=sort_key)
+    assert ordered == [None, False, True, 1.5, 2, "a", "b"]
+    assert sort_key(None, defined=False) < sort_key(None)
+
+
+def test_rewrite_carries_the_sort_values_with_the_row():
+    plan = QueryPlan("SELECT TOP 5 c.id, c.age AS years FROM c WHERE c.x = 1 ORDER BY c.age DESC, c.id")
+    assert rewrite_for_merge(plan) == (
+        'SELECT TOP 5 VALUE {"orderByItems": {"0": c.age, "1": c.id}, '
+        '"payload": {"id": c.id, "years": c.age}} FROM c WHERE c.x = 1 ORDER BY c.age DESC, c.id'
+    )
+    with pytest.raises(ValueError):
+        rewrite_for_merge(QueryPlan("SELECT * FROM c"))
+
+
+def test_ranges_are_merged_in_order():
+    results, merger, client_context = merge(
+        "SELECT * FROM c ORDER BY c.age",
+        {
+            "0": [row("a", ...), row("b", 1), row("c", 5), row("d", 9)],
+            "1": [row("e", None), row("f", 2), row("g", "x")],
+            "2": [],
+        },
+    )
+    assert results == ["a", "e", "b", "f", "c", "d", "g"]
+    assert all("orderByItems" in query for query in client_context.queries)
+    assert merger.stats()["results"] == 7
+
+
+def test_descending_and_secondary_sort_terms():
+    results, _, _ = merge(
+        "SELECT * FROM c ORDER BY c.age DESC, c.id",
+        {
+            "0": [row("a", 9, "a"), row("c", 5, "c"), row("z", 1, "z")],
+            "1": [row("b", 9, "b"), row("d", 5, "d")],
+        },
+    )
+    assert results == ["a", "b", "c", "d", "z"]
+
+
+def test_top_stops_the_merge():
+    results, _, _ = merge(
+        "SELECT TOP @n * FROM c ORDER BY c.age",
+        {"0": [row(i, i) for i in range(0, 20, 2)], "1": [row(i, i) for i in range(1, 20, 2)]},
+        parameters=[dict(name="@n", value=3)],
+    )
+    assert results == [0, 1, 2]
+
+
+def test_distinct_with_order_by_drops_duplicates_across_ranges():
+    results, _, _ = merge(
+        "SELECT DISTINCT VALUE c.city FROM c ORDER BY c.city",
+        {
+            "0": [row("Bergen", "Bergen"), row("Oslo", "Oslo"), row("Oslo", "Oslo")],
+            "1": [row("Bergen", "Bergen"), row("Tromso", "Tromso")],
+        },
+    )
+    assert results == ["Bergen", "Oslo", "Tromso"]
+
+
+def test_distinct_spills_once_over_the_memory_budget(tmp_path):
+    ranges = {
+        "0": [dict(n=i % 150) for i in range(300)],
+        "1": [dict(n=i % 200) for i in range(300)],
+    }
+    results, merger, _ = merge(
+        "SELECT DISTINCT * FROM c", ranges, max_memory=50 * 96, directory=str(tmp_path)
+    )
+    assert sorted(result["n"] for result in results) == list(range(200))
+    assert merger.stats()["spill_files"] > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_aggregates_are_rejected():
+    with pytest.raises(ValueError):
+        merge("SELECT VALUE COUNT(1) FROM c", {"0": []})
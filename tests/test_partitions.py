@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.partitions import PartitionTracker, SpaceSaving, analyze_partition_key
+
+
+class FakeClientContext:
+    """ One partition key range of `documents`, queried a page of `page_size` at a time. """
+
+    def __init__(self, documents, page_size=3):
+        self.documents = documents
+        self.page_size = page_size
+
+    def _ReadPartitionKeyRanges(self, collection_link):
+        return [dict(id="0")]
+
+    def QueryItemsPage(self, collection_link, query=None, options=None, partition_key_range_id=None):
+        text = query["query"]
+        if "MIN(" in text or "MAX(" in text:
+            timestamps = [document["_ts"] for document in self.documents]
+            return [min(timestamps) if "MIN(" in text else max(timestamps)], {}
+        parameters = {parameter["name"]: parameter["value"] for parameter in query["parameters"]}
+        matching = [
+            document
+            for document in self.documents
+            if parameters["@start"] <= document["_ts"] < parameters["@end"]
+        ]
+        start = int(options.get("continuation", 0))
+        end = start + min(self.page_size, options["maxItemCount"])
+        headers = {"x-ms-continuation": str(end)} if end < len(matching) else {}
+        return matching[start:end], headers
+
+
+class FakeContainer:
+    collection_link = "dbs/db/colls/coll"
+
+    def __init__(self, client_context):
+        self.client_context = client_context
+
+
+def test_sample_is_spread_over_the_modification_times():
+    # Stored oldest first: a prefix sample would only see the first account
+    documents = [dict(id=f"{i:03}", account="old", _ts=i) for i in range(100)]
+    documents += [dict(id=f"{i:03}", account="new", _ts=i) for i in range(100, 200)]
+    result = analyze_partition_key(FakeContainer(FakeClientContext(documents)), "/account", sample_size=20)
+    assert result["documents"] == 20
+    assert sorted(largest["partition_key"] for largest in result["largest"]) == ['"new"', '"old"']
+    assert result["largest"][0]["share"] == pytest.approx(0.5, abs=0.05)
+
+
+def test_sparse_windows_leave_their_share_to_later_ones():
+    documents = [dict(id=str(i), account=str(i % 4), _ts=1000 + i) for i in range(30)]
+    documents.append(dict(id="first", _ts=0))
+    result = analyze_partition_key(FakeContainer(FakeClientContext(documents)), "/account", sample_size=10)
+    assert result["documents"] == 10
+    assert result["missing"] == 1
+
+
+def test_space_saving_counts_exactly_within_capacity():
+    sketch = SpaceSaving(capacity=3)
+    for key, weight in (("a", 1), ("b", 2.5), ("a", 1), ("c", 0.5)):
+        sketch.add(key, weight)
+    assert sketch.top(3) == [("b", 2.5, 0.0), ("a", 2.0, 0.0), ("c", 0.5, 0.0)]
+    assert sketch.total == 5.0
+
+
+def test_space_saving_evicts_the_smallest_count():
+    sketch = SpaceSaving(capacity=2)
+    for key in ("a", "a", "a", "b", "c"):
+        sketch.add(key)
+    # c replaced b, inheriting its count as the error of its estimate
+    assert sketch.top(2) == [("a", 3.0, 0.0), ("c", 2.0, 1.0)]
+    assert len(sketch) == 2
+
+
+def test_space_saving_tracks_heavy_hitters_of_mixed_key_types():
+    # Keys with more than total / capacity = 200 of the weight are guaranteed to be tracked
+    sketch = SpaceSaving(capacity=10)
+    for i in range(1000):
+        sketch.add("hot" if i % 3 == 0 else (i, str(i)))
+        sketch.add(7 if i % 4 == 0 else f"cold-{i}")
+    top = dict((key, (count, error)) for key, count, error in sketch.top(2))
+    assert set(top) == {"hot", 7}
+    for key, actual in (("hot", 334), (7, 250)):
+        count, error = top[key]
+        assert count - error <= actual <= count
+
+
+def test_tracker_records_partition_keys_and_ranges_per_container():
+    tracker = PartitionTracker(capacity=10)
+    url = "https://account/dbs/db/colls/coll/docs/1"
+    for pk, charge, status in (('["a"]', 5.0, 200), ('["a"]', 1.0, 429), ('["b"]', 2.0, 200)):
+        tracker.record(
+            url,
+            {"x-ms-documentdb-partitionkey": pk},
+            status,
+            {"x-ms-request-charge": str(charge), "x-ms-documentdb-partitionkeyrangeid": "0"},
+        )
+    stats = tracker.get("/dbs/db/colls/coll/")
+    assert [hot["partition_key"] for hot in stats.hot_keys()] == ['["a"]', '["b"]']
+    assert stats.hot_keys(by="throttled")[0]["share"] == 1.0
+    assert stats.ranges["0"] == dict(requests=3, request_charge=8.0, throttled=1)
+    assert stats.skew() == 1.0
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.permissions import ResourceTokenCache
+
+USER = "dbs/db/users/alice"
+
+
+class FakeClientContext:
+    """ Grants a token on the database and one on a container of it, fresh on every read. """
+
+    def __init__(self):
+        self.reads = 0
+        self.error = None
+        self.read = threading.Event()
+
+    def ReadPermissions(self, user_link, options=None):
+        if self.error is not None:
+            raise self.error
+        self.reads += 1
+        self.read.set()
+        return [
+            dict(id="db", permissionMode="Read", resource="dbs/db", _token=f"db-{self.reads}"),
+            dict(id="coll", permissionMode="All", resource="dbs/db/colls/coll", _token=f"coll-{self.reads}"),
+        ]
+
+
+@pytest.fixture
+def cache():
+    client_context = FakeClientContext()
+    cache = ResourceTokenCache(client_context, expiry_seconds=600)
+    yield client_context, cache
+    cache.close()
+
+
+def test_tokens_are_read_once_and_the_most_specific_wins(cache):
+    client_context, cache = cache
+    assert cache.token(USER, "dbs/db/colls/coll") == "coll-1"
+    assert cache.token(USER, "/dbs/db/colls/other/") == "db-1"
+    assert client_context.reads == 1
+    assert cache.stats()["hits"] == 1
+    with pytest.raises(LookupError):
+        cache.get(USER, "dbs/elsewhere")
+
+
+def test_tokens_near_expiry_are_read_again(cache):
+    client_context, cache = cache
+    cache.token(USER, "dbs/db")
+    cache._users[USER].expires = time.time() + 10
+    assert cache.token(USER, "dbs/db") == "db-2"
+    assert cache.stats()["misses"] == 2
+
+
+def test_tokens_are_refreshed_in_the_background(cache):
+    client_context, cache = cache
+    cache.token(USER, "dbs/db")
+    client_context.read.clear()
+    with cache._condition:
+        cache._users[USER].refresh_at = time.time()
+        cache._condition.notify_all()
+    assert client_context.read.wait(2)
+    deadline = time.monotonic() + 2
+    while cache.refreshes < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.token(USER, "dbs/db") == "db-2"
+    assert client_context.reads == 2
+
+
+def test_failed_refresh_keeps_the_tokens_and_backs_off(cache):
+    client_context, cache = cache
+    cache.token(USER, "dbs/db")
+    client_context.error = ConnectionError("unavailable")
+    with cache._condition:
+        tokens = cache._users[USER]
+        tokens.refresh_at = time.time()
+        cache._condition.notify_all()
+    deadline = time.monotonic() + 2
+    while cache.refresh_errors < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.refresh_errors == 1
+    # Retried halfway to expiry
+    assert tokens.refresh_at == pytest.approx(time.time() + 300, abs=5)
+    assert cache.token(USER, "dbs/db") == "db-1"
+
+
+def test_idle_users_are_not_refreshed_and_dropped_once_expired():
+    cache = ResourceTokenCache(FakeClientContext(), expiry_seconds=600, idle_timeout=60)
+    cache._read(USER)
+    cache._read("dbs/db/users/bob")
+    now = time.time()
+    tokens = cache._users[USER]
+    tokens.last_used = now - 120
+    cache._users["dbs/db/users/bob"].refresh_at = now - 1
+    due, next_due = cache._due(now)
+    assert due == ["dbs/db/users/bob"]
+    assert next_due is None
+    assert USER in cache._users
+
+    cache._due(tokens.expires)
+    assert USER not in cache._users
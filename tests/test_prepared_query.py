@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from internal.cosmos.errors import HTTPFailure
+
+from azure.cosmos import Container
+from azure.cosmos.caching import LRUCache
+from azure.cosmos.concurrency import SingleFlight
+from azure.cosmos.query import QueryPlan
+
+DOCUMENTS = {"0": [dict(id="1", pk="a")], "1": [dict(id="2", pk="b")], "2": [dict(id="3", pk="c")]}
+
+
+class FakeClientContext:
+    """ A container partitioned on /pk, with a range per key of DOCUMENTS. """
+
+    def __init__(self):
+        self.profiler = None
+        self.query_plans = LRUCache(16)
+        self.single_flight = SingleFlight()
+        self.last_response_headers = None
+        self.ranges = [dict(id="0"), dict(id="1")]
+        self.range_reads = 0
+        self.pages = []
+        self.queries = []
+
+    def coalesce(self, key, fn):
+        return self.single_flight.do(key, fn)
+
+    def ReadContainer(self, collection_link):
+        return dict(partitionKey=dict(paths=["/pk"]))
+
+    def _ReadPartitionKeyRanges(self, collection_link):
+        self.range_reads += 1
+        return list(self.ranges)
+
+    def QueryItemsPage(self, collection_link, query=None, options=None, partition_key_range_id=None):
+        self.pages.append((partition_key_range_id, options.get("continuation")))
+        if partition_key_range_id not in (r["id"] for r in self.ranges):
+            raise HTTPFailure(410, "Gone", {"x-ms-substatus": "1002"})
+        return list(DOCUMENTS[partition_key_range_id]), {}
+
+    def QueryItems(self, database_or_Container_link, query, options=None, partition_key=None):
+        self.queries.append(dict(options or {}))
+        self.last_response_headers = {}
+        return [document for documents in DOCUMENTS.values() for document in documents]
+
+
+def make_container():
+    client_context = FakeClientContext()
+    return client_context, Container(client_context, "db", "coll")
+
+
+def test_equality_filters_of_conjunctions():
+    plan = QueryPlan("SELECT * FROM c WHERE c.pk = @pk AND 'NY' = c.address.state AND c.n > 1")
+    assert plan.equality_filters == {"/pk": "@pk", "/address/state": "'NY'"}
+    assert QueryPlan("SELECT * FROM c WHERE c.pk = @pk OR c.n = 1").equality_filters == {}
+    assert QueryPlan("SELECT * FROM c WHERE NOT c.pk = @pk").equality_filters == {}
+
+
+def test_query_pinning_the_partition_key_goes_to_one_partition():
+    client_context, container = make_container()
+    prepared = container.prepare("SELECT * FROM c WHERE c.pk = @pk")
+    list(prepared.query_items({"@pk": "a"}))
+    list(container.prepare("SELECT * FROM c WHERE c.pk = 'b'").query_items())
+    assert [query.get("partitionKey") for query in client_context.queries] == ["a", "b"]
+    assert client_context.range_reads == 0
+
+
+def test_query_runs_on_the_cached_ranges():
+    client_context, container = make_container()
+    prepared = container.prepare("SELECT * FROM c WHERE c.n > @n")
+    for _ in range(2):
+        assert [item["id"] for item in prepared.query_items({"@n": 1})] == ["1", "2"]
+    assert client_context.range_reads == 1
+    assert client_context.queries == []
+
+
+def test_split_range_is_read_on_its_children():
+    client_context, container = make_container()
+    prepared = container.prepare("SELECT * FROM c WHERE c.n > @n")
+    list(prepared.query_items({"@n": 1}))
+    client_context.ranges = [dict(id="0"), dict(id="2", parents=["1"]), dict(id="1b", parents=["1"])]
+    DOCUMENTS["1b"] = []
+    try:
+        assert [item["id"] for item in prepared.query_items({"@n": 1})] == ["1", "3"]
+    finally:
+        del DOCUMENTS["1b"]
+    assert client_context.range_reads == 2
+    assert [range_id for range_id, _ in client_context.pages[-4:]] == ["0", "1", "2", "1b"]
+    assert [r["id"] for r in prepared.partition_key_ranges] == ["0", "2", "1b"]
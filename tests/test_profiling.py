@@ -0,0 +1,56 @@
+import types
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import profiling
+from azure.cosmos.profiling import Profiler
+
+
+class _Client:
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+
+
+def test_failing_exporter_does_not_fail_the_operation():
+    def exporter(span):
+        raise RuntimeError("exporter is down")
+
+    profiler = Profiler(exporter=exporter)
+    assert profiler.run("Container.get_item", lambda: "item") == "item"
+    assert profiler.stats()["Container.get_item"]["count"] == 1
+
+
+def test_instrumented_phases_are_timed_for_profiled_clients_only():
+    calls = []
+    module = types.SimpleNamespace(sign=lambda client, value: calls.append(value) or value)
+    profiling.instrument(module, "sign", "sign")
+    profiler = Profiler()
+
+    def operation(client):
+        return module.sign(client, "signature")
+
+    assert profiler.run("Container.get_item", operation, _Client(profiler)) == "signature"
+    assert profiler.stats()["Container.get_item"]["phases"]["sign"] > 0
+    profiler.reset()
+    assert profiler.run("Container.get_item", operation, _Client()) == "signature"
+    assert profiler.stats()["Container.get_item"]["phases"]["sign"] == 0
+    assert calls == ["signature", "signature"]
+
+
+def test_request_bodies_of_profiled_clients_are_serialized_in_their_phase():
+    sent = []
+    module = types.SimpleNamespace(
+        _RequestBodyFromData=lambda data: f"json:{data}",
+        SynchronizedRequest=lambda client, *args, **kwargs: sent.append(args[6]),
+    )
+    profiling.instrument_serialization(module)
+    profiler = Profiler()
+    arguments = (None,) * 6 + ({"id": "1"},)
+    profiler.run(
+        "Container.upsert_item", module.SynchronizedRequest, _Client(profiler), *arguments, query_params=None
+    )
+    module.SynchronizedRequest(_Client(), *arguments, query_params=None)
+    assert sent == ["json:{'id': '1'}", {"id": "1"}]
+    assert profiler.stats()["Container.upsert_item"]["phases"]["serialize"] > 0
@@ -0,0 +1,185 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos import Container
+from azure.cosmos.caching import ChangeFeedInvalidator, LRUCache, QueryResultCache
+from azure.cosmos.concurrency import SingleFlight
+
+DOCUMENTS = [dict(id="1", pk="a"), dict(id="2", pk="b")]
+
+
+class _Results:
+    """ Query results as returned by the client: iterable, or fetched a block at a time. """
+
+    def __init__(self, client_context, documents):
+        self._client_context = client_context
+        self._blocks = [list(documents)]
+
+    def __iter__(self):
+        while self._blocks:
+            yield from self.fetch_next_block()
+
+    def fetch_next_block(self):
+        self._client_context.last_response_headers = {"x-ms-request-charge": "2.5"}
+        return self._blocks.pop(0) if self._blocks else []
+
+
+class FakeClientContext:
+    """ Answers every query with DOCUMENTS, once `release` is set. """
+
+    def __init__(self):
+        self.profiler = None
+        self.query_plans = LRUCache(16)
+        self.single_flight = SingleFlight()
+        self.queries = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self._thread_state = threading.local()
+
+    @property
+    def last_response_headers(self):
+        return getattr(self._thread_state, "last_response_headers", None)
+
+    @last_response_headers.setter
+    def last_response_headers(self, headers):
+        self._thread_state.last_response_headers = headers
+
+    def coalesce(self, key, fn):
+        return self.single_flight.do(key, fn)
+
+    def QueryItems(self, database_or_Container_link, query, options=None, partition_key=None):
+        self.queries += 1
+        self.started.set()
+        assert self.release.wait(5)
+        return _Results(self, DOCUMENTS)
+
+
+def run_concurrently(client_context, *calls):
+    results = [None] * len(calls)
+    errors = []
+
+    def run(index, call):
+        try:
+            results[index] = [dict(item) for item in call()]
+        except Exception as e:
+            errors.append(e)
+
+    threads = []
+    for index, call in enumerate(calls):
+        thread = threading.Thread(target=run, args=(index, call))
+        thread.start()
+        threads.append(thread)
+        if index == 0:
+            assert client_context.started.wait(5)
+    # Give the other callers time to join the first one's request, if they share it
+    time.sleep(0.1)
+    client_context.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert not errors
+    return results
+
+
+def make_container():
+    client_context = FakeClientContext()
+    container = Container(client_context, "db", "coll")
+    container.result_cache = QueryResultCache(ttl=60)
+    return client_context, container
+
+
+def test_cached_and_uncached_queries_run_concurrently():
+    client_context, container = make_container()
+    query = "SELECT * FROM c"
+    cached, uncached = run_concurrently(
+        client_context,
+        lambda: container.query_items(query),
+        lambda: container.query_items(query, cache_ttl=0),
+    )
+    assert cached == DOCUMENTS
+    assert uncached == DOCUMENTS
+    assert client_context.queries == 2
+
+
+def test_concurrent_cached_queries_share_one_request():
+    client_context, container = make_container()
+    query = "SELECT * FROM c"
+    first, second = run_concurrently(
+        client_context,
+        lambda: container.query_items(query),
+        lambda: container.query_items(query),
+    )
+    assert first == second == DOCUMENTS
+    assert client_context.queries == 1
+    assert client_context.single_flight.coalesced == 1
+    assert [dict(item) for item in container.query_items(query)] == DOCUMENTS
+    assert container.result_cache.hits == 1
+
+
+class _ChangeFeed:
+    def __init__(self, client_context):
+        self._client_context = client_context
+
+    def fetch_next_block(self):
+        self._client_context.last_response_headers = {"etag": "1"}
+        return []
+
+
+class FakeChangeFeedContext:
+    """ A container of one partition key range without changes, whose change feed can fail. """
+
+    def __init__(self):
+        self.last_response_headers = None
+        self.error = None
+
+    def _ReadPartitionKeyRanges(self, collection_link):
+        return [dict(id="0")]
+
+    def QueryItemsChangeFeed(self, collection_link, options=None):
+        if self.error is not None:
+            raise self.error
+        return _ChangeFeed(self)
+
+
+def test_cache_is_bypassed_while_the_change_feed_fails():
+    client_context = FakeChangeFeedContext()
+    cache = QueryResultCache(ttl=60)
+    cache.invalidator = ChangeFeedInvalidator(client_context, "dbs/db/colls/coll", on_change=cache.clear)
+    cache.invalidator.poll()
+    cache.put("key", {}, DOCUMENTS)
+    assert cache.get("key") == ({}, DOCUMENTS)
+
+    client_context.error = ConnectionError("unavailable")
+    with pytest.raises(ConnectionError):
+        cache.invalidator.poll()
+    assert cache.get("key") is None
+    cache.put("key", {}, DOCUMENTS)
+    assert cache.get("key") is None
+
+    client_context.error = None
+    assert not cache.invalidator.poll()
+    cache.put("key", {}, DOCUMENTS)
+    assert cache.get("key") == ({}, DOCUMENTS)
+
+
+def test_results_read_before_a_clear_are_not_stored():
+    client_context, container = make_container()
+    cache = container.result_cache
+    query = "SELECT * FROM c"
+    queried = client_context.QueryItems
+
+    def cleared_while_querying(*args, **kwargs):
+        results = queried(*args, **kwargs)
+        cache.clear()
+        return results
+
+    client_context.QueryItems = cleared_while_querying
+    client_context.release.set()
+    assert [dict(item) for item in container.query_items(query)] == DOCUMENTS
+    assert len(cache) == 0
+    client_context.QueryItems = queried
+    assert [dict(item) for item in container.query_items(query)] == DOCUMENTS
+    assert len(cache) == 1
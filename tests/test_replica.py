@@ -0,0 +1,183 @@
+import pytest
+
+pytest.importorskip("internal.cosmos")
+
+from azure.cosmos.replica import LocalReplica
+
+DOCUMENTS = [
+    dict(id="number", pk="a", _ts=1, value=10, flag=1, tags=[1, "red"]),
+    dict(id="string", pk="a", _ts=1, value="10", flag="1", tags=["1"]),
+    dict(id="true", pk="b", _ts=1, value=True, flag=True),
+    dict(id="null", pk="b", _ts=1, value=None),
+    dict(id="missing", pk="b", _ts=1),
+]
+
+
+class _ChangeFeed:
+    def __init__(self, client_context, documents):
+        self._client_context = client_context
+        self._blocks = [documents] if documents else []
+
+    def fetch_next_block(self):
+        self._client_context.last_response_headers = {"etag": str(self._client_context.etag)}
+        return self._blocks.pop(0) if self._blocks else []
+
+
+class FakeClientContext:
+    """ A container of one partition key range holding `documents`, with no changes. """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.changes = []
+        self.etag = 1
+        self.last_response_headers = None
+
+    def _ReadPartitionKeyRanges(self, collection_link):
+        return [dict(id="0")]
+
+    def QueryItemsPage(self, collection_link, query=None, options=None, partition_key_range_id=None):
+        return list(self.documents), {}
+
+    def QueryItemsChangeFeed(self, collection_link, options=None):
+        changes, self.changes = self.changes, []
+        self.etag += bool(changes)
+        return _ChangeFeed(self, changes)
+
+
+class FakeContainer:
+    collection_link = "dbs/db/colls/coll"
+
+    def __init__(self, documents):
+        self.client_context = FakeClientContext(documents)
+
+    def _partition_key_of(self, document):
+        return document["pk"]
+
+    def _item(self, headers, document):
+        return document
+
+    def get_item(self, id, partition_key=None):
+        raise AssertionError("read from the container")
+
+    def query_items(self, query, parameters=None):
+        raise AssertionError("queried the container")
+
+
+@pytest.fixture
+def replica():
+    with LocalReplica(FakeContainer(DOCUMENTS), start=False) as replica:
+        replica.bootstrap()
+        yield replica
+
+
+def ids(replica, condition, **parameters):
+    return sorted(
+        document["id"]
+        for document in replica.query_items(
+            f"SELECT * FROM c WHERE {condition}",
+            [dict(name=f"@{name}", value=value) for name, value in parameters.items()],
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "condition, expected",
+    [
+        # Values of different types don't compare: there is no conversion between them
+        ("c.value > 5", ["number"]),
+        ("c.value = 10", ["number"]),
+        ("c.value = '10'", ["string"]),
+        ("c.value >= '1'", ["string"]),
+        ("c.flag = 1", ["number"]),
+        ("c.flag = true", ["true"]),
+        ("c.value = true", ["true"]),
+        # null only equals null, and a missing property is undefined rather than null
+        ("c.value = null", ["null"]),
+        ("c.value != null", []),
+        ("IS_NULL(c.value)", ["null"]),
+        ("IS_DEFINED(c.value)", ["null", "number", "string", "true"]),
+        # A comparison of values of different types is undefined, and so is its negation
+        ("NOT (c.value > 5)", []),
+        ("NOT (c.value = 11)", ["number"]),
+        ("c.value IN (10, 'x')", ["number"]),
+        ("c.value NOT IN (11, 12)", ["number"]),
+        ("c.value", ["true"]),
+        ("ARRAY_CONTAINS(c.tags, 1)", ["number"]),
+        ("ARRAY_CONTAINS(c.tags, '1')", ["string"]),
+        ("STARTSWITH(c.value, '1')", ["string"]),
+        ("LENGTH(c.value) = 2", ["string"]),
+        ("LOWER(c.flag) = '1'", ["string"]),
+    ],
+)
+def test_comparisons_follow_cosmos_types(replica, condition, expected):
+    assert ids(replica, condition) == expected
+
+
+def test_parameters_are_compared_by_type(replica):
+    assert ids(replica, "c.value = @value", value=10) == ["number"]
+    assert ids(replica, "c.value = @value", value="10") == ["string"]
+    assert ids(replica, "c.flag = @flag", flag=True) == ["true"]
+    assert ids(replica, "c.value = @value", value=None) == ["null"]
+
+
+def test_resync_reads_from_the_container_until_loaded_again(replica):
+    container = replica.container
+    reads = []
+
+    def scan(*args, **kwargs):
+        # Reads made while the replica is being loaded again
+        reads.append(replica.staleness)
+        replica.sync()
+        reads.append(replica.staleness)
+        return list(DOCUMENTS), {}
+
+    container.client_context.QueryItemsPage = scan
+    assert replica.resync() == len(DOCUMENTS)
+    assert reads == [None, None]
+    assert replica.staleness is not None
+
+
+class _Gone(Exception):
+    status_code = 410
+    sub_status = 1002
+
+
+def test_failed_sync_reads_from_the_container(replica):
+    client_context = replica.container.client_context
+    read_changes = client_context.QueryItemsChangeFeed
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("unavailable")
+
+    client_context.QueryItemsChangeFeed = unavailable
+    with pytest.raises(ConnectionError):
+        replica.sync()
+    with pytest.raises(AssertionError, match="read from the container"):
+        replica.get_item("number")
+    client_context.QueryItemsChangeFeed = read_changes
+    replica.sync()
+    assert replica.get_item("number")["value"] == 10
+
+
+def test_split_range_is_followed_on_its_children(replica):
+    client_context = replica.container.client_context
+    read_changes = client_context.QueryItemsChangeFeed
+    continuation = replica._continuations["0"]
+    requested = []
+
+    def split(collection_link, options=None):
+        requested.append((options["partitionKeyRangeId"], options.get("continuation")))
+        if options["partitionKeyRangeId"] == "0":
+            raise _Gone()
+        return read_changes(collection_link, options)
+
+    client_context.QueryItemsChangeFeed = split
+    client_context._ReadPartitionKeyRanges = lambda collection_link: [
+        dict(id="1", parents=["0"]),
+        dict(id="2", parents=["0"]),
+    ]
+    client_context.changes = [dict(id="new", pk="c", _ts=2)]
+    assert replica.sync() == 1
+    assert requested == [("0", continuation), ("1", continuation), ("2", continuation)]
+    assert sorted(replica._continuations) == ["1", "2"]
+    assert replica.get_item("new")["pk"] == "c"